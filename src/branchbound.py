@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+    File name: branchbound.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 27/01/2019
+    Date last modified: 28/01/2019
+    Python Version: 3.5
+"""
+
+import glob
+import sqlite3
+import random as rnd
+import numpy as np
+import objective
+from simulation import simulate_protocol
+from resultdb import Columns, Unfinished
+
+
+def bounded_losses(simulate_traces, protocol_type, nrconfigs, bound=None, order=None):
+    """
+    Compute the absolute errors of K configurations neuron by neuron, and stop simulating a configuration as soon as the
+    sum of its squared errors exceeds the bound. The remaining neurons cannot lower that partial sum, which is thus a
+    lower bound of the loss of the configuration.
+    :param simulate_traces: function simulating a list of traces for a list of configuration indexes, and returning
+    the plasticities as a sequence (over traces) of sequences (over configurations)
+    :param protocol_type: protocol that is being simulated
+    :param nrconfigs: number of configurations K
+    :param bound: loss above which a configuration is abandoned (None to simulate all traces)
+    :param order: order in which the neurons are simulated (see learned_order)
+    :return: array of shape (K, number of neurons) with the absolute errors and array of shape (K, number of traces)
+    with the plasticities (both nan where not simulated), and boolean array telling for each configuration whether all
+    neurons were simulated
+    """
+
+    neurons = objective.NeuronTraces[protocol_type[:10]]
+    if order is None:
+        order = range(len(neurons))
+
+    plasticities = np.full((nrconfigs, objective.nr_traces(protocol_type)), np.nan)
+    errors = np.full((nrconfigs, len(neurons)), np.nan)
+    partial = np.zeros(nrconfigs)
+    active = np.arange(nrconfigs)
+    for n in order:
+
+        # Errors of the neuron for the configurations that are still below the bound
+        traces = [t for t, _ in neurons[n]]
+        plasticities[np.ix_(active, traces)] = np.transpose(simulate_traces(traces, list(active)))
+        errors[active, n] = objective.differences(plasticities[active], protocol_type)[:, n]
+        partial[active] += errors[active, n] ** 2
+
+        if bound is not None:
+            active = active[partial[active] <= bound]
+        if len(active) == 0:
+            break
+
+    return errors, plasticities, ~np.any(np.isnan(errors), axis=1)
+
+
+def database_configurations(db_names, table_name, parameters, set_param, nrsamples=50):
+    """
+    Draw parameter configurations whose losses were completely computed from result databases.
+    :param db_names: list of paths of the sqlite result databases
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param parameters: dictionary of parameters shared by all configurations (rule, veto, w_init, ...)
+    :param set_param: function transforming the name and grid index of a parameter to its value
+    :param nrsamples: maximal number of configurations to draw
+    :return: list of dictionaries of parameters
+    """
+
+    # Databases are opened read-only, since they may be written by running jobs
+    rows = []
+    for db_name in db_names:
+        db = sqlite3.connect('file:{}?mode=ro'.format(db_name), uri=True)
+        db.row_factory = sqlite3.Row
+        if db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
+            rows += [dict(row) for row in db.execute('SELECT * FROM ' + table_name)
+                     if row['l2'] is not None and row['l2'] < Unfinished and not dict(row).get('lb')]
+        db.close()
+
+    rows = rnd.sample(rows, min(nrsamples, len(rows)))
+    configurations = []
+    for row in rows:
+        pmts = dict(parameters)
+        for pname, column in Columns.items():
+            if row.get(column) is not None:
+                pmts[pname] = set_param(pname, row[column])
+        configurations.append(pmts)
+
+    return configurations
+
+
+def discriminative_order(protocol_type, configurations):
+    """
+    Order the neurons such that the ones most likely to push the loss of a configuration above the bound are
+    simulated first. Neurons are ranked by their average share of the loss of the configurations, per simulated trace.
+    :param protocol_type: protocol that is being simulated
+    :param configurations: list of dictionaries of parameters of typical configurations
+    :return: list of neuron indexes
+    """
+
+    neurons = objective.NeuronTraces[protocol_type[:10]]
+
+    shares = np.zeros(len(neurons))
+    for pmts in configurations:
+        p = simulate_protocol(protocol_type[:10], pmts, objective.nr_traces(protocol_type), 'numpy')
+        squares = objective.differences(p, protocol_type) ** 2
+        if np.sum(squares) > 0:
+            shares += squares / np.sum(squares)
+    shares /= np.array([len(traces) for traces in neurons])
+
+    return [int(n) for n in np.argsort(-shares, kind='stable')]
+
+
+def learned_order(protocol_type, pattern, table_name, parameters, set_param, nrsamples=50):
+    """
+    Learn the order in which to simulate the neurons from the configurations of existing result databases.
+    :param protocol_type: protocol that is being simulated
+    :param pattern: glob pattern of the paths of the result databases
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param parameters: dictionary of parameters shared by all configurations (rule, veto, w_init, ...)
+    :param set_param: function transforming the name and grid index of a parameter to its value
+    :param nrsamples: maximal number of configurations to simulate
+    :return: list of neuron indexes (in the default order if no configuration was found)
+    """
+
+    configurations = database_configurations(sorted(glob.glob(pattern)), table_name, parameters, set_param, nrsamples)
+    if len(configurations) == 0:
+        return list(range(len(objective.NeuronTraces[protocol_type[:10]])))
+
+    return discriminative_order(protocol_type, configurations)
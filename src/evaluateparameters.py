@@ -5,10 +5,12 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 27/12/2018
-    Date last modified: 04/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
+import objective
+import paramspace
 from simulation import *
 
 Bparams = {'PlasticityRule': 'Claire',
@@ -94,39 +96,15 @@ Lparams2 = {'PlasticityRule': 'Claire',
 
 def set_param(pname, index, plas='Claire_noveto'):
     """
-    This function will either transform the given index to the corresponding parameter value or sample an index in the
-    right parameter range to produce a randomly sampled value for the desired parameter.
+    This function will transform the given index to the corresponding parameter value, on the grid centered on the first
+    fit of the Letzkus protocol (see paramspace.py).
     :param pname: Name of the parameter to set
     :param index: Index of the parameter value
     :param plas: Type of plasticity rule used
     :return: return the value for desired parameter to set
     """
 
-    if plas == 'Claire_noveto':
-        if pname in ['Theta_high', 'Theta_low']:
-            return (-5 + 5 * index) * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return 10 ** (index - 6)
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x']:
-            return 3 ** (index - 1) * b2.ms
-        else:
-            raise ValueError(pname)
-    elif plas == 'Claire_veto':
-
-        cbest = {'A_LTD': 0.0001872, 'A_LTP': 0.00003933, 'Theta_low': 4.886 * b2.mV, 'Theta_high': 26.04 * b2.mV,
-                 'b_theta': 9999., 'tau_theta': 32.13 * b2.ms, 'tau_lowpass1': 77.17 * b2.ms,
-                 'tau_lowpass2': 2.001 * b2.ms, 'tau_x': 20.89 * b2.ms}
-
-        if pname in ['Theta_high', 'Theta_low']:
-            return cbest[pname] + 8 * index * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return cbest[pname] * 10 ** index
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'tau_theta', 'b_theta']:
-            return cbest[pname] * 4 ** index
-        else:
-            raise ValueError(pname)
-    else:
-        raise ValueError(plas)
+    return paramspace.set_param(pname, index, plas, 'Letzkus_first')
 
 
 if __name__ == "__main__":
@@ -136,12 +114,8 @@ if __name__ == "__main__":
 
     # Initialize some specifics
     if protocol is 'Brandalise':
-        nrtraces = 24
-        repets = 60
         parameters = Bparams2
     elif protocol is 'Letzkus':
-        nrtraces = 9
-        repets = 150
         if False:
             parameters = Lparams2
         else:
@@ -161,33 +135,21 @@ if __name__ == "__main__":
                 parameters[param_name] = set_param(param_name, indexes[param_name], pl)
     else:
         raise ValueError(protocol)
+    nrtraces = objective.nr_traces(protocol)
     p = [0] * nrtraces
 
     # Simulate for all available traces of the corresponding protocol
     for t in range(nrtraces):
         p[t], _ = simulate(protocol, t, parameters, debug=False)
 
-    if protocol is 'Brandalise':
-        p = [repets * p[0], 38 * p[1] + 22 * p[2], repets * p[3], 40 * p[4] + 20 * p[5], repets * p[6], repets * p[7],
-             45 * p[8] + 15 * p[9], repets * p[10], repets * p[11], repets * p[12], 41 * p[13] + 19 * p[14],
-             repets * p[15], repets * p[16], 44 * p[17] + 16 * p[18], repets * p[19], repets * p[20],
-             45 * p[21] + 15 * p[22], repets * p[23]]
-        target = [100, 144.8, 96.6, 122, 101.4, 95.5, 128.7, 101.1, 94.5,
-                  100, 131, 96.6, 100, 119.3, 104.5, 104.3, 40, 40]
-    else:
-        p = [repets * pl for pl in p]
-        target = [92, 129, 90, 100, 118, 100, 137, 85, 100, 78]
-
-    d = [0] * len(target)
-    for t in range(len(p)):
-        plast = 100 * (1 + p[t])
-        d[t] = abs(target[t] - plast)
-        print("Trace {} has plasticity: {} and difference: {}".format(t, plast, d[t]))
-    print("L-infinity is {}".format(max(d)))
-    if protocol is 'Letzkus':
-        print("L2 is {}".format(sum([dif ** 2 for dif in d])))
-    elif protocol is 'Brandalise':
-        print("L2 is {}".format(100 * sum([d[t] ** 2 for t in range(len(d) - 2)])
-                                + 25 * sum([d[-t] ** 2 for t in range(1, 3)])))
-
-    print(d)
+    # Score the parameters as the parameter searches do
+    plasticities = objective.neuron_plasticities(p, protocol)
+    d = objective.differences(p, protocol)
+    for n in range(len(d)):
+        print("Neuron {} has plasticity: {} and difference: {}".format(n, plasticities[n], d[n]))
+    li, l2 = objective.losses(d)
+    print("L-infinity is {}".format(li))
+    print("L2 is {}".format(l2))
+    print("Weighted L2 is {}".format(objective.losses(d, objective.EvaluationWeights[protocol])[1]))
+
+    print(list(d))
@@ -5,326 +5,515 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 16/01/2010
-    Date last modified: 17/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
 import sys
-import math
+import json
+import hashlib
 import dataset
 import warnings
 from simulation import *
+import objective
+from screening import screening_cut, online_screening_cut
+from branchbound import bounded_losses, learned_order
+import paramspace
+from paramspace import set_param
+import searchspace
+import resultdb
 
-warnings.filterwarnings("error")
+# Screening losses of all configurations screened by this job (see screening.screening_cut)
+ScreenedLosses = []
 
+# Maximal number of configurations simulated at once by the batched engines
+ChunkSize = 1024
 
-def set_param(pname, index, plas='Claire_noveto', prot='Letzkus'):
-    """
-    This function will either transform the given index to the corresponding parameter value or sample an index in the
-    right parameter range to produce a randomly sampled value for the desired parameter.
-    :param pname: Name of the parameter to set
-    :param index: Index of the parameter value
-    :param plas: Type of plasticity rule used
-    :param prot: protocol that is being simulated
-    :return: return the value for desired parameter to set
-    """
+# Parameters whose change invalidates the low-pass filtered traces cached by the numpy engine, which are varied slowest
+SlowParameters = ['tau_lowpass1', 'tau_lowpass2']
 
-    # Get optimal parameters that will be used as center to get the surrounding to grid search
-    if prot == 'Letzkus':
-        if plas == 'Claire_noveto':
-            raise NotImplementedError
-        elif plas == 'Claire_veto':
-            cbest = {'A_LTD': 0.00017497, 'A_LTP': 0.0000392, 'Theta_low': 5.19687991 * b2.mV, 'b_theta': 9991.2109,
-                     'Theta_high': 25.7159892 * b2.mV, 'tau_theta': 26.7646283 * b2.ms, 'tau_x': 21.8613168 * b2.ms,
-                     'tau_lowpass1': 70.4876245 * b2.ms, 'tau_lowpass2': 2.00056053 * b2.ms}
+# Loss above which the simulation of a configuration is abandoned (None for no pruning), which is lowered to the best
+# complete loss found by the job, and order in which the neurons are simulated (see branchbound.bounded_losses)
+Pruning = {'bound': None, 'order': None}
 
-        else:
-            raise ValueError(plas)
-    elif prot == 'Brandalise':
-        if plas == 'Claire_noveto':
-            raise NotImplementedError
-        elif plas == 'Claire_veto':
-            cbest = {'A_LTD': 0.099763602, 'A_LTP': 0.01505758, 'Theta_low': 2.927871397 * b2.mV,
-                     'Theta_high': 12.12886953 * b2.mV, 'b_theta': 942.1754017, 'tau_theta': 114.6026989 * b2.ms,
-                     'tau_lowpass1': 63.79366 * b2.ms, 'tau_lowpass2': 2.853035054 * b2.ms, 'tau_x': 4.990562943*b2.ms}
-        else:
-            raise ValueError(plas)
-    elif prot == 'Brandaliseb':
-        if plas == 'Claire_noveto':
-            raise NotImplementedError
-        elif plas == 'Claire_veto':
-            cbest = {'A_LTD': 0.099761303, 'A_LTP': 0.013652842, 'Theta_low': 2.636491402 * b2.mV,
-                     'Theta_high': 12.20124861 * b2.mV, 'b_theta': 2.114599383, 'tau_theta': 75.72422075 * b2.ms,
-                     'tau_lowpass1': 74.55801316*b2.ms, 'tau_lowpass2': 2.786924509*b2.ms, 'tau_x': 5.12639093*b2.ms}
-        else:
-            raise ValueError(plas)
-    else:
-        raise ValueError(prot)
-
-    # Compute parameter value from index
-    if plas == 'Claire_noveto':
-        if pname in ['Theta_high', 'Theta_low']:
-            return (-5 + 5 * index) * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return 10 ** (index - 6)
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x']:
-            return 3 ** (index - 1) * b2.ms
-        else:
-            raise ValueError(pname)
-    elif plas == 'Claire_veto':
-        if pname in ['Theta_high', 'Theta_low']:
-            return cbest[pname] + 8 * index * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return cbest[pname] * 10 ** index
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'tau_theta', 'b_theta']:
-            return cbest[pname] * 4 ** index
-        else:
-            raise ValueError(pname)
+# Tables of the result database in which a job checkpoints the linear position on its grid of the first configuration
+# it has not started yet, and the ranges of linear positions it has started but not finished yet (see checkpoint)
+CursorTable = 'cursor'
+InflightTable = 'inflight'
+
+warnings.filterwarnings("error")
 
 
-def init_params(granularity, split, table_name, plasticity, veto, jid):
+def init_params(granularity, split, table_name, plasticity, veto, jid, nrjobs=None, last=()):
     """
-    Initialize objects that will be necessary for the monte carlo parameter optimization and are specific to the desired
-    specifics of the simulation.
+    Initialize objects that will be necessary for the grid search and are specific to the desired specifics of the
+    simulation. The search space of each rule and granularity, and the parameters fixed in each job, are specified in
+    searchspace.json.
     :param granularity: int describing how fine the param search will be (Note: the range is also decreased for that)
     :param split: bool whether or not to split the search grid dependening on the job id
     :param table_name: name of the database table, which also specifies the plasticity rule used
     :param plasticity: type of plasticity (Claire, Clopath)
     :param veto: whether or not to sue veto
     :param jid: id of the job on which this program is running (only useful in case of split)
-    :return: list of names (keys) of the parameters to fit, dictionaries of the indexes and of the actual values of the
-    parameters to start with, boundaries of the index grid to use for the search.
-    """
-
-    # Make list of parameters to fit and initialization of parameters object with those that don't need fitting
-    if split:
-        if table_name == 'Claire_noveto':
-            if granularity == 0:
-                # List of parameters to fit
-                param_names = ['A_LTP', 'A_LTD', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-
-                # Compute set parameter indexes
-                itl = jid % 9
-                ith = int(math.floor(float(jid) / 9.))
-                indexes = {'Theta_high': ith, 'Theta_low': itl}
-
-                # Compute set parameter values
-                tl = set_param('Theta_low', itl, table_name)
-                th = set_param('Theta_high', ith, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'Theta_high': th, 'Theta_low': tl}
-            elif granularity == 1:
-                # List of parameters to fit
-                param_names = ['Theta_high', 'A_LTP', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-
-                # Compute set parameter indexes
-                itl = (jid % 13) * 0.5 + 2
-                iad = int(math.floor(float(jid) / 13.) + 1)
-                indexes = {'Theta_low': itl, 'A_LTD': iad}
-
-                # Compute set parameter values
-                tl = set_param('Theta_low', itl, table_name)
-                ad = set_param('A_LTD', iad, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'Theta_low': tl, 'A_LTD': ad}
-            else:
-                raise ValueError(granularity)
-        elif table_name == 'Claire_veto':
-
-            # List of parameters to fit
-            param_names = ['Theta_high', 'Theta_low', 'tau_lowpass1', 'tau_lowpass2', 'tau_x', 'b_theta', 'tau_theta']
-
-            if granularity == 1:
-
-                # Compute set parameter indexes
-                iap = (jid % 9) * 0.5 - 2
-                iad = math.floor(float(jid) / 9.) * 0.5 - 2
-                indexes = {'A_LTP': iap, 'A_LTD': iad}
-
-                # Compute set parameter values
-                ap = set_param('A_LTP', iap, table_name)
-                ad = set_param('A_LTD', iad, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'A_LTP': ap, 'A_LTD': ad}
-
-            elif granularity == 3:
-
-                # Compute set parameter indexes
-                iap = (jid % 5) * 0.125 - 0.25
-                iad = math.floor(float(jid) / 5.) * 0.125 - 0.25
-                indexes = {'A_LTP': iap, 'A_LTD': iad}
-
-                # Compute set parameter values
-                ap = set_param('A_LTP', iap, table_name)
-                ad = set_param('A_LTD', iad, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'A_LTP': ap, 'A_LTD': ad}
-            else:
-                raise NotImplementedError
-        else:
-            raise NotImplementedError(table_name)
-    else:
-        # List of parameters to fit
-        param_names = ['Theta_high', 'Theta_low', 'A_LTP', 'A_LTD', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-        if table_name == 'Claire_veto':
-            param_names += ['b_theta', 'tau_theta']
+    :param nrjobs: number of jobs among which the grid is split (None for one job per block of the specification)
+    :param last: names of the parameters scored analytically, which are fixed last if the blocks of the specification
+    are too coarse for the jobs
+    :return: list of names (keys) of the parameters to fit, list of the dictionaries of the indexes and of the actual
+    values of the parameters to start with in each block of the grid searched by the job, boundaries of the index grid
+    to use for the search.
+    """
 
-        # Initialize parameters not needing fitting
+    space, param_names, blocks = searchspace.job_blocks('gridsearch', table_name, granularity, jid, nrjobs, split, last,
+                                                        searchspace.block_cost(table_name, last))
+    if space['step'] != 0.5 ** granularity:
+        raise ValueError(space['step'])
+
+    # Specifications of the search grid depending on the search granularity
+    grid_params = {p[0]: p[1:] for p in space['parameters']}
+
+    # Initialize parameters not needing fitting, parameters fixed in the block and parameters to fit
+    starts = []
+    for block in blocks:
+        indexes = dict(block)
         parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5}
+        for param_name in param_names:
+            indexes[param_name] = grid_params[param_name][0]
+        for param_name in indexes:
+            parameters[param_name] = set_param(param_name, indexes[param_name], table_name)
+        starts.append((indexes, parameters))
 
-        # Initialize dictionary for parameter indexes
-        indexes = {}
+    return param_names, starts, grid_params
 
-    # Specifications of the search grid depending on the search granularity
-    if table_name == 'Claire_noveto':
-        if granularity == 0:
-            grid_params = {'Theta_high': [1, 8], 'Theta_low': [1, 8], 'A_LTP': [1, 7], 'A_LTD': [1, 7],
-                           'tau_lowpass1': [1, 6], 'tau_lowpass2': [1, 6], 'tau_x': [1, 6]}
-
-        elif granularity == 1:
-            grid_params = {'Theta_high': [3, 7], 'Theta_low': [2, 8], 'A_LTP': [-1, 7], 'A_LTD': [1, 7],
-                           'tau_lowpass1': [1, 6], 'tau_lowpass2': [1, 4], 'tau_x': [1, 8]}
-        else:
-            raise NotImplementedError
-    elif table_name == 'Claire_veto':
-
-        if granularity == 1:
-            grid_params = {'Theta_high': [-1.5, 1], 'Theta_low': [-0.5, 1.5], 'A_LTP': [-2, 2], 'A_LTD': [-2, 2],
-                           'tau_lowpass1': [-1, 0.5], 'tau_lowpass2': [-0.5, 1], 'tau_x': [-1, 1],
-                           'b_theta': [-1, 0.5], 'tau_theta': [-1, 0.5]}
-        elif granularity == 3:
-            grid_params = {'Theta_high': [-0.25, 0.25], 'Theta_low': [-0.25, 0.25], 'A_LTP': [-0.25, 0.25],
-                           'A_LTD': [-0.25, 0.25], 'tau_lowpass1': [-0.25, 0.25], 'tau_lowpass2': [-0.25, 0.25],
-                           'tau_x': [-0.25, 0.25], 'b_theta': [-0.25, 0.25], 'tau_theta': [-0.25, 0.25]}
-        else:
-            raise NotImplementedError
+
+def is_simulated(table, idxs, veto):
+    """
+    Check whether a parameter configuration was already simulated and stored in the result table.
+    :param table: database table containing the simulation results
+    :param idxs: dictionary of indexes describing the position of the configuration on the grid
+    :param veto: whether or not to use veto mechanism
+    :return: True if the configuration is already in the table
+    """
+
+    if veto:
+        query = table.find_one(th=idxs['Theta_high'], tl=idxs['Theta_low'], ap=idxs['A_LTP'], ad=idxs['A_LTD'],
+                               t1=idxs['tau_lowpass1'], t2=idxs['tau_lowpass2'], tx=idxs['tau_x'],
+                               bt=idxs['b_theta'], tt=idxs['tau_theta'])
     else:
-        raise ValueError(table_name)
+        query = table.find_one(th=idxs['Theta_high'], tl=idxs['Theta_low'], ap=idxs['A_LTP'], ad=idxs['A_LTD'],
+                               t1=idxs['tau_lowpass1'], t2=idxs['tau_lowpass2'], tx=idxs['tau_x'])
+
+    return query is not None
+
+
+def grid_layout(param_names, starts, granularity):
+    """
+    :param param_names: list of the names of the parameters to vary, the first one varying slowest
+    :param starts: list of (indexes, parameters) of each block of the job (see init_params)
+    :param granularity: int describing how fine the param search will be
+    :return: string identifying the order in which the job enumerates its configurations, such that a cursor is only
+    resumed by a job enumerating them identically
+    """
+
+    layout = [param_names, [sorted(indexes.items()) for indexes, _ in starts], 0.5 ** granularity]
+
+    return hashlib.md5(json.dumps(layout).encode()).hexdigest()
 
-    # Initialize parameter indices and values according to desired grid design and specfic granularity
-    for param_name in param_names:
-        indexes[param_name] = grid_params[param_name][0]
-        parameters[param_name] = set_param(param_name, indexes[param_name], table_name)
 
-    return param_names, indexes, parameters, grid_params
+def load_cursor(database, table_name, layout):
+    """
+    :param database: database containing the simulation results of the job
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param layout: order in which the job enumerates its configurations (see grid_layout)
+    :return: linear position of the first configuration the job has not started yet and list of the (first, last)
+    linear positions of the ranges of configurations it has started but not finished (None and [] if no cursor was
+    checkpointed for that layout)
+    """
+
+    cursor = database[CursorTable].find_one(tab=table_name)
+    if cursor is None or cursor['layout'] != layout:
+        return None, []
+    inflight = [(row['first'], row['last']) for row in database[InflightTable].find(tab=table_name)]
+
+    return cursor['position'], inflight
+
+
+def checkpoint(database, table_name, position, inflight, layout=None):
+    """
+    Persist the progress of the job, such that it can resume from there after a restart. Must be called within the
+    transaction writing the results of the job (see resultdb.ResultWriter).
+    :param database: database containing the simulation results of the job
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param position: linear position of the first configuration the job has not started yet
+    :param inflight: list of the (first, last) linear positions of the ranges of configurations started but not finished
+    :param layout: order in which the job enumerates its configurations (None to keep the one of the cursor)
+    """
+
+    cursor = dict(tab=table_name, position=int(position))
+    if layout is not None:
+        cursor['layout'] = layout
+    database[CursorTable].upsert(cursor, ['tab'])
+    database[InflightTable].delete(tab=table_name)
+    for first, last in inflight:
+        database[InflightTable].insert(dict(tab=table_name, first=int(first), last=int(last)))
+
+
+def store_configurations(table, configurations, plasticities, prot, veto, screened=None, fidelity=1):
+    """
+    Compute the losses of simulated parameter configurations and insert them into the result table.
+    :param table: result table, or writer buffering its rows (see resultdb.ResultWriter), to insert results into
+    :param configurations: list of K dictionaries of indexes describing the position of the configurations on the grid
+    :param plasticities: array of shape (K, number of traces) with the simulated plasticities of all traces
+    :param prot: string describing the protocol to simulate
+    :param veto: whether or not to use veto mechanism
+    :param screened: list of losses of the configurations with the screening simulation (None if not screened)
+    :param fidelity: 1 if the plasticities come from the reference simulation, 0 if from the screening simulation
+    :return: array with the L2 loss of each configuration
+    """
+
+    # Compute errors of all configurations at once
+    plasticities = np.asarray(plasticities, dtype=float)
+    errors = objective.differences(plasticities, prot)
+
+    # Update database
+    for k in range(len(configurations)):
+        store_losses(table, configurations[k], errors[k], veto, None if screened is None else screened[k], fidelity,
+                     None, plasticities[k])
+        print('        Max Error {}'.format(max(errors[k])))
+    sys.stdout.flush()
+
+    return objective.losses(errors)[1]
+
+
+def store_losses(table, idxs, differences, veto, screened=None, fidelity=1, complete=None, plasticities=None):
+    """
+    Insert the losses of a parameter configuration into the result table.
+    :param table: result table, or writer buffering its rows (see resultdb.ResultWriter), to insert results into
+    :param idxs: dictionary of indexes describing the position of the configuration on the grid
+    :param differences: absolute errors of the neurons (nan for neurons that were not simulated)
+    :param veto: whether or not to use veto mechanism
+    :param screened: loss of the configuration with the screening simulation (None if it was not screened)
+    :param fidelity: 1 if the plasticities come from the reference simulation, 0 if from the screening simulation
+    :param complete: whether or not all neurons were simulated, the losses being lower bounds otherwise (None if the
+    simulation could not be abandoned)
+    :param plasticities: simulated plasticity of each trace, stored such that the configuration can be scored again
+    """
+
+    li, l2 = objective.losses(differences)
+    row = dict(th=idxs['Theta_high'], tl=idxs['Theta_low'], ap=idxs['A_LTP'], ad=idxs['A_LTD'],
+               t1=idxs['tau_lowpass1'], t2=idxs['tau_lowpass2'], tx=idxs['tau_x'], li=float(li), l2=float(l2))
+    if veto:
+        row['bt'] = idxs['b_theta']
+        row['tt'] = idxs['tau_theta']
+    if screened is not None:
+        row['ls'] = screened
+        row['fi'] = fidelity
+    if complete is not None:
+        row['lb'] = int(not complete)
+    if plasticities is not None:
+        row['pl'] = objective.pack_plasticities(plasticities)
+    table.insert(row)
+
+
+def store_bounded(table, configurations, simulate_traces, prot, veto, screened):
+    """
+    Simulate parameter configurations neuron by neuron until their loss exceeds the pruning bound, insert their
+    (possibly lower bounds of) losses into the result table and lower the bound to the best complete loss.
+    :param table: result table, or writer buffering its rows (see resultdb.ResultWriter), to insert results into
+    :param configurations: list of dictionaries of indexes describing the position of the configurations on the grid
+    :param simulate_traces: function simulating traces for configurations (see branchbound.bounded_losses)
+    :param prot: string describing the protocol to simulate
+    :param veto: whether or not to use veto mechanism
+    :param screened: list of losses of the configurations with the screening simulation (None if not screened)
+    """
+
+    errors, plasticities, complete = bounded_losses(simulate_traces, prot, len(configurations), Pruning['bound'],
+                                                    Pruning['order'])
+    li, l2 = objective.losses(errors)
+    for k in range(len(configurations)):
+        store_losses(table, configurations[k], errors[k], veto, screened[k], 1, bool(complete[k]), plasticities[k])
+        if complete[k]:
+            Pruning['bound'] = min(Pruning['bound'], float(l2[k]))
+
+        print('        Max Error {}{}'.format(li[k], '' if complete[k] else ' (abandoned)'))
+    sys.stdout.flush()
 
 
-def gridrecursion(pi, pnames, indexes, grid_params, parameters, granularity, plas, nrp, table, database, nrtraces,
-                  nrneurons, repets, prot, targets, nr, veto, catching_up):
+def analytic_parameters(plasticity, veto):
     """
-    Recursive function to loop each parameter to vary along it grid search values.
-    :param pi: int describing which parameter of the variable parameter list we are currently varying
+    Parameters that can be scored analytically by the numpy engine once all other parameters are fixed. Without veto,
+    the plasticity is linear in the amplitudes, and with the Claire rule the integrals of all thresholds of the grid can
+    be swept at once.
+    :param plasticity: type of plasticity (Claire, Clopath)
+    :param veto: whether or not to use veto mechanism
+    :return: list of parameter names, in the order in which they must be varied
+    """
+
+    if veto:
+        return []
+    elif plasticity == 'Claire':
+        return ['Theta_high', 'Theta_low', 'A_LTP', 'A_LTD']
+    else:
+        return ['A_LTP', 'A_LTD']
+
+
+def chunk_columns(parameters, pnames, indexes, plas):
+    """
+    Unitless parameter columns of a chunk of configurations, which can directly be fed to the batched engines.
+    :param parameters: dictionary of values of the parameters shared by all configurations of the chunk
     :param pnames: list of variable parameters
-    :param indexes: dictionary of indexes describing the position of the current parameters on the grid
-    :param grid_params: dictionary of boundaries of the grid for each parameter
-    :param parameters: dictionary of values of the parameters
-    :param granularity: int describing how fine the param search will be (Note: the range is also decreased for that)
+    :param indexes: array of shape (number of configurations, number of variable parameters) with their grid indexes
     :param plas: Type of plasticity rule used
-    :param nrp: number of parameters that are varied in this program of grid search
-    :param table: database table to update simulation results into
-    :param database: database to commit simulation results into
+    :return: dictionary of unitless values (floats for shared parameters and arrays for variable ones)
+    """
+
+    columns = numpysim.strip_units(parameters)
+    for d in range(len(pnames)):
+        columns[pnames[d]] = paramspace.values(pnames[d], indexes[:, d], plas)
+
+    return columns
+
+
+def chunk_subset(columns, ks):
+    """
+    :param columns: dictionary of parameter columns of a chunk of configurations (see chunk_columns)
+    :param ks: list of positions of configurations in the chunk
+    :return: dictionary of the parameter columns of those configurations only
+    """
+
+    return {name: value[ks] if isinstance(value, np.ndarray) else value for name, value in columns.items()}
+
+
+def analytic_chunk(anames, configurations, columns, table, nrtraces, prot, veto):
+    """
+    Score the configurations of a chunk sharing all parameters but the ones that can be handled analytically (see
+    analytic_parameters). A single sweep of the potentiation and depression integrals per trace is then enough to
+    compute the plasticities of all configurations.
+    :param anames: list of the analytic parameters varied in the chunk
+    :param configurations: list of dictionaries of indexes describing the position of the configurations on the grid
+    :param columns: dictionary of parameter columns of the configurations (see chunk_columns)
+    :param table: result table, or writer buffering its rows (see resultdb.ResultWriter), to insert results into
     :param nrtraces: number of traces to simulate for that protocol
-    :param nrneurons: number of neurons in this protocol
-    :param repets: number of repetitions of the protocol we need to simulate to get the target plasticity
     :param prot: string describing the protocol to simulate
-    :param targets: list of target plasticities to compute losses
-    :param nr: The number of parameter configurations already simulated by the grid search
     :param veto: whether or not to use veto mechanism
-    :param catching_up: whether or not the program is still catching up with precomputed configurations
-    :return: The updated number of parameter configurations simulated by the grid search
+    :return: array with the L2 loss of each configuration
     """
 
-    # Copy dictionaries that will be modified
-    pmts = dict(parameters)
-    idxs = dict(indexes)
+    # Parameters shared by all configurations, the analytic ones being ignored by the sweeps
+    shared = {name: value if not isinstance(value, np.ndarray) else float(value[0]) for name, value in columns.items()}
 
-    # Loop through all indexes of the current parameter to vary in the search
-    pname = pnames[pi]
-    for i in range(int((grid_params[pname][1] - grid_params[pname][0]) * 2 ** granularity + 1)):
+    if 'Theta_high' in anames or 'Theta_low' in anames:
 
-        # Update index and parameter
-        idxs[pname] = grid_params[pname][0] + i * 0.5 ** granularity
-        pmts[pname] = set_param(pname, idxs[pname], plas)
+        # Sweep the integrals of all distinct thresholds of the chunk at once
+        highs, ih = np.unique(columns['Theta_high'], return_inverse=True)
+        lows, il = np.unique(columns['Theta_low'], return_inverse=True)
+        integrals = [simulate_thresholds(prot[:10], t, shared, highs, lows) for t in range(nrtraces)]
+        plasticities = [columns['A_LTP'] * ltp[ih] - columns['A_LTD'] * ltd[il] for ltp, ltd in integrals]
 
-        ################################################################################################################
-        #  Recurse into next parameter or simulate in case you arrived at the last parameter of the list
-        ################################################################################################################
-        if pi < nrp - 1:
+    else:
+
+        # Potentiation and depression integrals of each trace (the amplitudes of parameters are ignored)
+        integrals = [simulate_integrals(prot[:10], t, [shared], shared['PlasticityRule']) for t in range(nrtraces)]
+        plasticities = [columns['A_LTP'] * ltp[0] - columns['A_LTD'] * ltd[0] for ltp, ltd in integrals]
+
+    # Compute losses and update database
+    plasticities = np.transpose([np.broadcast_to(p, (len(configurations),)) for p in plasticities])
+    return store_configurations(table, configurations, plasticities, prot, veto)
+
+
+def batched_chunk(configurations, columns, table, nrtraces, prot, veto, engine, screen):
+    """
+    Simulate a chunk of configurations with a batched engine, a single batch per trace.
+    :param configurations: list of dictionaries of indexes describing the position of the configurations on the grid
+    :param columns: dictionary of parameter columns of the configurations (see chunk_columns)
+    :param table: result table, or writer buffering its rows (see resultdb.ResultWriter), to insert results into
+    :param nrtraces: number of traces to simulate for that protocol
+    :param prot: string describing the protocol to simulate
+    :param veto: whether or not to use veto mechanism
+    :param engine: simulation backend to use ('numpy' or 'standalone')
+    :param screen: whether or not to screen configurations with a cheap simulation (see ScreeningParameters) and only
+    promote the most promising ones to the reference simulation
+    """
+
+    # Screen all configurations with the cheap simulation and only promote the most promising ones
+    rule = columns['PlasticityRule']
+    promoted = list(range(len(configurations)))
+    screened = [None] * len(configurations)
+    if screen:
+        plasticities = np.transpose([simulate_batch(prot[:10], t, columns, rule, veto, None, 'numpy',
+                                                    ScreeningParameters['method'], ScreeningParameters['timestep'])
+                                     for t in range(nrtraces)])
+        screened = list(objective.scores(plasticities, prot)[1])
+        promoted = list(screening_cut(screened, ScreeningParameters['quantile'], ScreeningParameters['threshold'],
+                                      ScreenedLosses))
+
+        # Configurations that are not promoted are stored with their screening plasticities
+        rejected = [k for k in range(len(configurations)) if k not in promoted]
+        store_configurations(table, [configurations[k] for k in rejected], plasticities[rejected], prot, veto,
+                             [screened[k] for k in rejected], 0)
+    batch = chunk_subset(columns, promoted)
+
+    # Simulate traces for the configurations whose loss is below the pruning bound
+    if len(promoted) > 0 and Pruning['bound'] is not None:
+
+        def simulate_traces(traces, active):
+            if engine == 'standalone':
+                return simulate_standalone(prot[:10], traces, chunk_subset(batch, active), rule, veto)
+            return [simulate_batch(prot[:10], t, chunk_subset(batch, active), rule, veto) for t in traces]
+
+        store_bounded(table, [configurations[k] for k in promoted], simulate_traces, prot, veto,
+                      [screened[k] for k in promoted])
 
-            # Recurse into next parameter
-            nr, catching_up = gridrecursion(pi + 1, pnames, idxs, grid_params, pmts, granularity, plas, nrp, table,
-                                            database, nrtraces, nrneurons, repets, prot, targets, nr, veto, catching_up)
+    else:
 
+        # Plasticity matrix of shape (number of traces, number of promoted configurations)
+        if len(promoted) == 0:
+            plasticities = np.zeros((nrtraces, 0))
+        elif engine == 'standalone':
+            plasticities = simulate_standalone(prot[:10], list(range(nrtraces)), batch, rule, veto)
         else:
+            plasticities = [simulate_batch(prot[:10], t, batch, rule, veto) for t in range(nrtraces)]
+
+        # Compute losses of all configurations at once and update database
+        store_configurations(table, [configurations[k] for k in promoted], np.transpose(plasticities), prot, veto,
+                             [screened[k] for k in promoted], 1)
+
+
+def single_configuration(idxs, pmts, table, nrtraces, prot, veto, engine, screen):
+    """
+    Simulate a single configuration with an engine simulating one configuration at a time.
+    :param idxs: dictionary of indexes describing the position of the configuration on the grid
+    :param pmts: dictionary of values of the parameters, with their Brian2 units
+    :param table: result table, or writer buffering its rows (see resultdb.ResultWriter), to insert results into
+    :param nrtraces: number of traces to simulate for that protocol
+    :param prot: string describing the protocol to simulate
+    :param veto: whether or not to use veto mechanism
+    :param engine: simulation backend to use ('brian2')
+    :param screen: whether or not to screen the configuration with a cheap simulation (see ScreeningParameters) and
+    only promote it to the reference simulation if promising
+    """
+
+    # Screen the configuration first if required, and only promote it if promising
+    screened = None
+    fidelity = 1
+    if screen:
+        p = list(simulate_protocol(prot[:10], pmts, nrtraces, 'numpy', ScreeningParameters['method'],
+                                   ScreeningParameters['timestep']))
+        screened = float(objective.scores(p, prot)[1])
+        fidelity = int(online_screening_cut(screened, ScreenedLosses, ScreeningParameters['quantile'],
+                                            ScreeningParameters['threshold']))
 
-            # Check whether this parameter configuration was already simulated.
-            if catching_up:
-                if veto:
-                    query = table.find_one(th=idxs['Theta_high'], tl=idxs['Theta_low'], ap=idxs['A_LTP'],
-                                           ad=idxs['A_LTD'], t1=idxs['tau_lowpass1'], t2=idxs['tau_lowpass2'],
-                                           tx=idxs['tau_x'], bt=idxs['b_theta'], tt=idxs['tau_theta'])
-                else:
-                    query = table.find_one(th=idxs['Theta_high'], tl=idxs['Theta_low'], ap=idxs['A_LTP'],
-                                           ad=idxs['A_LTD'], t1=idxs['tau_lowpass1'], t2=idxs['tau_lowpass2'],
-                                           tx=idxs['tau_x'])
+    # Simulate traces one at a time until the loss exceeds the pruning bound, or all at once
+    if fidelity == 1 and Pruning['bound'] is not None:
 
-                if query is None:
-                    catching_up = False
+        def simulate_traces(traces, _):
+            return [[simulate(prot[:10], t, pmts, engine=engine)[0]] for t in traces]
 
-            ############################################################################################################
-            #  Simulate plasticities (We arrived at the last parameter to recurse into)
-            ############################################################################################################
+        store_bounded(table, [idxs], simulate_traces, prot, veto, [screened])
+    else:
+        if fidelity == 1:
+            p = list(simulate_protocol(prot[:10], pmts, nrtraces, engine))
+
+        # Compute losses and update database
+        store_configurations(table, [idxs], [p], prot, veto, [screened], fidelity)
 
-            if not catching_up:
 
-                print('Configuration: {}'.format(nr))
+def gridwalk(pnames, indexes, grid_params, parameters, granularity, plas, table, writer, nrtraces, prot, nr, veto,
+             catching_up, engine='brian2', screen=False, start=0, stop=None):
+    """
+    Simulate the configurations of a block of the grid chunk by chunk, enumerated in mixed-radix order with the first
+    parameter varying slowest (see searchspace.grid_chunks).
+    :param pnames: list of variable parameters
+    :param indexes: dictionary of indexes of the parameters shared by all configurations of the block
+    :param grid_params: dictionary of boundaries of the grid for each parameter
+    :param parameters: dictionary of values of the parameters shared by all configurations of the block
+    :param granularity: int describing how fine the param search will be (Note: the range is also decreased for that)
+    :param plas: Type of plasticity rule used
+    :param table: database table containing the simulation results
+    :param writer: writer buffering the rows of the result table (see resultdb.ResultWriter)
+    :param nrtraces: number of traces to simulate for that protocol
+    :param prot: string describing the protocol to simulate
+    :param nr: The number of parameter configurations of the blocks searched before this one
+    :param veto: whether or not to use veto mechanism
+    :param catching_up: whether or not the program is still catching up with configurations that were started before a
+    restart, and may thus already be in the table
+    :param engine: simulation backend to use ('brian2', 'numpy' or 'standalone')
+    :param screen: whether or not to screen configurations with a cheap simulation (see ScreeningParameters) and only
+    promote the most promising ones to the reference simulation
+    :param start: linear position in the block of the first configuration to simulate
+    :param stop: linear position in the block after the last configuration to simulate (None for the whole block)
+    :return: The number of parameter configurations of the blocks up to this one, and whether or not the program is
+    still catching up
+    """
 
-                # Initialize plasticity array
-                p = [0] * nrtraces
+    step = 0.5 ** granularity
+    shape = searchspace.grid_shape(pnames, grid_params, step)
+
+    # Trailing parameters are scored analytically if possible (at a lower cost than any screening simulation), once
+    # per combination of the other parameters
+    analytic = analytic_parameters(parameters['PlasticityRule'], veto)
+    anames = []
+    if engine == 'numpy':
+        while len(anames) < len(pnames) and pnames[len(pnames) - len(anames) - 1] in analytic:
+            anames.insert(0, pnames[len(pnames) - len(anames) - 1])
+    if len(anames) > 0:
+        chunksize = int(np.prod(shape[len(pnames) - len(anames):]))
+    elif engine in ['numpy', 'standalone']:
+        chunksize = ChunkSize
+    else:
+        chunksize = 1
+
+    for first, chunk in searchspace.grid_chunks(pnames, grid_params, step, start, stop, chunksize):
+
+        # Skip configurations that were already simulated. The rows of a chunk are not stored in linear order (e.g. the
+        # configurations rejected by the screening are stored before the promoted ones), so every configuration of a
+        # chunk started before a restart is looked up
+        last = nr + first + len(chunk)
+        configurations = [dict(indexes, **dict(zip(pnames, row))) for row in chunk.tolist()]
+        missing = list(range(len(configurations)))
+        if catching_up:
+            missing = [k for k in missing if not is_simulated(table, configurations[k], veto)]
+            catching_up = len(missing) == 0
+        if len(missing) == 0:
+            writer.set_progress(dict(position=last, inflight=[]))
+            continue
+        configurations = [configurations[k] for k in missing]
+        columns = chunk_columns(parameters, pnames, chunk[missing], plas)
+        first += nr + missing[0]
+
+        # Mark the configurations of the chunk as started until all their rows are flushed
+        writer.set_progress(dict(position=last, inflight=[(first, last)]))
 
-                # Iterate through all available traces to simulate
-                for t in range(nrtraces):
-                    # Simulate trace and store plasticity
-                    p[t], _ = simulate(prot[:10], t, pmts)
+        ################################################################################################################
+        #  Simulate plasticities
+        ################################################################################################################
 
-                ########################################################################################################
-                #  Compute losses and update database
-                ########################################################################################################
+        if len(anames) > 0:
 
-                # If Brandalise weight supralinear and linear trace plasticity contributions
-                if prot[:10] == 'Brandalise':
-                    p = [p[0], 0.78 * p[1] + 0.22 * p[2], p[3], 0.8 * p[4] + 0.2 * p[5], p[6], p[7],
-                         0.85 * p[8] + 0.15 * p[9], p[10], p[11], p[12], 0.81 * p[13] + 0.19 * p[14], p[15], p[16],
-                         0.84 * p[17] + 0.16 * p[18], p[19], p[20], 0.85 * p[21] + 0.15 * p[22], p[23]]
+            print('Configurations: {} to {}'.format(first, last - 1))
+            l2 = analytic_chunk(anames, configurations, columns, writer, nrtraces, prot, veto)
+            if Pruning['bound'] is not None:
+                Pruning['bound'] = min(Pruning['bound'], float(np.min(l2)))
 
-                # Compute errors
-                differences = [abs(targets[t] - 100 * (1 + repets * p[t])) for t in range(nrneurons)]
+        elif engine in ['numpy', 'standalone']:
 
-                # Update database
-                table.insert(dict(th=idxs['Theta_high'], tl=idxs['Theta_low'], ap=idxs['A_LTP'], ad=idxs['A_LTD'],
-                                  t1=idxs['tau_lowpass1'], t2=idxs['tau_lowpass2'], tx=idxs['tau_x'],
-                                  bt=idxs['b_theta'], tt=idxs['tau_theta'], li=max(differences),
-                                  l2=sum([d ** 2 for d in differences])))
+            print('Configurations: {} to {}'.format(first, last - 1))
+            batched_chunk(configurations, columns, writer, nrtraces, prot, veto, engine, screen)
 
-                database.commit()
+        else:
 
-                print('        Max Error {}'.format(max(differences)))
-                sys.stdout.flush()
+            print('Configuration: {}'.format(first))
+            pmts = dict(parameters)
+            for pname in pnames:
+                pmts[pname] = paramspace.quantity(pname, columns[pname][0])
+            single_configuration(configurations[0], pmts, writer, nrtraces, prot, veto, engine, screen)
 
-            nr += 1
+        writer.set_progress(dict(position=last, inflight=[]))
 
-    return nr, catching_up
+    return nr + int(np.prod(shape)), catching_up
 
 
-def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0, split=True, jid=0):
+def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0, split=True, jid=0, engine='brian2',
+         screen=False, prune=False, bound=None, nrjobs=None, background=False):
     """
 
     :param protocol_type: Whether to fit on the 'Letzkus' or 'Brandalise' voltage traces.
@@ -333,25 +522,27 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     :param granularity: int describing how fine the param search will be (Note: the range is also decreased for that)
     :param split: bool whether or not to split the search grid dependening on the job id
     :param jid: id of the job running the montecarlo search. Necessary for splitting the grid search in case of split.
+    :param engine: simulation backend to use ('brian2', 'numpy' or 'standalone')
+    :param screen: whether or not to screen configurations with a cheap simulation before the reference simulation
+    :param prune: whether or not to abandon the simulation of a configuration once its loss exceeds the best loss found
+    so far, only storing a lower bound of its loss (with lb=1)
+    :param bound: loss above which configurations are abandoned from the start if pruning (e.g. the best loss of
+    previous searches); None for no bound until a configuration is completely simulated
+    :param nrjobs: number of jobs among which the grid is split (None for one job per block of searchspace.json)
+    :param background: whether or not to write the results from a background thread (see resultdb.result_writer)
     """
 
+    # A Brian2 run costs about as much for one trace as for all, such that abandoning configurations would not pay off
+    if prune and engine == 'brian2':
+        raise ValueError("Pruning requires an engine simulating traces at a cost proportional to their number.")
+
     ####################################################################################################################
     # Define some variables depending on the protocol type
     ####################################################################################################################
 
-    if protocol_type[:10] == 'Brandalise':
-        nrtraces = 24
-        nrneurons = 18
-        repets = 60
-        targets = [100, 144.8, 96.6, 122, 101.4, 95.5, 128.7, 101.1, 94.5,
-                   100, 131, 96.6, 100, 119.3, 104.5, 104.3, 40, 40]
-    elif protocol_type is 'Letzkus':
-        nrtraces = 9
-        nrneurons = 9
-        repets = 150
-        targets = [92, 129, 90, 100, 118, 100, 137, 85, 100]
-    else:
+    if protocol_type[:10] not in objective.Targets:
         raise ValueError(protocol_type)
+    nrtraces = objective.nr_traces(protocol_type)
 
     ####################################################################################################################
     # Connect to database (Sqlite database corresponding to the plasticity model used)
@@ -366,7 +557,27 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     # Plasticity parameters initializations
     ####################################################################################################################
 
-    param_names, indexes, parameters, grid_params = init_params(granularity, split, table_name, plasticity, veto, jid)
+    # Vary parameters that can be scored analytically by the numpy engine last (and only fix them in the jobs if
+    # needed), and the time constants of the low-pass filters cached by the numpy engine first
+    analytic = analytic_parameters(plasticity, veto) if engine == 'numpy' else []
+    param_names, starts, grid_params = init_params(granularity, split, table_name, plasticity, veto, jid, nrjobs,
+                                                   analytic)
+    if engine == 'numpy':
+        param_names = [name for name in SlowParameters if name in param_names] + \
+                      [name for name in param_names if name not in analytic + SlowParameters] + \
+                      [name for name in analytic if name in param_names]
+    if len(starts) == 0:
+        print('\nNo block of the grid is assigned to this job.')
+        return 0
+
+    # Pruning bound, resuming from the best complete loss of the job, and order of the neurons learned from all results
+    if prune:
+        losses = [row['l2'] for row in the_table.all() if not row.get('lb') and row['l2'] is not None]
+        Pruning['bound'] = min(losses + [np.inf if bound is None else bound])
+        Pruning['order'] = learned_order(protocol_type, '../Data/gridresults_' + protocol_type + '_g*_j*.db',
+                                         table_name, starts[0][1],
+                                         lambda pname, index: set_param(pname, index, table_name))
+        print('Neuron order: {}'.format(Pruning['order']))
 
     print('\nInitialization completed.')
 
@@ -377,8 +588,37 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     print('\nStarting Grid Search:')
     sys.stdout.flush()
 
-    _ = gridrecursion(0, param_names, indexes, grid_params, parameters, granularity, table_name, len(param_names),
-                      the_table, db, nrtraces, nrneurons, repets, protocol_type, targets, 0, veto, True)
+    # Resume from the cursor of a previous run of the job, only checking which of the configurations it had started
+    # were finished, or catch up with its results from the start if it did not checkpoint any cursor
+    layout = grid_layout(param_names, starts, granularity)
+    resume, inflight = load_cursor(db, table_name, layout)
+    if resume is None:
+        resume, catching_up = 0, len(the_table) > 0
+        db.begin()
+        checkpoint(db, table_name, 0, [], layout)
+        db.commit()
+    else:
+        catching_up = len(inflight) > 0
+
+    # Rows are written behind the simulations, and the progress of the job is checkpointed along with them, such that
+    # the rows of a range of linear positions are only considered written once they are all flushed
+    writer = resultdb.result_writer(db, the_table, background, lambda progress: checkpoint(
+        db, table_name, progress['position'], progress['inflight']))
+    writer.set_progress(dict(position=resume, inflight=inflight))
+    resume = min([first for first, _ in inflight] + [resume])
+    print('Resuming from configuration {}'.format(resume))
+
+    # Search the blocks of the grid of the job one after the other
+    nr = 0
+    for indexes, parameters in starts:
+        size = int(np.prod(searchspace.grid_shape(param_names, grid_params, 0.5 ** granularity)))
+        if nr + size <= resume:
+            nr += size
+            continue
+        start = max(0, resume - nr)
+        nr, catching_up = gridwalk(param_names, indexes, grid_params, parameters, granularity, table_name, the_table,
+                                   writer, nrtraces, protocol_type, nr, veto, catching_up, engine, screen, start)
+    writer.flush()
 
     print('\nFinished Grid search successfully!')
 
@@ -396,13 +636,24 @@ if __name__ == "__main__":
     else:
         g = 3
 
+    # Number of jobs among which the grid is split
+    if len(sys.argv) > 3:
+        nrj = int(sys.argv[3])
+    else:
+        nrj = None
+
     # Simulation choices
     ptype = 'Brandaliseb'  # Type of protocol to use for parameter fit
     rule_name = 'Claire'  # can be either of 'Claire' or 'Clopath'
     vetoing = True  # whether or not to use a veto mechanism between LTP and LTD
+    backend = 'numpy'  # can be either of 'brian2', 'numpy' or 'standalone'
+    screening = False  # whether or not to only simulate promising configurations with the reference simulation
+    pruning = False  # whether or not to abandon configurations once their loss exceeds the best loss found so far
+    writing = False  # whether or not to write the results from a background thread
 
     # Run
-    exi = main(ptype, rule_name, veto=vetoing, granularity=g, split=True, jid=j)
+    exi = main(ptype, rule_name, veto=vetoing, granularity=g, split=True, jid=j, engine=backend, screen=screening,
+               prune=pruning, nrjobs=nrj, background=writing)
 
     if exi is 0:
         print('\nGrid search finished successfully!')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+    File name: lowpasscache.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 25/01/2019
+    Date last modified: 25/01/2019
+    Python Version: 3.5
+"""
+
+import numpy as np
+from os import makedirs
+from os.path import isfile, join
+from collections import OrderedDict
+from numpysim import lowpass
+
+
+class LowpassCache(object):
+    """
+    Cache of low-pass filtered voltage traces. The filtered traces only depend on the voltage trace and on the time
+    constant of the filter (never on thresholds or amplitudes), such that they can be shared by all the configurations
+    of a parameter search using the same time constants. Traces are kept in memory with a least recently used eviction
+    policy, and optionally saved to npy files in a directory, which is then used as a second (persistent) cache level.
+    """
+
+    def __init__(self, maxsize=128, directory=None):
+        """
+        :param maxsize: maximal number of filtered traces kept in memory
+        :param directory: directory for the on-disk cache level (None to only cache in memory)
+        """
+
+        self.maxsize = maxsize
+        self.directory = directory
+        self.traces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            makedirs(directory, exist_ok=True)
+
+    def filtered(self, protocol_type, trace_id, voltage, dt, tau):
+        """
+        Get the low-pass filtered voltage trace, computing it only if it is neither in memory nor on disk.
+        :param protocol_type: protocol from which the voltage trace comes from ('Brandalise' or 'Letzkus')
+        :param trace_id: identifier of the voltage trace within the protocol
+        :param voltage: voltage trace (only used if the filtered trace must be computed)
+        :param dt: integration timestep in seconds
+        :param tau: time constant of the filter in seconds
+        :return: read-only array with the filter state at each timestep
+        """
+
+        key = (protocol_type, trace_id, '{:.12e}'.format(dt), '{:.12e}'.format(tau))
+
+        # In memory level
+        if key in self.traces:
+            self.hits += 1
+            self.traces.move_to_end(key)
+            return self.traces[key]
+
+        # On disk level, else compute it
+        path = None if self.directory is None else join(self.directory, 'lowpass_{}_{}_{}_{}.npy'.format(*key))
+        if path is not None and isfile(path):
+            self.hits += 1
+            trace = np.load(path)
+        else:
+            self.misses += 1
+            trace = lowpass(voltage, dt, tau)
+            if path is not None:
+                np.save(path, trace)
+
+        # Store in memory and evict the least recently used traces
+        trace.flags.writeable = False
+        self.traces[key] = trace
+        while len(self.traces) > self.maxsize:
+            self.traces.popitem(last=False)
+
+        return trace
+
+    def clear(self):
+        """
+        Empty the in memory level of the cache (files of the on disk level are kept).
+        """
+
+        self.traces.clear()
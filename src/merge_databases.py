@@ -5,11 +5,14 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 11/01/2019
-    Date last modified: 12/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
+import re
+import glob
 import dataset
+from resultdb import Unfinished
 
 
 if __name__ == "__main__":
@@ -21,18 +24,9 @@ if __name__ == "__main__":
     plasticity = 'Claire'
     veto = False
 
-    # Predefine some specifics dependent stuff
-    if granularity == 0 and protocol_type == 'Letzkus' and plasticity == 'Claire' and not veto \
-            and algo == 'monteresults_':
-        nrdb = 81
-    elif granularity == 0 and protocol_type is 'Letzkus' and plasticity is 'Claire' and not veto \
-            and algo == 'monteresults_':
-        nrdb = 91
-    if granularity == 1 and protocol_type == 'Letzkus' and plasticity == 'Claire' and not veto \
-            and algo == 'samplespace_':
-        nrdb = 64
-    else:
-        raise NotImplementedError
+    # Databases of all jobs of the run, whatever the number of jobs was, sorted by job id
+    db_names = glob.glob('../Data/' + algo + protocol_type + '_g' + str(granularity) + '_j*.db')
+    db_names = sorted(db_names, key=lambda name: int(re.search(r'_j(\d+)\.db$', name).group(1)))
 
     # Connect with the database where all the results will be merged and create the table that will contain it
     merged_db = dataset.connect('sqlite:///../Data/' + algo + protocol_type + '_g' + str(granularity) + '.db')
@@ -54,13 +48,12 @@ if __name__ == "__main__":
     maxid = 0
 
     # Add the databases one by one to the merged database
-    for i in range(nrdb):
+    for db_name in db_names:
 
-        print('Base {}'.format(i))
+        print('Base {}'.format(db_name))
 
         merged_db.query("BEGIN;")
-        merged_db.query("ATTACH DATABASE '../Data/" + algo + protocol_type + "_g" + str(granularity) + "_j"
-                        + str(i) + ".db' AS candidate;")
+        merged_db.query("ATTACH DATABASE '" + db_name + "' AS candidate;")
         if veto:
             raise NotImplementedError
         else:
@@ -76,9 +69,12 @@ if __name__ == "__main__":
         merged_db.query("DETACH DATABASE candidate;")
         merged_db.commit()
 
-    # Remove rows that weren't finished with simulating
-    merged_table = merged_db.create_table(table_name)
-    merged_table.delete(score=9999999999999999)
-    merged_db.commit()
+    # Rows whose simulation was never finished (their worker was killed before writing their scores) are kept without
+    # their leases, which are not merged, such that a shared search on the merged table claims them again (see
+    # resultdb.claim_configuration)
+    if algo == 'monteresults_':
+        nr_unfinished = next(merged_db.query("SELECT count(*) AS nr FROM " + table_name + " WHERE l2 IN (" +
+                                             str(Unfinished) + ", " + str(float(Unfinished)) + ");"))['nr']
+        print('Keeping {} unfinished configurations to simulate again'.format(nr_unfinished))
 
     print('\nDone')
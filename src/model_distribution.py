@@ -5,7 +5,7 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 21/01/2018
-    Date last modified: 22/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
@@ -13,6 +13,7 @@ import sys
 import dataset
 import random
 from os.path import isfile
+from resultdb import Unfinished
 
 
 if __name__ == "__main__":
@@ -112,10 +113,10 @@ if __name__ == "__main__":
             # Add it to the actual sample space database with its cumulative relative probability
             if veto:
                 newtab.insert(dict(crp=crp, ap=q['ap'], ad=q['ad'], th=q['th'], tl=q['tl'], t1=q['t1']-nh, t2=q['t2'],
-                                   tx=q['tx'], bt=q['bt'], tt=q['tt'], li=9999999999999999, l2=9999999999999999))
+                                   tx=q['tx'], bt=q['bt'], tt=q['tt'], li=Unfinished, l2=Unfinished))
             else:
                 newtab.insert(dict(ap=q['ap'], ad=q['ad'], th=q['th'], tl=q['tl'], t1=q['t1'] - nh, t2=q['t2'],
-                                   tx=q['tx'], li=9999999999999999, l2=9999999999999999, crp=crp))
+                                   tx=q['tx'], li=Unfinished, l2=Unfinished, crp=crp))
 
             if nri % 100 == 0:
                 print(nri)
@@ -5,60 +5,42 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 21/12/2018
-    Date last modified: 04/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
 import sys
-import math
 import dataset
 import warnings
 import random as rnd
 from simulation import *
+import objective
+import paramspace
+import searchspace
+import resultdb
+from screening import online_screening_cut
+from branchbound import bounded_losses, learned_order
 
 warnings.filterwarnings("error")
 
 
 def set_param(pname, index, plas='Claire_noveto'):
     """
-    This function will either transform the given index to the corresponding parameter value or sample an index in the
-    right parameter range to produce a randomly sampled value for the desired parameter.
+    This function will transform the given index to the corresponding parameter value, on the grid centered on the first
+    fit of the Letzkus protocol (see paramspace.py).
     :param pname: Name of the parameter to set
     :param index: Index of the parameter value
     :param plas: Type of plasticity rule used
     :return: return the value for desired parameter to set
     """
 
-    if plas == 'Claire_noveto':
-        if pname in ['Theta_high', 'Theta_low']:
-            return (-5 + 5 * index) * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return 10 ** (index - 6)
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x']:
-            return 3 ** (index - 1) * b2.ms
-        else:
-            raise ValueError(pname)
-    elif plas == 'Claire_veto':
-
-        cbest = {'A_LTD': 0.0001872, 'A_LTP': 0.00003933, 'Theta_low': 4.886 * b2.mV, 'Theta_high': 26.04 * b2.mV,
-                 'b_theta': 9999., 'tau_theta': 32.13 * b2.ms, 'tau_lowpass1': 77.17 * b2.ms,
-                 'tau_lowpass2': 2.001 * b2.ms, 'tau_x': 20.89 * b2.ms}
-
-        if pname in ['Theta_high', 'Theta_low']:
-            return cbest[pname] + 8 * index * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return cbest[pname] * 10 ** index
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'tau_theta', 'b_theta']:
-            return cbest[pname] * 4 ** index
-        else:
-            raise ValueError(pname)
-    else:
-        raise ValueError(plas)
+    return paramspace.set_param(pname, index, plas, 'Letzkus_first')
 
 
-def init_params(granularity, split, table_name, plasticity, veto, jid, first_id, the_table, debug):
+def init_params(granularity, split, table_name, plasticity, veto, jid, first_id, the_table, debug, nrjobs=None):
     """
-
+    Initialize objects that will be necessary for the monte carlo parameter optimization. The search space of each rule
+    and granularity, and the parameters fixed in each job, are specified in searchspace.json.
     :param granularity: int describing how fine the param search will be (Note: the range is also decreased for that)
     :param split: bool whether or not to split the search grid dependening on the job id
     :param table_name: name of the database table, which also specifies the plasticity rule used
@@ -68,100 +50,24 @@ def init_params(granularity, split, table_name, plasticity, veto, jid, first_id,
     :param first_id: id of the first parameter configuration to use (can be none for random initialization)
     :param the_table: pointer to the database table used to store simulation results
     :param debug: debug mode or release mode
+    :param nrjobs: number of jobs among which the space is split (None for one job per block of the specification)
     :return: list of names (keys) of the parameters to fit, dictionaries of the indexes and of the actual values of the
-    parameters to start with, boundaries of the index grid to use for the search, index increase step used for MC.
+    parameters to start with, boundaries of the index grid to use for the search, index increase step used for MC and
+    list of dictionaries of the indexes of the fixed parameters of each block of the space searched by the job.
     """
 
-    # Make list of parameters to fit and initialization of parameters object with those that don't need fitting
-    if split:
-        if table_name == 'Claire_noveto':
-            if granularity == 0:
-                # List of parameters to fit
-                param_names = ['A_LTP', 'A_LTD', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-
-                # Compute set parameter indexes
-                itl = jid % 9
-                ith = int(math.floor(float(jid) / 9.))
-                indexes = {'Theta_high': ith, 'Theta_low': itl}
-
-                # Compute set parameter values
-                tl = set_param('Theta_low', itl, table_name)
-                th = set_param('Theta_high', ith, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'Theta_high': th, 'Theta_low': tl}
-            elif granularity == 1:
-                # List of parameters to fit
-                param_names = ['Theta_high', 'A_LTP', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-
-                # Compute set parameter indexes
-                itl = (jid % 13) * 0.5 + 2
-                iad = int(math.floor(float(jid) / 13.) + 1)
-                indexes = {'Theta_low': itl, 'A_LTD': iad}
-
-                # Compute set parameter values
-                tl = set_param('Theta_low', itl, table_name)
-                ad = set_param('A_LTD', iad, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'Theta_low': tl, 'A_LTD': ad}
-            else:
-                raise ValueError(granularity)
-        elif table_name == 'Claire_veto':
-            if granularity == 1:
-                # List of parameters to fit
-                param_names = ['Theta_high', 'Theta_low', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-
-                # Compute set parameter indexes
-                iap = (jid % 9) * 0.5 - 2
-                iad = math.floor(float(jid) / 9.) * 0.5 - 2
-                indexes = {'A_LTP': iap, 'A_LTD': iad}
-
-                # Compute set parameter values
-                ap = set_param('A_LTP', iap, table_name)
-                ad = set_param('A_LTD', iad, table_name)
-
-                # Initialize parameters not needing fitting
-                parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5,
-                              'A_LTP': ap, 'A_LTD': ad}
-            else:
-                raise NotImplementedError
-        else:
-            raise NotImplementedError(table_name)
-    else:
-        # List of parameters to fit
-        param_names = ['Theta_high', 'Theta_low', 'A_LTP', 'A_LTD', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
-
-        # Initialize parameters not needing fitting
-        parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5}
+    space, param_names, blocks = searchspace.job_blocks('montesearch', table_name, granularity, jid, nrjobs, split,
+                                                        cost=searchspace.block_cost(table_name))
+    if len(blocks) == 0:
+        raise ValueError('No block of the search space is assigned to job {}.'.format(jid))
 
-        # Initialize dictionary for parameter indexes
-        indexes = {}
+    # Initialize parameters not needing fitting and start in a random block of the job
+    parameters = {'PlasticityRule': plasticity, 'veto': veto, 'x_reset': 1., 'w_max': 1, 'w_init': 0.5}
+    indexes = dict(rnd.choice(blocks))
 
     # Specifications of the search grid depending on the search granularity
-    increase = 0.5 ** granularity
-    if table_name == 'Claire_noveto':
-        if granularity == 0:
-            grid_params = {'Theta_high': [0, 8], 'Theta_low': [0, 8], 'A_LTP': [1, 7], 'A_LTD': [1, 7],
-                           'tau_lowpass1': [1, 6], 'tau_lowpass2': [1, 6], 'tau_x': [1, 6]}
-
-        elif granularity == 1:
-            grid_params = {'Theta_high': [3, 7], 'Theta_low': [2, 8], 'A_LTP': [-1, 7], 'A_LTD': [1, 7],
-                           'tau_lowpass1': [1, 6], 'tau_lowpass2': [1, 4], 'tau_x': [1, 8]}
-        else:
-            raise NotImplementedError
-    elif table_name == 'Claire_veto':
-        param_names += ['b_theta', 'tau_theta']
-        if granularity == 1:
-            grid_params = {'Theta_high': [-1.5, 1], 'Theta_low': [-0.5, 1.5], 'A_LTP': [-2, 2], 'A_LTD': [-2, 2],
-                           'tau_lowpass1': [-1, 0.5], 'tau_lowpass2': [-0.5, 1], 'tau_x': [-1, 1],
-                           'b_theta': [-1, 0.5], 'tau_theta': [-1, 0.5]}
-        else:
-            raise NotImplementedError
-    else:
-        raise ValueError(table_name)
+    increase = space['step']
+    grid_params = {p[0]: p[1:] for p in space['parameters']}
 
     # Initialize parameter indices
     if first_id is None:
@@ -169,24 +75,22 @@ def init_params(granularity, split, table_name, plasticity, veto, jid, first_id,
             nr_param_indexes = int(round((grid_params[param_name][1] - grid_params[param_name][0]) / increase + 1))
             indexes[param_name] = rnd.sample(range(nr_param_indexes), 1)[0] * increase + grid_params[param_name][0]
     else:
-        translator = {'Theta_high': 'th', 'Theta_low': 'tl', 'A_LTP': 'ap', 'A_LTD': 'ad', 'tau_lowpass1': 't1',
-                      'tau_lowpass2': 't2', 'tau_x': 'tx', 'b_theta': 'bt', 'tau_theta': 'tt'}
         first_indices = the_table.find_one(id=first_id)
         for param_name in param_names:
-            indexes[param_name] = first_indices[translator[param_name]]
+            indexes[param_name] = first_indices[resultdb.Columns[param_name]]
 
         if debug:
             print('First indices are:\n{}'.format(first_indices))
 
     # Initialize parameter values from indices according to desired grid design and specfic granularity
-    for param_name in param_names:
+    for param_name in indexes:
         parameters[param_name] = set_param(param_name, indexes[param_name], table_name)
 
-    return param_names, indexes, parameters, grid_params, increase
+    return param_names, indexes, parameters, grid_params, increase, blocks
 
 
 def main(protocol_type='Letzkus', plasticity='Claire', veto=False, debug=False, granularity=0, first_id=None,
-         split=True, jid=0):
+         split=True, jid=0, engine='brian2', screen=False, prune=False, nrjobs=None, background=False, shared=False):
     """
     Parameter search script that uses an algorithm inspired by a mix between grid and Monte-Carlo search.
     :param protocol_type: Whether to fit on the 'Letzkus' or 'Brandalise' voltage traces.
@@ -197,28 +101,30 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, debug=False,
     :param first_id: ID of the parameter configuration to start with. If None, a random configuration is used.
     :param split: bool whether or not to split the search grid dependening on the job id
     :param jid: id of the job running the montecarlo search. Necessary for splitting the grid search in case of split.
+    :param engine: simulation backend to use ('brian2' or 'numpy')
+    :param screen: whether or not to screen configurations with a cheap simulation before the reference simulation
+    :param prune: whether or not to abandon the simulation of a configuration once it is certain to be rejected, only
+    storing a lower bound of its loss (with lb=1)
+    :param nrjobs: number of jobs among which the space is split (None for one job per block of searchspace.json)
+    :param background: whether or not to write the results from a background thread (see resultdb.result_writer)
+    :param shared: whether or not other workers share the result database, such that configurations must be claimed
+    before being simulated (see resultdb.claim)
     """
 
     # Set random seed to current time to have different seeds for each of the many jobs
     rnd.seed()
 
+    # A Brian2 run costs about as much for one trace as for all, such that abandoning configurations would not pay off
+    if prune and engine == 'brian2':
+        raise ValueError("Pruning requires an engine simulating traces at a cost proportional to their number.")
+
     ####################################################################################################################
     # Define some variables depending on the protocol type
     ####################################################################################################################
 
-    if protocol_type is 'Brandalise':
-        nrtraces = 24
-        nrneurons = 18
-        repets = 60
-        targets = [100, 144.8, 96.6, 122, 101.4, 95.5, 128.7, 101.1, 94.5,
-                   100, 131, 96.6, 100, 119.3, 104.5, 104.3, 40, 40]
-    elif protocol_type is 'Letzkus':
-        nrtraces = 9
-        nrneurons = 9
-        repets = 150
-        targets = [92, 129, 90, 100, 118, 100, 137, 85, 100]
-    else:
+    if protocol_type not in objective.Targets:
         raise ValueError(protocol_type)
+    nrtraces = objective.nr_traces(protocol_type)
 
     ####################################################################################################################
     # Connect to database (Sqlite database corresponding to the plasticity model used)
@@ -227,14 +133,34 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, debug=False,
     db_name = '../Data/monteresults_' + protocol_type + '_g' + str(granularity) + '_j' + str(jid) + '.db'
     db = dataset.connect('sqlite:///' + db_name)
     table_name = plasticity + '_veto' if veto else plasticity + '_noveto'
+
+    # Configurations are claimed with leases when other workers share the database, whose table is then prepared first
+    worker = resultdb.owner()
+    if shared:
+        resultdb.lease_table(db, table_name, veto)
     the_table = db.create_table(table_name)
 
+    # Scores of the configurations already in the table, such that visited configurations are looked up in memory
+    visited = resultdb.VisitedConfigurations(db, the_table, veto, shared)
+    print('{} configurations were already visited'.format(len(visited)))
+
+    # Rows are buffered and written in one transaction every resultdb.FlushRows rows or resultdb.FlushDelay seconds
+    writer = resultdb.result_writer(db, the_table, background)
+
     ####################################################################################################################
     # Plasticity parameters initializations
     ####################################################################################################################
 
-    param_names, indexes, parameters, grid_params, increase = init_params(granularity, split, table_name, plasticity,
-                                                                          veto, jid, first_id, the_table, debug)
+    param_names, indexes, parameters, grid_params, increase, blocks = init_params(granularity, split, table_name,
+                                                                                  plasticity, veto, jid, first_id,
+                                                                                  the_table, debug, nrjobs)
+
+    # Order in which the neurons are simulated when pruning, learned from the results of all jobs
+    order = None
+    if prune:
+        order = learned_order(protocol_type, '../Data/monteresults_' + protocol_type + '_g*_j*.db', table_name,
+                              parameters, lambda pname, index: set_param(pname, index, table_name))
+        print('Neuron order: {}'.format(order))
 
     print('\nInitialization completed.')
 
@@ -248,6 +174,7 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, debug=False,
     nr_iterations = 10000000
     patience = 3*len(param_names)
     waiting = 0
+    screened = []
 
     print('\nStarting Monte-Carlo optimization:')
 
@@ -287,87 +214,105 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, debug=False,
 
         else:
             # If the system is stuck in a region where it cannot explore new configurations, randomly reset parameters
+            # and the block of the job in which they are searched
             waiting = 0
             current_score = maxint
+            new_parameters = dict(parameters)
+            new_indexes = dict(rnd.choice(blocks))
 
             for param_name in param_names:
                 nr_param_indexes = int(round((grid_params[param_name][1] - grid_params[param_name][0]) / increase + 1))
-                indexes[param_name] = rnd.sample(range(nr_param_indexes), 1)[0] * increase + grid_params[param_name][0]
-                new_parameters[param_name] = set_param(param_name, indexes[param_name], table_name)
+                new_indexes[param_name] = rnd.sample(range(nr_param_indexes), 1)[0] * increase + \
+                    grid_params[param_name][0]
+            for param_name in new_indexes:
+                new_parameters[param_name] = set_param(param_name, new_indexes[param_name], table_name)
 
             print('\n>>>> Random Parameter Reset\n')
 
+        # Draw the acceptance sample before simulating, such that configurations whose loss exceeds current_score / draw
+        # can be rejected before all their traces are simulated (once current_score is reset if the search restarts)
+        draw = rnd.uniform(0, 1)
+        bound = current_score / draw if prune and draw > 0 else None
+
         ################################################################################################################
         # If parameter configuration was already simulated, move on to accept or reject it. Otherwise, run simulations.
         ################################################################################################################
 
-        # Check whether this parameter configuration was already simulated.
-        if veto:
-            query = the_table.find_one(th=new_indexes['Theta_high'], tl=new_indexes['Theta_low'],
-                                       ap=new_indexes['A_LTP'], ad=new_indexes['A_LTD'], t1=new_indexes['tau_lowpass1'],
-                                       t2=new_indexes['tau_lowpass2'], tx=new_indexes['tau_x'],
-                                       bt=new_indexes['b_theta'], tt=new_indexes['tau_theta'])
-        else:
-            query = the_table.find_one(th=new_indexes['Theta_high'], tl=new_indexes['Theta_low'],
-                                       ap=new_indexes['A_LTP'], ad=new_indexes['A_LTD'], t1=new_indexes['tau_lowpass1'],
-                                       t2=new_indexes['tau_lowpass2'], tx=new_indexes['tau_x'])
+        # Check whether this parameter configuration was already simulated. If the database is shared with other
+        # workers, configurations that are not scored yet are only simulated if they can be claimed, and are otherwise
+        # being simulated by another worker (or were scored by it since they were looked up)
+        key = dict((resultdb.Columns[p], new_indexes[p]) for p in resultdb.key_parameters(veto))
+        known_score = visited.score(new_indexes)
+        query_id = None
+        if shared and (known_score is None or resultdb.is_unfinished(known_score)):
+            query_id = resultdb.claim_configuration(db, the_table, key, worker)
+            known_score = None if query_id is not None else visited.refresh(new_indexes)
 
-        if query is None:
+        if known_score is None:
 
             waiting = 0
 
-            # Create that row and temporarily put a score of zero to prevent other processors to compute it again
-            if veto:
-                query_id = the_table.insert(dict(th=new_indexes['Theta_high'], tl=new_indexes['Theta_low'],
-                                                 ap=new_indexes['A_LTP'], ad=new_indexes['A_LTD'],
-                                                 t1=new_indexes['tau_lowpass1'], t2=new_indexes['tau_lowpass2'],
-                                                 tx=new_indexes['tau_x'], bt=new_indexes['b_theta'],
-                                                 tt=new_indexes['tau_theta'], li=9999999999999999, l2=9999999999999999))
-
-            else:
-                query_id = the_table.insert(dict(th=new_indexes['Theta_high'], tl=new_indexes['Theta_low'],
-                                                 ap=new_indexes['A_LTP'], ad=new_indexes['A_LTD'],
-                                                 t1=new_indexes['tau_lowpass1'], t2=new_indexes['tau_lowpass2'],
-                                                 tx=new_indexes['tau_x'], li=9999999999999999, l2=9999999999999999))
-            db.commit()
-
             ############################################################################################################
             #            Run Simulations of all traces with new parameters and get plasticity
             ############################################################################################################
 
-            # Initialize plasticity array
-            p = [0] * nrtraces
+            # Screen the configuration with the cheap simulation first if required, and only promote it if promising
+            row = key if query_id is None else dict(id=query_id, ow=None, ex=None)
+            for fidelity in ([0, 1] if screen else [1]):
 
-            # Iterate through all available traces
-            for t in range(nrtraces):
+                # Simulate traces one at a time until the configuration is certain to be rejected
+                if fidelity == 1 and prune:
 
-                # Simulate traces and store plasticities
-                p[t], _ = simulate(protocol_type, t, new_parameters)
+                    def simulate_traces(traces, _):
+                        return [[simulate(protocol_type, t, new_parameters, engine=engine)[0]] for t in traces]
 
-            # If Brandalise weight supralinear and linear trace plasticity contributions
-            if protocol_type == 'Brandalise':
-                p = [p[0], 0.78 * p[1] + 0.22 * p[2], p[3], 0.8 * p[4] + 0.2 * p[5], p[6], p[7],
-                     0.85 * p[8] + 0.15 * p[9], p[10], p[11], p[12], 0.81 * p[13] + 0.19 * p[14], p[15], p[16],
-                     0.84 * p[17] + 0.16 * p[18], p[19], p[20], 0.85 * p[21] + 0.15 * p[22], p[23]]
+                    errors, plasticities, complete = bounded_losses(simulate_traces, protocol_type, 1, bound, order)
+                    differences = errors[0]
+                    p = plasticities[0]
+                    row['lb'] = int(not complete[0])
 
-            ############################################################################################################
-            #  Compute score and update database
-            ############################################################################################################
+                else:
 
-            # Compute score
-            differences = [abs(targets[t] - 100 * (1 + repets * p[t])) for t in range(nrneurons)]
-            new_score = sum([d ** 2 for d in differences])
+                    # Simulate all available traces at once
+                    if fidelity == 0:
+                        p = list(simulate_protocol(protocol_type, new_parameters, nrtraces, 'numpy',
+                                                   ScreeningParameters['method'], ScreeningParameters['timestep']))
+                    else:
+                        p = list(simulate_protocol(protocol_type, new_parameters, nrtraces, engine))
 
-            # Update database
-            the_table.update(dict(id=query_id, li=max(differences), l2=new_score), ['id'])
-            db.commit()
+                    differences = objective.differences(p, protocol_type)
+
+                ########################################################################################################
+                #  Compute score
+                ########################################################################################################
+
+                max_error, new_score = [float(loss) for loss in objective.losses(differences)]
+                row.update(li=max_error, l2=new_score, pl=objective.pack_plasticities(p))
+
+                # Configurations that are not promoted keep their screening score
+                if screen:
+                    row['fi'] = fidelity
+                    if fidelity == 0:
+                        row['ls'] = new_score
+                        if not online_screening_cut(new_score, screened, ScreeningParameters['quantile'],
+                                                    ScreeningParameters['threshold']):
+                            break
+
+            # Update database (the row is written behind, its score being looked up in the visited configurations
+            # unless it is only a lower bound, which must not be accepted once current_score is reset)
+            if query_id is None:
+                writer.insert(row)
+            else:
+                writer.update(row, ['id'])
+            if not row.get('lb'):
+                visited.add(new_indexes, row['l2'])
 
         else:
 
             waiting += 1
 
             # Get score that was already computed
-            new_score = query['li']
+            new_score = known_score
             print('    Was already simulated')
 
         # Given appropriate probability, update current state with the new state
@@ -381,13 +326,15 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, debug=False,
             except ZeroDivisionError or RuntimeWarning:
                 accept_prob = 1
 
-            if rnd.uniform(0, 1) < accept_prob:
+            if draw < accept_prob:
                 parameters = new_parameters
                 indexes = new_indexes
                 current_score = new_score
 
         print('    Score = {}'.format(current_score))
 
+    writer.flush()
+
     return 0
 
 
@@ -402,19 +349,32 @@ if __name__ == "__main__":
     else:
         g = 0
 
-    # Starting Configuration
-    if len(sys.argv) == 4:
+    # Starting Configuration (None for a random one)
+    if len(sys.argv) > 3 and sys.argv[3] != 'None':
         fid = int(sys.argv[3])
     else:
         fid = None
 
+    # Number of jobs among which the search space is split
+    if len(sys.argv) > 4:
+        nrj = int(sys.argv[4])
+    else:
+        nrj = None
+
     # Simulation choices
     ptype = 'Letzkus'  # Type of protocol to use for parameter fit
     rule_name = 'Claire'  # can be either of 'Claire' or 'Clopath'
     vetoing = False  # whether or not to use a veto mechanism between LTP and LTD
+    backend = 'numpy'  # can be either of 'brian2' or 'numpy'
+    screening = False  # whether or not to only simulate promising configurations with the reference simulation
+    pruning = False  # whether or not to abandon configurations once they are certain to be rejected
+    writing = False  # whether or not to write the results from a background thread
+    sharing = False  # whether or not other workers share the result database of the job
 
     # Run
-    exi = main(ptype, rule_name, veto=vetoing, debug=False, granularity=g, first_id=fid, split=True, jid=j)
+    exi = main(ptype, rule_name, veto=vetoing, debug=False, granularity=g, first_id=fid, split=True, jid=j,
+               engine=backend, screen=screening, prune=pruning, nrjobs=nrj, background=writing,
+               shared=sharing)
 
     if exi is 0:
         print('\nMonte-Carlo search finished successfully!')
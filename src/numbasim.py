@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+    File name: numbasim.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 26/01/2019
+    Date last modified: 26/01/2019
+    Python Version: 3.5
+"""
+
+import math
+import numpy as np
+import numpysim
+
+# Numba is an optional dependency, only required by the numba engine
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+# Parameters of the fused kernel, in the order of its arguments
+KernelParameters = ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'x_reset', 'A_LTP', 'A_LTD', 'Theta_low', 'Theta_high',
+                    'b_theta', 'tau_theta', 'w_init']
+
+
+@njit(parallel=True, cache=True)
+def fused_kernel(v, nrsteps, t_pre, dt, clopath, veto, tau_lowpass1, tau_lowpass2, tau_x, x_reset, a_ltp, a_ltd,
+                 theta_low, theta_high, b_theta, tau_theta, w_init, plasticity):
+    """
+    Integrate the weight changes of K configurations with the same forward-Euler scheme as the Brian2 simulation, in a
+    single compiled loop over time per configuration (without any temporary array). Configurations are distributed over
+    threads. The voltage trace is followed by zeros up to nrsteps.
+    :param v: voltage trace in mV
+    :param nrsteps: number of timesteps to simulate
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param clopath: True for the Clopath rule, False for the Claire rule
+    :param veto: whether or not the depression threshold is raised by the veto mechanism
+    :param tau_lowpass1: array of the K time constants of the first low-pass filter (likewise for all parameters below,
+    all in unitless SI values)
+    :param tau_lowpass2: time constants of the second low-pass filter
+    :param tau_x: time constants of the presynaptic trace
+    :param x_reset: values of the presynaptic trace after the spike
+    :param a_ltp: potentiation amplitudes
+    :param a_ltd: depression amplitudes
+    :param theta_low: depression thresholds
+    :param theta_high: potentiation thresholds
+    :param b_theta: veto strengths
+    :param tau_theta: veto time constants
+    :param w_init: initial weights
+    :param plasticity: output array receiving the final plasticity of each configuration
+    """
+
+    dt_ms = 1000. * dt
+    nrsamples = v.shape[0]
+
+    for k in prange(plasticity.shape[0]):
+        a1 = dt / tau_lowpass1[k]
+        a2 = dt / tau_lowpass2[k]
+        a_theta = dt / tau_theta[k]
+        theta_low_zero = 1000. * theta_low[k]
+        theta_high_mv = 1000. * theta_high[k]
+        v_lowpass1 = 0.
+        v_lowpass2 = 0.
+        theta = 0.
+        w_ampa = 0.
+
+        for i in range(nrsteps):
+            v_i = v[i] if i < nrsamples else 0.
+            t = i * dt
+
+            # Presynaptic trace
+            x = 0.
+            if t >= t_pre:
+                x = x_reset[k] * math.exp((t_pre - t) / tau_x[k])
+
+            # Potentiation and depression terms
+            threshold_low = theta_low_zero + b_theta[k] * theta if veto else theta_low_zero
+            if clopath:
+                w_ltp = a_ltp[k] * x * max(v_i - theta_high_mv, 0.) * max(v_lowpass2 - threshold_low, 0.)
+            else:
+                w_ltp = a_ltp[k] * x * max(v_lowpass2 - theta_high_mv, 0.)
+            w_ltd = a_ltd[k] * x * max(v_lowpass1 - threshold_low, 0.)
+
+            # Euler step of all state variables
+            w_ampa += dt_ms * (w_ltp - w_ltd)
+            if veto:
+                theta = (1. - a_theta) * theta + a_theta * w_ltp
+            v_lowpass1 = (1. - a1) * v_lowpass1 + a1 * v_i
+            v_lowpass2 = (1. - a2) * v_lowpass2 + a2 * v_i
+
+        plasticity[k] = w_ampa / w_init[k]
+
+
+def batch_kernel(voltage, t_pre, dt, prm, tolerance=None, nrsteps=None):
+    """
+    Drop-in replacement of numpysim.batch_kernel running the compiled fused kernel.
+    :param voltage: voltage trace in mV
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters, with the numerical values given as arrays of length K (see
+    numpysim.table_columns) and the rule name and veto flag shared by all configurations
+    :param tolerance: maximal absolute error on each plasticity allowed to truncate the simulation (None for no
+    truncation, see numpysim.active_window)
+    :param nrsteps: number of timesteps to simulate if the voltage trace is followed by zeros
+    :return: array with the final plasticity of each configuration and array with the achieved error bounds
+    """
+
+    if not NUMBA_AVAILABLE:
+        raise ImportError("The numba engine requires the numba package.")
+    if prm['PlasticityRule'] not in ['Claire', 'Clopath']:
+        raise NotImplementedError(prm['PlasticityRule'])
+
+    # Broadcast all parameters to contiguous arrays of length K (veto parameters are unused without veto)
+    defaults = {'b_theta': 0., 'tau_theta': 1.}
+    nrconfigs = max(np.size(prm[name]) for name in prm if name not in ['PlasticityRule', 'veto'])
+    columns = [np.ascontiguousarray(np.broadcast_to(np.asarray(prm.get(name, defaults.get(name)), dtype=float),
+                                                    (nrconfigs,))) for name in KernelParameters]
+
+    v = np.ascontiguousarray(voltage, dtype=float)
+    nrsteps = len(v) if nrsteps is None else max(nrsteps, len(v))
+    bounds = np.zeros(nrconfigs)
+    if tolerance is not None:
+        nrsteps, bounds = numpysim.active_window(v, t_pre, dt, prm, tolerance, nrsteps)
+
+    plasticity = np.zeros(nrconfigs)
+    fused_kernel(v, nrsteps, float(t_pre), float(dt), prm['PlasticityRule'] == 'Clopath', bool(prm['veto']),
+                 *(columns + [plasticity]))
+
+    return plasticity, np.broadcast_to(bounds, (nrconfigs,)).copy()
@@ -0,0 +1,684 @@
+#!/usr/bin/env python
+
+"""
+    File name: numpysim.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 24/01/2019
+    Date last modified: 27/01/2019
+    Python Version: 3.5
+"""
+
+import numpy as np
+
+# Largest exponent of the gain used inside one block of the low-pass scan (keeps r ** -j far from overflowing)
+MAX_LOG_GAIN = 300.
+
+# Maximal number of array elements (configurations x timesteps) integrated at once by a batched simulation
+BATCH_ELEMENTS = 4000000
+
+
+def strip_units(plasticity_parameters):
+    """
+    Convert a dictionary of plasticity parameters (possibly containing Brian2 quantities) to plain floats in SI units.
+    Non numerical entries such as the plasticity rule name or the veto flag are kept as they are.
+    :param plasticity_parameters: parameters of the plasticity rule (see evaluateparameters.py for examples)
+    :return: dictionary with the same keys and unitless SI values
+    """
+
+    unitless = {}
+    for key, value in plasticity_parameters.items():
+        if key in ['PlasticityRule', 'veto']:
+            unitless[key] = value
+        else:
+            unitless[key] = float(value)
+
+    return unitless
+
+
+def table_columns(param_table):
+    """
+    Convert a table of K parameter configurations to a dictionary of unitless parameter columns of length K. The table
+    can either be a numpy structured array, a dictionary of columns or a list of plasticity parameter dictionaries
+    (possibly containing Brian2 quantities). Non numerical entries (rule name and veto flag) are dropped.
+    :param param_table: table of parameter configurations
+    :return: dictionary of float arrays with one value per configuration
+    """
+
+    if isinstance(param_table, np.ndarray) and param_table.dtype.names is not None:
+        return {name: np.asarray(param_table[name], dtype=float) for name in param_table.dtype.names}
+    elif isinstance(param_table, dict):
+        return {name: np.asarray(column, dtype=float) for name, column in param_table.items()
+                if name not in ['PlasticityRule', 'veto']}
+    else:
+        rows = [strip_units(row) for row in param_table]
+        return {name: np.array([row[name] for row in rows]) for name in rows[0]
+                if name not in ['PlasticityRule', 'veto']}
+
+
+def exact_time_constants(prm, dt):
+    """
+    Time constants for which the forward-Euler step of a low-pass filter equals the exact solution over a timestep with
+    the input held constant: the Euler factor 1 - dt / tau_euler matches exp(-dt / tau) for
+    tau_euler = dt / (1 - exp(-dt / tau)). The whole Euler scheme then becomes an exponential integrator of the low-pass
+    filters and of the veto threshold, which stays stable and accurate for timesteps close to or above the time
+    constants (tau_euler is always larger than dt).
+    :param prm: unitless plasticity parameters (see strip_units), numerical values can be arrays of K configurations
+    :param dt: integration timestep
+    :return: copy of the parameters with the time constants of the filters replaced by their Euler equivalents
+    """
+
+    exact = dict(prm)
+    for name in ['tau_lowpass1', 'tau_lowpass2', 'tau_theta']:
+        if name in prm:
+            exact[name] = -dt / np.expm1(-dt / np.asarray(prm[name], dtype=float))
+
+    return exact
+
+
+def coarse_trace(voltage, factor):
+    """
+    Resample voltage traces to a timestep factor times larger, taking the mean of the samples within each step.
+    :param voltage: voltage trace(s) (time along the last axis)
+    :param factor: integer ratio between the coarse and the original timesteps
+    :return: coarse voltage trace(s), the last step being completed with zeros
+    """
+
+    voltage = np.asarray(voltage, dtype=float)
+    nrsteps = -(-voltage.shape[-1] // factor)
+    padded = np.zeros(voltage.shape[:-1] + (nrsteps * factor,))
+    padded[..., :voltage.shape[-1]] = voltage
+
+    return np.mean(padded.reshape(voltage.shape[:-1] + (nrsteps, factor)), axis=-1)
+
+
+def lowpass(signal, dt, tau):
+    """
+    Forward-Euler integration of the low-pass filter dy/dt = (signal(t) - y) / tau starting at y = 0, i.e. the same
+    scheme as the 'euler' method of Brian2. The returned state at index i is the one used to evaluate the equations at
+    time i * dt. Instead of stepping through time one sample after the other, the linear recurrence is solved in blocks
+    with cumulative sums.
+    :param signal: input signal sampled with timestep dt (time along the last axis)
+    :param dt: integration timestep
+    :param tau: time constant of the filter (scalar or array broadcastable to the leading axes of signal)
+    :return: array with the filter state at each timestep
+    """
+
+    # Discrete recurrence y[i+1] = r * y[i] + u[i]
+    a = (dt / np.asarray(tau, dtype=float))[..., np.newaxis]
+    u = a * np.asarray(signal, dtype=float)
+    shape = u.shape
+    nrsteps = shape[-1]
+    u = np.broadcast_to(u, shape).reshape(-1, nrsteps)
+    r = np.broadcast_to(1. - a, shape[:-1] + (1,)).reshape(-1, 1)
+    y = np.zeros(u.shape)
+
+    if nrsteps < 2:
+        return y.reshape(shape)
+
+    # Degenerated filters (time constant close to or below the timestep) are simply stepped through
+    if np.any(np.abs(r) < 1e-3) or np.any(np.abs(r) > 1.):
+        for i in range(nrsteps - 1):
+            y[:, i + 1] = r[:, 0] * y[:, i] + u[:, i]
+        return y.reshape(shape)
+
+    # Solve the recurrence blockwise: y[s+j+1] = r^j * (r * y[s] + sum_k r^-k * u[s+k])
+    log_decay = -np.log(np.min(np.abs(r)))
+    block = nrsteps if log_decay == 0. else int(max(1, min(nrsteps, MAX_LOG_GAIN / log_decay)))
+    j = np.arange(block)
+    gain = r ** -j
+    decay = r ** j
+    carry = np.zeros(u.shape[0])
+    for s in range(0, nrsteps, block):
+        m = min(block, nrsteps - s)
+        z = decay[:, :m] * (r * carry[:, np.newaxis] + np.cumsum(u[:, s:s + m] * gain[:, :m], axis=1))
+        y[:, s] = carry
+        y[:, s + 1:s + m] = z[:, :-1]
+        carry = z[:, -1]
+
+    return y.reshape(shape)
+
+
+def presynaptic_trace(nrsteps, dt, t_pre, tau_x, x_reset):
+    """
+    Presynaptic trace x_reset * exp((t_pre - t) / tau_x) * int(t >= t_pre) evaluated at every timestep.
+    :param nrsteps: number of timesteps
+    :param dt: integration timestep
+    :param t_pre: time of the presynaptic spike (scalar or array of spike times, one per trace)
+    :param tau_x: time constant of the presynaptic trace (scalar or array of time constants)
+    :param x_reset: value of the trace right after the presynaptic spike
+    :return: array with the presynaptic trace at each timestep (time along the last axis)
+    """
+
+    t = np.arange(nrsteps) * dt
+    t_pre = np.asarray(t_pre, dtype=float)[..., np.newaxis]
+    tau_x = np.asarray(tau_x, dtype=float)[..., np.newaxis]
+    x_reset = np.asarray(x_reset, dtype=float)[..., np.newaxis]
+
+    # Exponent is clipped before the spike to avoid overflows in a part of the trace that is zeroed anyway
+    return x_reset * np.exp(np.minimum(t_pre - t, 0.) / tau_x) * (t >= t_pre)
+
+
+def unique_lowpass(signal, dt, tau, filtered=None):
+    """
+    Low-pass filter a single signal with one time constant per configuration, filtering only once per distinct value.
+    :param signal: input signal sampled with timestep dt (or several signals along the leading axes for a single time
+    constant)
+    :param dt: integration timestep
+    :param tau: time constant(s) of the filter
+    :param filtered: optional function returning the filtered signal for a given time constant (e.g. from a cache)
+    :return: filtered signal for each time constant (time along the last axis)
+    """
+
+    tau = np.asarray(tau, dtype=float)
+    if tau.ndim == 0:
+        return lowpass(signal, dt, tau) if filtered is None else filtered(float(tau))[..., :np.shape(signal)[-1]]
+
+    taus, inverse = np.unique(tau, return_inverse=True)
+    if filtered is None:
+        traces = lowpass(signal, dt, taus)
+    else:
+        traces = np.array([filtered(t)[:np.shape(signal)[-1]] for t in taus])
+
+    return traces[inverse.reshape(tau.shape)]
+
+
+def dynamic_states(voltage, t_pre, dt, prm, filtered=None):
+    """
+    Compute the states of the plasticity equations that do not depend on the plasticity itself, i.e. the presynaptic
+    trace and both low-pass filtered voltages.
+    :param voltage: voltage trace in mV
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters (see strip_units)
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :return: presynaptic trace, first and second low-pass filtered voltages (time along the last axis)
+    """
+
+    x = presynaptic_trace(np.shape(voltage)[-1], dt, t_pre, prm['tau_x'], prm['x_reset'])
+    v_lowpass1 = unique_lowpass(voltage, dt, prm['tau_lowpass1'], filtered)
+    v_lowpass2 = unique_lowpass(voltage, dt, prm['tau_lowpass2'], filtered)
+
+    return x, v_lowpass1, v_lowpass2
+
+
+def first_timestep(nrsteps, dt, t_pre):
+    """
+    :param nrsteps: number of timesteps
+    :param dt: integration timestep
+    :param t_pre: time of the presynaptic spike (scalar or array of spike times)
+    :return: index of the first timestep at which the presynaptic trace is non zero (nrsteps if there is none), for
+    each spike time
+    """
+
+    return np.sum(np.arange(nrsteps) * dt < np.asarray(t_pre, dtype=float)[..., np.newaxis], axis=-1)
+
+
+def decaying(dt, *taus):
+    """
+    :param dt: integration timestep
+    :param taus: time constants of low-pass filters (scalars or arrays)
+    :return: whether the Euler steps of all filters decay monotonically in absence of input (required by the closed
+    form of the zero voltage tail)
+    """
+
+    return all(np.all(np.asarray(tau, dtype=float) > dt) for tau in taus)
+
+
+def lowpass_end(signal, dt, tau, filtered=None):
+    """
+    :param signal: input signal sampled with timestep dt (time along the last axis)
+    :param dt: integration timestep
+    :param tau: time constant(s) of the filter
+    :param filtered: optional function returning the filtered signal for a given time constant (see unique_lowpass)
+    :return: state of the filter right after the last sample of the signal, for each time constant (or signal)
+    """
+
+    tau = np.asarray(tau, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    if signal.shape[-1] == 0:
+        return np.zeros(np.broadcast(tau, signal[..., 0]).shape)
+
+    a = dt / tau
+    return (1. - a) * unique_lowpass(signal, dt, tau, filtered)[..., -1] + a * signal[..., -1]
+
+
+def padded_lowpass(signal, dt, nrsteps, filtered=None):
+    """
+    Low-pass filtering of a signal followed by zeros up to nrsteps samples. The states over the zero padding simply
+    decay geometrically from the state after the last sample.
+    :param signal: input signal sampled with timestep dt (without the zero padding, time along the last axis)
+    :param dt: integration timestep
+    :param nrsteps: number of samples of the padded signal
+    :param filtered: optional function returning the filtered signal (without padding) for a given time constant
+    :return: function returning the filtered padded signal for a given time constant (see unique_lowpass)
+    """
+
+    length = np.shape(signal)[-1]
+
+    def padded(tau):
+        head = lowpass(signal, dt, tau) if filtered is None else filtered(tau)[..., :length]
+        decay = (1. - dt / tau) ** np.arange(nrsteps - length)
+        tail = lowpass_end(signal, dt, tau, filtered)[..., np.newaxis] * decay
+        return np.concatenate([head, tail], axis=-1)
+
+    return padded
+
+
+def _geometric(ratio, start, stop):
+    """
+    :param ratio: ratio of the geometric series (between 0 and 1)
+    :param start: first exponent of the sum
+    :param stop: exponent after the last one of the sum
+    :return: sum of ratio ** j for j from start to stop - 1 (zero if the range is empty)
+    """
+
+    with np.errstate(invalid='ignore'):
+        return np.where(stop > start, (ratio ** start - ratio ** stop) / (1. - ratio), 0.)
+
+
+def relu_tail(y, r, theta, x0, q, length):
+    """
+    Closed form of sum(x0 * q^j * max(r^j * y - theta, 0)) over j from 0 to length - 1, i.e. of a thresholded low-pass
+    state decaying from y (with 0 < r < 1), weighted by the decaying presynaptic trace. Since r^j * y is monotonic, the
+    steps above threshold form a contiguous range, over which both terms are geometric series.
+    :param y: initial state(s)
+    :param r: decay factor(s) of the state per timestep
+    :param theta: threshold(s)
+    :param x0: initial value(s) of the presynaptic trace
+    :param q: decay factor(s) of the presynaptic trace per timestep
+    :param length: number(s) of timesteps
+    :return: thresholded integral(s)
+    """
+
+    y, r, theta = np.broadcast_arrays(np.asarray(y, dtype=float), np.asarray(r, dtype=float),
+                                      np.asarray(theta, dtype=float))
+    length = np.asarray(length, dtype=float)
+
+    # Timestep at which the state crosses the threshold
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = np.log(theta / y) / np.log(r)
+        above_until = np.clip(np.ceil(crossing), 0., length)
+        above_from = np.clip(np.floor(crossing) + 1., 0., length)
+
+    # Positive thresholds are only exceeded at the beginning, negative ones (if ever) until the end
+    start = np.where((theta < 0.) & (y < 0.), above_from, 0.)
+    stop = np.where(theta >= 0., np.where(y > theta, above_until, 0.), length)
+
+    return x0 * (y * _geometric(q * r, start, stop) - theta * _geometric(q, start, stop))
+
+
+def tail_integrals(voltage, nrsteps, t_pre, dt, prm, theta_high, theta_low, filtered=None):
+    """
+    Potentiation and depression integrals (see amplitude_integrals) accumulated over the zero padding of a voltage
+    trace, i.e. from timestep len(voltage) to nrsteps, in closed form: over the padding, the low-pass states decay
+    geometrically and so does the presynaptic trace. Rules without veto only.
+    :param voltage: voltage trace in mV (without padding, or several traces along the leading axes)
+    :param nrsteps: number of timesteps of the padded trace
+    :param t_pre: time of the presynaptic spike (or array of spike times, one per trace)
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters (see strip_units), numerical values can be arrays of K configurations
+    :param theta_high: potentiation threshold(s) in mV
+    :param theta_low: depression threshold(s) in mV
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :return: integrals I_LTP and I_LTD over the padding
+    """
+
+    # The tail starts after the last sample, or at the presynaptic spike if it comes later
+    length = np.shape(voltage)[-1]
+    start = np.maximum(length, first_timestep(nrsteps, dt, t_pre))
+    if np.all(start >= nrsteps):
+        return 0., 0.
+
+    tau_x = np.asarray(prm['tau_x'], dtype=float)
+    r1 = 1. - dt / np.asarray(prm['tau_lowpass1'], dtype=float)
+    r2 = 1. - dt / np.asarray(prm['tau_lowpass2'], dtype=float)
+    y1 = lowpass_end(voltage, dt, prm['tau_lowpass1'], filtered) * r1 ** (start - length)
+    y2 = lowpass_end(voltage, dt, prm['tau_lowpass2'], filtered) * r2 ** (start - length)
+    x0 = prm['x_reset'] * np.exp((t_pre - start * dt) / tau_x)
+    q = np.exp(-dt / tau_x)
+
+    if prm['PlasticityRule'] == 'Claire':
+        ltp = relu_tail(y2, r2, theta_high, x0, q, nrsteps - start)
+    elif prm['PlasticityRule'] == 'Clopath':
+        ltp = np.maximum(-theta_high, 0.) * relu_tail(y2, r2, theta_low, x0, q, nrsteps - start)
+    else:
+        raise NotImplementedError(prm['PlasticityRule'])
+    ltd = relu_tail(y1, r1, theta_low, x0, q, nrsteps - start)
+
+    return 1000. * dt * ltp, 1000. * dt * ltd
+
+
+def amplitude_integrals(voltage, t_pre, dt, prm, filtered=None, nrsteps=None):
+    """
+    Without veto, the weight change is linear in the amplitudes: w_ampa = A_LTP * I_LTP - A_LTD * I_LTD. This function
+    computes both integrals, which only depend on the trace, the thresholds and the time constants, such that any pair
+    of amplitudes can then be scored analytically. The amplitudes given in prm are ignored.
+    :param voltage: voltage trace in mV (or several traces along the leading axes, for a single configuration)
+    :param t_pre: time of the presynaptic spike (or array of spike times, one per trace)
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters (see strip_units), numerical values can be arrays of K configurations
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :param nrsteps: number of timesteps to simulate if the voltage trace is followed by zeros (see tail_integrals)
+    :return: integrals I_LTP and I_LTD (one per configuration or trace)
+    """
+
+    if prm['veto']:
+        raise ValueError("The weight change is only linear in the amplitudes without veto.")
+
+    # Work in mV and ms, which is how the weight derivative is normalized in the Brian2 equations
+    dt_ms = 1000. * dt
+    v, filtered, nrsteps = _padding(voltage, dt, prm, filtered, nrsteps)
+    theta_low = 1000. * np.asarray(prm['Theta_low'], dtype=float)
+    theta_high = 1000. * np.asarray(prm['Theta_high'], dtype=float)
+
+    x, v_lowpass1, v_lowpass2 = dynamic_states(v, t_pre, dt, prm, filtered)
+
+    if prm['PlasticityRule'] == 'Claire':
+        ltp = x * np.maximum(v_lowpass2 - theta_high[..., np.newaxis], 0.)
+    elif prm['PlasticityRule'] == 'Clopath':
+        ltp = x * np.maximum(v - theta_high[..., np.newaxis], 0.) * np.maximum(v_lowpass2 - theta_low[..., np.newaxis],
+                                                                               0.)
+    else:
+        raise NotImplementedError(prm['PlasticityRule'])
+    ltd = x * np.maximum(v_lowpass1 - theta_low[..., np.newaxis], 0.)
+
+    # Zero voltage tail in closed form
+    tail_ltp, tail_ltd = tail_integrals(v, nrsteps, t_pre, dt, prm, theta_high, theta_low, filtered)
+
+    return dt_ms * np.sum(ltp, axis=-1) + tail_ltp, dt_ms * np.sum(ltd, axis=-1) + tail_ltd
+
+
+def _padding(voltage, dt, prm, filtered, nrsteps):
+    """
+    Decide how to handle the zero padding of a voltage trace. It is left to tail_integrals if all low-pass filters decay
+    monotonically, else the padding is explicitly appended to the trace.
+    :param voltage: voltage trace in mV (without padding)
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :param nrsteps: number of timesteps of the padded trace (None if there is no padding)
+    :return: voltage trace, function returning filtered voltages and number of timesteps to use for the integration
+    """
+
+    v = np.asarray(voltage, dtype=float)
+    if nrsteps is None or nrsteps <= v.shape[-1]:
+        return v, filtered, v.shape[-1]
+    elif decaying(dt, prm['tau_lowpass1'], prm['tau_lowpass2']):
+        return v, filtered, nrsteps
+    else:
+        return zero_padding(v, nrsteps), padded_lowpass(v, dt, nrsteps, filtered), nrsteps
+
+
+def zero_padding(voltage, nrsteps):
+    """
+    :param voltage: voltage trace(s) (time along the last axis)
+    :param nrsteps: number of timesteps of the padded traces
+    :return: voltage trace(s) followed by zeros up to nrsteps
+    """
+
+    padded = np.zeros(np.shape(voltage)[:-1] + (nrsteps,))
+    padded[..., :np.shape(voltage)[-1]] = voltage
+
+    return padded
+
+
+def threshold_sweep(signal, weights, thresholds):
+    """
+    Evaluate sum(weights * max(signal - theta, 0)) for a whole vector of thresholds theta in a single pass. The signal
+    is sorted once, after which each threshold only requires a binary search into suffix sums of the sorted values.
+    :param signal: signal to threshold (1D)
+    :param weights: weights of each sample of the signal (same shape as signal)
+    :param thresholds: array of thresholds (same unit as signal)
+    :return: array with the weighted integral above each threshold
+    """
+
+    order = np.argsort(signal)
+    values = np.asarray(signal, dtype=float)[order]
+    weights = np.asarray(weights, dtype=float)[order]
+
+    # Suffix sums (with a trailing zero) of the weights and of the weighted values
+    suffix_w = np.append(np.cumsum(weights[::-1])[::-1], 0.)
+    suffix_wv = np.append(np.cumsum((weights * values)[::-1])[::-1], 0.)
+
+    # First sorted sample strictly above each threshold
+    thresholds = np.asarray(thresholds, dtype=float)
+    first = np.searchsorted(values, thresholds, side='right')
+
+    return suffix_wv[first] - thresholds * suffix_w[first]
+
+
+def threshold_integrals(voltage, t_pre, dt, prm, theta_high, theta_low, filtered=None, nrsteps=None):
+    """
+    Potentiation and depression integrals of the Claire rule without veto (see amplitude_integrals) for a single set of
+    time constants, but for whole vectors of potentiation and depression thresholds at once.
+    :param voltage: voltage trace in mV
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters of a single configuration (its thresholds and amplitudes are ignored)
+    :param theta_high: array of potentiation thresholds (in volts)
+    :param theta_low: array of depression thresholds (in volts)
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :param nrsteps: number of timesteps to simulate if the voltage trace is followed by zeros (see tail_integrals)
+    :return: integrals I_LTP for each theta_high and I_LTD for each theta_low
+    """
+
+    if prm['veto'] or prm['PlasticityRule'] != 'Claire':
+        raise ValueError("Threshold sweeps are only available for the Claire rule without veto.")
+
+    dt_ms = 1000. * dt
+    v, filtered, nrsteps = _padding(voltage, dt, prm, filtered, nrsteps)
+    theta_high = 1000. * np.asarray(theta_high, dtype=float)
+    theta_low = 1000. * np.asarray(theta_low, dtype=float)
+
+    x, v_lowpass1, v_lowpass2 = dynamic_states(v, t_pre, dt, prm, filtered)
+    tail_ltp, tail_ltd = tail_integrals(v, nrsteps, t_pre, dt, prm, theta_high, theta_low, filtered)
+
+    ltp = dt_ms * threshold_sweep(v_lowpass2, x, theta_high) + tail_ltp
+    ltd = dt_ms * threshold_sweep(v_lowpass1, x, theta_low) + tail_ltd
+
+    return ltp, ltd
+
+
+def plasticity_kernel(voltage, t_pre, dt, prm, filtered=None, nrsteps=None):
+    """
+    Integrate the weight change of a synapse exposed to a voltage trace with the same forward-Euler scheme as the Brian2
+    simulation in simulation.py. All values are unitless: the voltage trace is in mV as stored in the data files, times
+    are in seconds and thresholds in volts (i.e. the SI values of the Brian2 quantities).
+    :param voltage: voltage trace in mV (or several traces along the leading axes, for a single configuration)
+    :param t_pre: time of the presynaptic spike (or array of spike times, one per trace)
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters (see strip_units), numerical values can be arrays of K configurations
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :param nrsteps: number of timesteps to simulate if the voltage trace is followed by zeros (handled in closed form
+    without veto, see tail_integrals)
+    :return: final weight change w_ampa (not yet normalized by the initial weight), one per configuration
+    """
+
+    a_ltp = np.asarray(prm['A_LTP'], dtype=float)
+    a_ltd = np.asarray(prm['A_LTD'], dtype=float)
+
+    # Without veto the amplitudes can be factored out of the integrals
+    if not prm['veto']:
+        i_ltp, i_ltd = amplitude_integrals(voltage, t_pre, dt, prm, filtered, nrsteps)
+        return a_ltp * i_ltp - a_ltd * i_ltd
+
+    # The veto depends on the whole history, such that the zero padding is explicitly integrated
+    v = np.asarray(voltage, dtype=float)
+    if nrsteps is not None and nrsteps > v.shape[-1]:
+        filtered = padded_lowpass(v, dt, nrsteps, filtered)
+        v = zero_padding(v, nrsteps)
+
+    # Work in mV and ms, which is how the weight derivative is normalized in the Brian2 equations
+    dt_ms = 1000. * dt
+    theta_low = 1000. * np.asarray(prm['Theta_low'], dtype=float)[..., np.newaxis]
+    theta_high = 1000. * np.asarray(prm['Theta_high'], dtype=float)[..., np.newaxis]
+
+    x, v_lowpass1, v_lowpass2 = dynamic_states(v, t_pre, dt, prm, filtered)
+
+    if prm['PlasticityRule'] == 'Claire':
+        # Veto is a low-pass of the potentiation term, which itself does not depend on the veto
+        w_ltp = a_ltp[..., np.newaxis] * x * np.maximum(v_lowpass2 - theta_high, 0.)
+        theta = lowpass(w_ltp, dt, prm['tau_theta'])
+        theta_low = theta_low + np.asarray(prm['b_theta'], dtype=float)[..., np.newaxis] * theta
+        w_ltd = a_ltd[..., np.newaxis] * x * np.maximum(v_lowpass1 - theta_low, 0.)
+    elif prm['PlasticityRule'] == 'Clopath':
+        return _clopath_veto(v, v_lowpass1, v_lowpass2, x, dt, prm)
+    else:
+        raise NotImplementedError(prm['PlasticityRule'])
+
+    return dt_ms * np.sum(w_ltp - w_ltd, axis=-1)
+
+
+def _clopath_veto(v, v_lowpass1, v_lowpass2, x, dt, prm):
+    """
+    Clopath rule with veto, where the veto feeds back into the potentiation term and thus must be stepped through time.
+    :param v: voltage trace in mV
+    :param v_lowpass1: first low-pass filtered voltage
+    :param v_lowpass2: second low-pass filtered voltage
+    :param x: presynaptic trace
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters
+    :return: final weight change w_ampa
+    """
+
+    dt_ms = 1000. * dt
+    theta_low_zero = 1000. * np.asarray(prm['Theta_low'], dtype=float)
+    theta_high = 1000. * np.asarray(prm['Theta_high'], dtype=float)
+    a_ltp = np.asarray(prm['A_LTP'], dtype=float)
+    a_ltd = np.asarray(prm['A_LTD'], dtype=float)
+    b_theta = np.asarray(prm['b_theta'], dtype=float)
+    decay = dt / np.asarray(prm['tau_theta'], dtype=float)
+
+    theta = np.zeros(np.broadcast(theta_low_zero, a_ltp, decay, x[..., 0]).shape)
+    w_ampa = np.zeros(theta.shape)
+    for i in range(v.shape[-1]):
+        theta_low = theta_low_zero + b_theta * theta
+        w_ltp = a_ltp * x[..., i] * np.maximum(v[..., i] - theta_high, 0.) \
+            * np.maximum(v_lowpass2[..., i] - theta_low, 0.)
+        w_ltd = a_ltd * x[..., i] * np.maximum(v_lowpass1[..., i] - theta_low, 0.)
+        w_ampa = w_ampa + dt_ms * (w_ltp - w_ltd)
+        theta = theta + decay * (w_ltp - theta)
+
+    return w_ampa
+
+
+def active_window(voltage, t_pre, dt, prm, tolerance, nrsteps=None):
+    """
+    The presynaptic trace is zero before t_pre and decays exponentially afterwards, such that the weight change
+    accumulated after t_pre + k * tau_x becomes negligible. This function finds the number of timesteps after which the
+    remaining plasticity is guaranteed to stay below the tolerance. The bound uses that the low-pass filtered voltages
+    never exceed the maximum of the trace (and that amplitudes and b_theta are non negative, such that the veto can only
+    raise the depression threshold).
+    :param voltage: voltage trace in mV
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters (see strip_units), numerical values can be arrays of K configurations
+    :param tolerance: maximal absolute error on the final plasticity (weight change normalized by the initial weight)
+    :param nrsteps: number of timesteps if the voltage trace is followed by zeros
+    :return: number of timesteps to integrate and achieved error bound on the plasticity of each configuration
+    """
+
+    v = np.asarray(voltage, dtype=float)
+    nrsteps = len(v) if nrsteps is None else max(nrsteps, len(v))
+    vmax = max(float(np.max(v)), 0.) if len(v) > 0 else 0.
+    theta_high = 1000. * np.asarray(prm['Theta_high'], dtype=float)
+    theta_low = 1000. * np.asarray(prm['Theta_low'], dtype=float)
+    tau_x = np.asarray(prm['tau_x'], dtype=float)
+
+    # Largest weight change per timestep and per unit of presynaptic trace
+    if prm['PlasticityRule'] == 'Claire':
+        ltp_max = np.maximum(vmax - theta_high, 0.)
+    elif prm['PlasticityRule'] == 'Clopath':
+        ltp_max = np.maximum(vmax - theta_high, 0.) * np.maximum(vmax - theta_low, 0.)
+    else:
+        raise NotImplementedError(prm['PlasticityRule'])
+    ltd_max = np.maximum(vmax - theta_low, 0.)
+    rate = 1000. * dt * np.abs(prm['x_reset']) * (np.abs(prm['A_LTP']) * ltp_max + np.abs(prm['A_LTD']) * ltd_max) \
+        / prm['w_init']
+
+    # Plasticity accumulated from timestep n on is below rate * exp((t_pre - n * dt) / tau_x) / (1 - exp(-dt / tau_x))
+    decay = np.exp(-dt / tau_x)
+    first = first_timestep(nrsteps, dt, t_pre)
+    with np.errstate(divide='ignore'):
+        needed = np.ceil((t_pre + tau_x * np.log(rate / (tolerance * (1. - decay)))) / dt)
+    end = int(min(nrsteps, max(int(np.max(first)), 1, np.max(needed))))
+    bounds = rate * np.exp((t_pre - end * dt) / tau_x) / (1. - decay) * (end < nrsteps)
+
+    return end, bounds
+
+
+def _chunks(prm, nrsteps):
+    """
+    Split a table of K configurations into chunks so that the intermediate arrays (configurations x timesteps) of the
+    kernels stay below BATCH_ELEMENTS elements.
+    :param prm: unitless plasticity parameters, with the numerical values given as arrays of length K
+    :param nrsteps: number of timesteps of the trace to simulate
+    :return: generator of (start, stop, parameters of the configurations start to stop)
+    """
+
+    columns = [name for name in prm if name not in ['PlasticityRule', 'veto']]
+    nrconfigs = max(np.size(prm[name]) for name in columns)
+    chunk = max(1, BATCH_ELEMENTS // nrsteps)
+
+    for start in range(0, nrconfigs, chunk):
+        stop = min(start + chunk, nrconfigs)
+        sub = dict(prm)
+        for name in columns:
+            if np.size(prm[name]) > 1:
+                sub[name] = prm[name][start:stop]
+        yield start, stop, sub
+
+
+def batch_kernel(voltage, t_pre, dt, prm, filtered=None, tolerance=None, nrsteps=None):
+    """
+    Integrate the weight changes of K parameter configurations on the same voltage trace, chunk by chunk. If a tolerance
+    is given, each chunk is only integrated up to the end of its active window (see active_window).
+    :param voltage: voltage trace in mV
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters, with the numerical values given as arrays of length K (see
+    table_columns) and the rule name and veto flag shared by all configurations
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :param tolerance: maximal absolute error on each plasticity allowed to truncate the simulation (None for no
+    truncation)
+    :param nrsteps: number of timesteps to simulate if the voltage trace is followed by zeros
+    :return: array with the final plasticity (weight change normalized by the initial weight) of each configuration and
+    array with the achieved error bound of each configuration
+    """
+
+    nrconfigs = max(np.size(prm[name]) for name in prm if name not in ['PlasticityRule', 'veto'])
+    plasticity = np.zeros(nrconfigs)
+    bounds = np.zeros(nrconfigs)
+    nrsteps = len(voltage) if nrsteps is None else max(nrsteps, len(voltage))
+    for start, stop, sub in _chunks(prm, nrsteps):
+        end = nrsteps
+        if tolerance is not None:
+            end, bounds[start:stop] = active_window(voltage, t_pre, dt, sub, tolerance, nrsteps)
+        plasticity[start:stop] = plasticity_kernel(voltage[:end], t_pre, dt, sub, filtered, end) / sub['w_init']
+
+    return plasticity, bounds
+
+
+def batch_integrals(voltage, t_pre, dt, prm, filtered=None, nrsteps=None):
+    """
+    Batched version of amplitude_integrals, normalized by the initial weight such that the plasticity of configuration
+    k is A_LTP[k] * ltp[k] - A_LTD[k] * ltd[k].
+    :param voltage: voltage trace in mV
+    :param t_pre: time of the presynaptic spike
+    :param dt: integration timestep
+    :param prm: unitless plasticity parameters, with the numerical values given as arrays of length K
+    :param filtered: optional function returning the filtered voltage for a given time constant (see unique_lowpass)
+    :param nrsteps: number of timesteps to simulate if the voltage trace is followed by zeros
+    :return: arrays ltp and ltd with the normalized integrals of each configuration
+    """
+
+    nrconfigs = max(np.size(prm[name]) for name in prm if name not in ['PlasticityRule', 'veto'])
+    ltp = np.zeros(nrconfigs)
+    ltd = np.zeros(nrconfigs)
+    for start, stop, sub in _chunks(prm, len(voltage)):
+        i_ltp, i_ltd = amplitude_integrals(voltage, t_pre, dt, sub, filtered, nrsteps)
+        ltp[start:stop] = i_ltp / sub['w_init']
+        ltd[start:stop] = i_ltd / sub['w_init']
+
+    return ltp, ltd
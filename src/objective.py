@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+    File name: objective.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 28/01/2019
+    Date last modified: 28/01/2019
+    Python Version: 3.5
+"""
+
+import numpy as np
+
+# Experimental plasticity of each neuron of the protocols in percent
+Targets = {'Letzkus': [92, 129, 90, 100, 118, 100, 137, 85, 100],
+           'Brandalise': [100, 144.8, 96.6, 122, 101.4, 95.5, 128.7, 101.1, 94.5,
+                          100, 131, 96.6, 100, 119.3, 104.5, 104.3, 40, 40]}
+
+# Number of repetitions of the protocol we need to simulate to get the target plasticity
+Repetitions = {'Letzkus': 150, 'Brandalise': 60}
+
+# Traces contributing to the plasticity of each neuron with their weights (supralinear and linear Brandalise traces)
+NeuronTraces = {'Letzkus': [[(t, 1.)] for t in range(9)],
+                'Brandalise': [[(0, 1.)], [(1, 0.78), (2, 0.22)], [(3, 1.)], [(4, 0.8), (5, 0.2)], [(6, 1.)], [(7, 1.)],
+                               [(8, 0.85), (9, 0.15)], [(10, 1.)], [(11, 1.)], [(12, 1.)], [(13, 0.81), (14, 0.19)],
+                               [(15, 1.)], [(16, 1.)], [(17, 0.84), (18, 0.16)], [(19, 1.)], [(20, 1.)],
+                               [(21, 0.85), (22, 0.15)], [(23, 1.)]]}
+
+# Weights of the squared errors of each neuron used to compare single parameter sets (see evaluateparameters.py)
+EvaluationWeights = {'Letzkus': [1.] * 9, 'Brandalise': [100.] * 16 + [25.] * 2}
+
+
+def mixing_matrix(protocol_type):
+    """
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :return: array of shape (number of neurons, number of traces) with the weight of each trace in each neuron
+    """
+
+    neurons = NeuronTraces[protocol_type[:10]]
+    mixing = np.zeros((len(neurons), max(t for traces in neurons for t, _ in traces) + 1))
+    for n in range(len(neurons)):
+        for t, weight in neurons[n]:
+            mixing[n, t] = weight
+
+    return mixing
+
+
+def nr_traces(protocol_type):
+    """
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :return: number of traces to simulate to score a configuration
+    """
+
+    return mixing_matrix(protocol_type).shape[1]
+
+
+def neuron_plasticities(plasticities, protocol_type):
+    """
+    :param plasticities: array of shape (K, number of traces) with the simulated plasticity of K configurations on each
+    trace (or of shape (number of traces,) for a single configuration), nan for traces that were not simulated
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :return: array of shape (K, number of neurons) with the plasticity of each neuron after all repetitions in percent
+    (nan for neurons with a trace that was not simulated)
+    """
+
+    plasticities = np.asarray(plasticities, dtype=float)
+    mixing = mixing_matrix(protocol_type)
+    missing = np.isnan(plasticities)
+    mixed = np.dot(np.where(missing, 0., plasticities), mixing.T)
+    if np.any(missing):
+        mixed[np.dot(missing, mixing.T != 0)] = np.nan
+
+    return 100 * (1 + Repetitions[protocol_type[:10]] * mixed)
+
+
+def differences(plasticities, protocol_type):
+    """
+    :param plasticities: array of shape (K, number of traces) with the simulated plasticity of K configurations on each
+    trace (or of shape (number of traces,) for a single configuration)
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :return: array of shape (K, number of neurons) with the absolute error of each neuron (nan if not simulated)
+    """
+
+    return np.abs(np.array(Targets[protocol_type[:10]]) - neuron_plasticities(plasticities, protocol_type))
+
+
+def losses(errors, weights=None):
+    """
+    :param errors: array of shape (K, number of neurons) with the absolute errors of K configurations (see differences)
+    :param weights: weights of the squared errors of each neuron (None for unweighted)
+    :return: arrays with the L-infinity and the (weighted) L2 loss of each configuration, ignoring neurons that were not
+    simulated (such that the losses of abandoned configurations are lower bounds)
+    """
+
+    errors = np.asarray(errors, dtype=float)
+    squares = errors ** 2 if weights is None else np.asarray(weights, dtype=float) * errors ** 2
+
+    return np.nanmax(errors, axis=-1), np.nansum(squares, axis=-1)
+
+
+def scores(plasticities, protocol_type, weights=None):
+    """
+    Score K parameter configurations from their plasticity matrix.
+    :param plasticities: array of shape (K, number of traces) with the simulated plasticity of K configurations on each
+    trace (or of shape (number of traces,) for a single configuration)
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :param weights: weights of the squared errors of each neuron (None for unweighted)
+    :return: arrays with the L-infinity and the (weighted) L2 loss of each configuration
+    """
+
+    return losses(differences(plasticities, protocol_type), weights)
+
+
+def pack_plasticities(plasticities):
+    """
+    :param plasticities: simulated plasticity of a configuration on each trace (nan for traces that were not simulated)
+    :return: bytes to store in the pl column of result tables, such that they can be scored again (see rescore.py)
+    """
+
+    return np.asarray(plasticities, dtype='<f8').tobytes()
+
+
+def unpack_plasticities(blob):
+    """
+    :param blob: content of the pl column of a result table (see pack_plasticities)
+    :return: array with the simulated plasticity of the configuration on each trace
+    """
+
+    return np.frombuffer(blob, dtype='<f8').astype(float)
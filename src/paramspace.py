@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+    File name: paramspace.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 28/01/2019
+    Date last modified: 28/01/2019
+    Python Version: 3.5
+"""
+
+import numpy as np
+import brian2 as b2
+
+# Scales of the units in which the parameters are usually written, such that values are unitless SI floats
+mV = 1e-3
+ms = 1e-3
+
+# Brian2 units of the parameters, which are only attached when the values are handed to a simulation (see quantity)
+Units = {'Theta_high': b2.volt, 'Theta_low': b2.volt, 'A_LTP': None, 'A_LTD': None, 'tau_lowpass1': b2.second,
+         'tau_lowpass2': b2.second, 'tau_x': b2.second, 'b_theta': None, 'tau_theta': b2.second}
+
+# Best configurations of the Claire_veto rule, used as center of the grid around which to search. Letzkus_first is the
+# first fit of the Letzkus protocol, around which the monte carlo and sampled searches were run.
+Centers = {'Letzkus': {'A_LTD': 0.00017497, 'A_LTP': 0.0000392, 'Theta_low': 5.19687991 * mV, 'b_theta': 9991.2109,
+                       'Theta_high': 25.7159892 * mV, 'tau_theta': 26.7646283 * ms, 'tau_x': 21.8613168 * ms,
+                       'tau_lowpass1': 70.4876245 * ms, 'tau_lowpass2': 2.00056053 * ms},
+           'Letzkus_first': {'A_LTD': 0.0001872, 'A_LTP': 0.00003933, 'Theta_low': 4.886 * mV, 'Theta_high': 26.04 * mV,
+                             'b_theta': 9999., 'tau_theta': 32.13 * ms, 'tau_lowpass1': 77.17 * ms,
+                             'tau_lowpass2': 2.001 * ms, 'tau_x': 20.89 * ms},
+           'Brandalise': {'A_LTD': 0.099763602, 'A_LTP': 0.01505758, 'Theta_low': 2.927871397 * mV,
+                          'Theta_high': 12.12886953 * mV, 'b_theta': 942.1754017, 'tau_theta': 114.6026989 * ms,
+                          'tau_lowpass1': 63.79366 * ms, 'tau_lowpass2': 2.853035054 * ms, 'tau_x': 4.990562943 * ms},
+           'Brandaliseb': {'A_LTD': 0.099761303, 'A_LTP': 0.013652842, 'Theta_low': 2.636491402 * mV,
+                           'Theta_high': 12.20124861 * mV, 'b_theta': 2.114599383, 'tau_theta': 75.72422075 * ms,
+                           'tau_lowpass1': 74.55801316 * ms, 'tau_lowpass2': 2.786924509 * ms,
+                           'tau_x': 5.12639093 * ms}}
+
+
+def encoding(pname, plas='Claire_noveto', prot='Letzkus'):
+    """
+    Transformation between the grid index of a parameter and its value, which is value = origin * base ** (step * index)
+    for logarithmic parameters and value = origin + step * index otherwise.
+    :param pname: Name of the parameter
+    :param plas: Type of plasticity rule used
+    :param prot: Center of the grid of the Claire_veto rule (see Centers)
+    :return: origin, step and base of the logarithm (None for linear parameters)
+    """
+
+    if plas == 'Claire_noveto':
+        if pname in ['Theta_high', 'Theta_low']:
+            return -5 * mV, 5 * mV, None
+        elif pname in ['A_LTP', 'A_LTD']:
+            return 1e-6, 1., 10.
+        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x']:
+            return ms / 3., 1., 3.
+        else:
+            raise ValueError(pname)
+    elif plas == 'Claire_veto':
+        if prot not in Centers:
+            raise ValueError(prot)
+        center = Centers[prot][pname] if pname in Centers[prot] else None
+        if pname in ['Theta_high', 'Theta_low']:
+            return center, 8 * mV, None
+        elif pname in ['A_LTP', 'A_LTD']:
+            return center, 1., 10.
+        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'tau_theta', 'b_theta']:
+            return center, 1., 4.
+        else:
+            raise ValueError(pname)
+    else:
+        raise ValueError(plas)
+
+
+def values(pname, indexes, plas='Claire_noveto', prot='Letzkus'):
+    """
+    Transform grid indexes of a parameter to the corresponding parameter values in bulk.
+    :param pname: Name of the parameter
+    :param indexes: Index (or array of indexes) of the parameter values
+    :param plas: Type of plasticity rule used
+    :param prot: Center of the grid of the Claire_veto rule (see Centers)
+    :return: array of unitless SI values of the same shape as the indexes
+    """
+
+    origin, step, base = encoding(pname, plas, prot)
+    indexes = np.asarray(indexes, dtype=float)
+    if base is None:
+        return origin + step * indexes
+    else:
+        return origin * base ** (step * indexes)
+
+
+def indexes(pname, vals, plas='Claire_noveto', prot='Letzkus'):
+    """
+    Transform values of a parameter back to their (not necessarily integer) grid indexes in bulk.
+    :param pname: Name of the parameter
+    :param vals: Unitless SI value (or array of values) of the parameter, or Brian2 quantities
+    :param plas: Type of plasticity rule used
+    :param prot: Center of the grid of the Claire_veto rule (see Centers)
+    :return: array of indexes of the same shape as the values
+    """
+
+    origin, step, base = encoding(pname, plas, prot)
+    vals = np.asarray(vals, dtype=float)
+    if base is None:
+        return (vals - origin) / step
+    else:
+        return np.log(vals / origin) / np.log(base) / step
+
+
+def quantity(pname, vals):
+    """
+    Attach the Brian2 unit of a parameter to its values, which should only be done when handing them to a simulation.
+    :param pname: Name of the parameter
+    :param vals: Unitless SI value (or array of values) of the parameter
+    :return: Brian2 quantity (or float for dimensionless scalars)
+    """
+
+    vals = np.asarray(vals, dtype=float)
+    if Units[pname] is None:
+        return float(vals) if vals.ndim == 0 else vals
+    else:
+        return vals * Units[pname]
+
+
+def set_param(pname, index, plas='Claire_noveto', prot='Letzkus'):
+    """
+    This function will transform the given index to the corresponding parameter value, with its Brian2 unit.
+    :param pname: Name of the parameter to set
+    :param index: Index of the parameter value
+    :param plas: Type of plasticity rule used
+    :param prot: Center of the grid of the Claire_veto rule (see Centers)
+    :return: return the value for desired parameter to set
+    """
+
+    return quantity(pname, values(pname, index, plas, prot))
@@ -5,18 +5,43 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 27/12/2018
-    Date last modified: 28/12/2018
+    Date last modified: 25/01/2019
     Python Version: 3.5
 """
 
 import pandas as pd
 import numpy as np
+from tracestore import Prespikes, bundle_path
+
+# Number of timesteps simulated for each trace (the samples of a trace being followed by zeros up to this length)
+Durations = {'Letzkus': 10000, 'Brandalise': 100000}
+
+# Sampling interval of the voltage traces in seconds
+SamplingInterval = 0.0001
+
+
+def pack_traces(protocol_type, traces):
+    """
+    Pack all the voltage traces of a protocol into a single bundle file. Only the actual samples are stored (without the
+    zero padding) together with their offsets, such that the simulator can handle the padding in closed form.
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :param traces: list of unpadded voltage traces (in mV)
+    """
+
+    prespikes = Prespikes[protocol_type] + [np.nan] * (len(traces) - len(Prespikes[protocol_type]))
+    np.savez(bundle_path(protocol_type),
+             samples=np.concatenate(traces),
+             offsets=np.cumsum([0] + [len(trace) for trace in traces]),
+             prespike=np.array(prespikes[:len(traces)]),
+             nrsteps=np.array([Durations[protocol_type]] * len(traces)),
+             dt=np.array(SamplingInterval))
+
 
 if __name__ == "__main__":
     """
     Removes unnecessary columns and rows from the original data and renormalizes it using the average of the first rows
-    of each column as baseline. The preprocessed voltage traces are then saved in a new csv file. Also saves each 
-    individual trace to a numpy array in its corresponding npy file.
+    of each column as baseline. The preprocessed voltage traces are then saved in a new csv file. Also saves all the
+    unpadded traces of a protocol to a trace bundle (see pack_traces).
     """
 
     # Clean Brandalise voltage traces
@@ -36,18 +61,18 @@ if __name__ == "__main__":
     c = 1000 * c  # Letzkus is in volts, so we convert to mV
     c.to_csv('../Data/Letzkus_clean.csv', header=None, index=False)
 
-    # Save traces to numpy arrays for Brandalise
+    # Save the traces of Brandalise to a bundle
     c = pd.read_csv('../Data/Brandalise_clean.csv', header=None)
+    unpadded = []
     for i in range(c.shape[1]):
         a = c.as_matrix([i])
-        a = a[~np.isnan(a)]
-        a = np.append(a, [0.0] * (100000 - len(a)))
-        np.save('../Data/B_{}'.format(i), a)
+        unpadded.append(a[~np.isnan(a)])
+    pack_traces('Brandalise', unpadded)
 
-    # Save traces to numpy arrays for Letzkus
+    # Save the traces of Letzkus to a bundle
     c = pd.read_csv('../Data/Letzkus_clean.csv', header=None)
+    unpadded = []
     for i in range(c.shape[1]):
         a = c.as_matrix([i])
-        a = a[~np.isnan(a)]
-        a = np.append(a, [0.0] * (10000 - len(a)))
-        np.save('../Data/L_{}'.format(i), a)
+        unpadded.append(a[~np.isnan(a)])
+    pack_traces('Letzkus', unpadded)
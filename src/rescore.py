@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+    File name: rescore.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 28/01/2019
+    Date last modified: 28/01/2019
+    Python Version: 3.5
+"""
+
+import glob
+import sqlite3
+import numpy as np
+import objective
+
+
+def rescore(db_name, table_name, protocol_type, weights=None):
+    """
+    Recompute the losses of all configurations of a result table from their stored plasticities (see
+    objective.pack_plasticities) with the current objective, without simulating anything. Rows without plasticities
+    (unfinished or stored before plasticities were kept) are left untouched.
+    :param db_name: path of the sqlite result database
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param protocol_type: Whether the configurations were fit on the 'Letzkus' or 'Brandalise' voltage traces.
+    :param weights: weights of the squared errors of each neuron (None for unweighted)
+    :return: number of rescored configurations
+    """
+
+    db = sqlite3.connect(db_name)
+    columns = [row[1] for row in db.execute('PRAGMA table_info({})'.format(table_name))]
+    if 'pl' not in columns:
+        db.close()
+        return 0
+
+    # Score all configurations at once
+    rows = db.execute('SELECT id, pl FROM {} WHERE pl IS NOT NULL'.format(table_name)).fetchall()
+    if len(rows) > 0:
+        plasticities = np.array([objective.unpack_plasticities(row[1]) for row in rows])
+        li, l2 = objective.scores(plasticities, protocol_type, weights)
+
+        # Update database in a single transaction
+        with db:
+            db.executemany('UPDATE {} SET li = ?, l2 = ? WHERE id = ?'.format(table_name),
+                           zip(li.tolist(), l2.tolist(), [row[0] for row in rows]))
+    db.close()
+
+    return len(rows)
+
+
+if __name__ == "__main__":
+
+    # Specifics of the databases to rescore (targets, repetitions and mixing are set in objective.py)
+    algo = 'gridresults_'
+    protocol = 'Brandalise'
+    granularity = 3
+    plasticity = 'Claire'
+    veto = True
+    weighted = False  # whether or not to use the weights of evaluateparameters.py
+
+    table = plasticity + '_veto' if veto else plasticity + '_noveto'
+    for name in sorted(glob.glob('../Data/' + algo + protocol + '_g' + str(granularity) + '_j*.db')):
+        nr = rescore(name, table, protocol, objective.EvaluationWeights[protocol[:10]] if weighted else None)
+        print('{}: {} configurations rescored'.format(name, nr))
@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+
+"""
+    File name: resultdb.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 28/01/2019
+    Date last modified: 28/01/2019
+    Python Version: 3.5
+"""
+
+import os
+import sys
+import time
+import queue
+import socket
+import atexit
+import signal
+import threading
+from collections import OrderedDict
+from sqlalchemy.exc import OperationalError
+
+# Columns of the result tables holding the grid index of each parameter
+Columns = {'Theta_high': 'th', 'Theta_low': 'tl', 'A_LTP': 'ap', 'A_LTD': 'ad', 'tau_lowpass1': 't1',
+           'tau_lowpass2': 't2', 'tau_x': 'tx', 'b_theta': 'bt', 'tau_theta': 'tt'}
+
+# Losses of the rows of configurations that are not scored yet, which may be leased to a worker simulating them until
+# the expiry of the lease (see claim)
+Unfinished = 9999999999999999
+
+# Duration in seconds of the lease of a worker on a configuration, after which another worker may claim it again. Must
+# exceed the time to simulate a configuration and write its row (see FlushDelay).
+LeaseTime = 3600.
+
+# Number of buffered rows and delay in seconds since the last flush after which result writers flush their buffer
+FlushRows = 1024
+FlushDelay = 60.
+
+# Number of rows handed over to a background result writer that may wait to be buffered before the simulation waits
+QueueSize = 4096
+
+
+def key_parameters(veto):
+    """
+    :param veto: whether or not the veto mechanism is used
+    :return: list of the names of the parameters identifying a configuration in the result tables
+    """
+
+    names = ['Theta_high', 'Theta_low', 'A_LTP', 'A_LTD', 'tau_lowpass1', 'tau_lowpass2', 'tau_x']
+    if veto:
+        names += ['b_theta', 'tau_theta']
+
+    return names
+
+
+def index_table(table, veto):
+    """
+    Create the composite index of a result table on the columns identifying a configuration (if not already there),
+    such that looking up a configuration does not scan the whole table.
+    :param table: database table containing the simulation results
+    :param veto: whether or not the veto mechanism is used
+    """
+
+    columns = [Columns[p] for p in key_parameters(veto)]
+    for column in columns + ['li', 'l2']:
+        if not table.has_column(column):
+            table.create_column_by_example(column, 0.)
+    table.create_index(columns, table.name + '_key')
+
+
+def is_unfinished(loss):
+    """
+    :param loss: loss of a row of a result table
+    :return: whether or not the row is not scored yet (REAL columns store Unfinished rounded to the nearest float)
+    """
+
+    return loss == Unfinished or loss == float(Unfinished)
+
+
+def wal_mode(database):
+    """
+    Switch a database to write-ahead logging, such that it can be read while another connection writes into it.
+    :param database: database to switch
+    """
+
+    database.query('PRAGMA journal_mode=WAL;')
+
+
+def owner():
+    """
+    :return: identifier of this worker in the leases of the result tables
+    """
+
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def lease_table(database, table_name, veto):
+    """
+    Prepare a result table shared by several workers for claiming its configurations: the owner of the lease of a row
+    and the time at which it expires are stored in columns ow and ex, and the database uses write-ahead logging. The
+    table, all the columns the workers may write and the index of the configurations are created up front in SQL, before
+    the table is loaded, such that workers do not race to create them.
+    :param database: database containing the result table
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param veto: whether or not the veto mechanism is used
+    """
+
+    wal_mode(database)
+    keys = [Columns[p] for p in key_parameters(veto)]
+    columns = [(c, 'REAL') for c in keys] + [('li', 'REAL'), ('l2', 'REAL'), ('ls', 'REAL'), ('fi', 'INTEGER'),
+                                             ('lb', 'INTEGER'), ('pl', 'BLOB'), ('ow', 'TEXT'), ('ex', 'REAL')]
+
+    database.query('CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY);'.format(table_name))
+    existing = [row['name'] for row in database.query('PRAGMA table_info({});'.format(table_name))]
+    for column, sqltype in columns:
+        if column not in existing:
+            try:
+                database.query('ALTER TABLE {} ADD COLUMN {} {};'.format(table_name, column, sqltype))
+            except OperationalError as error:
+                # Another worker created the column in the meantime
+                if 'duplicate column' not in str(error):
+                    raise
+    database.query('CREATE INDEX IF NOT EXISTS {0}_key ON {0} ({1});'.format(table_name, ', '.join(keys)))
+    database.commit()
+
+
+def claim(database, table, row_id, worker):
+    """
+    Atomically lease an unscored row of a result table, if it is not leased or its lease expired (e.g. its worker was
+    killed). The row is released when its scores are written with ow and ex set to None.
+    :param database: database containing the result table (see lease_table)
+    :param table: database table containing the simulation results
+    :param row_id: id of the row to claim
+    :param worker: identifier of the claiming worker (see owner)
+    :return: whether or not the row was claimed
+    """
+
+    now = time.time()
+    database.begin()
+    try:
+        result = database.query('UPDATE {} SET ow = :ow, ex = :ex WHERE id = :id AND l2 IN (:unfinished, '
+                                ':rounded) AND (ow IS NULL OR ex < :now);'.format(table.name), ow=worker,
+                                ex=now + LeaseTime, id=row_id, unfinished=Unfinished, rounded=float(Unfinished),
+                                now=now)
+        claimed = result.result_proxy.rowcount == 1
+        database.commit()
+    except BaseException:
+        database.rollback()
+        raise
+
+    return claimed
+
+
+def claim_configuration(database, table, key, worker):
+    """
+    Atomically lease a configuration of a result table, inserting an unscored row for it if it is not in the table yet.
+    :param database: database containing the result table (see lease_table)
+    :param table: database table containing the simulation results
+    :param key: dictionary of the indexes of the configuration in the columns identifying it (see Columns)
+    :param worker: identifier of the claiming worker (see owner)
+    :return: id of the claimed row, or None if the configuration is scored or leased by another worker
+    """
+
+    condition = ' AND '.join('{0} = :{0}'.format(column) for column in key)
+    database.begin()
+    try:
+        database.query('INSERT INTO {0} ({1}, li, l2) SELECT {2}, :unfinished, :unfinished WHERE NOT EXISTS (SELECT 1 '
+                       'FROM {0} WHERE {3});'.format(table.name, ', '.join(key), ', '.join(':' + c for c in key),
+                                                     condition), unfinished=Unfinished, **key)
+        row = next(iter(database.query('SELECT id FROM {} WHERE {} AND l2 IN (:unfinished, :rounded) LIMIT 1;'.format(
+            table.name, condition), unfinished=Unfinished, rounded=float(Unfinished), **key)), None)
+        database.commit()
+    except BaseException:
+        database.rollback()
+        raise
+
+    if row is None or not claim(database, table, row['id'], worker):
+        return None
+
+    return row['id']
+
+
+class VisitedConfigurations(object):
+    """
+    In-process map of the configurations of a result table to their score (the L2 loss l2, which the Monte-Carlo
+    acceptance step compares), loaded once at start-up and kept up to date with the rows inserted by the process, such
+    that looking up whether a configuration was already visited does not query the database. Configurations missing from
+    the map are still looked up in the (indexed) table, as other processes sharing the database may have inserted them
+    since. Rows only holding a lower bound of the loss (lb=1, see branchbound.bounded_losses) are ignored, as well as
+    rows that are not scored yet unless the table is shared with workers that may still be simulating them.
+    """
+
+    def __init__(self, database, table, veto, shared=False):
+        """
+        :param database: database containing the result table
+        :param table: database table containing the simulation results
+        :param veto: whether or not the veto mechanism is used
+        :param shared: whether or not the table is shared with other workers (see claim_configuration)
+        """
+
+        self.table = table
+        self.parameters = key_parameters(veto)
+        self.columns = [Columns[p] for p in self.parameters]
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+        index_table(table, veto)
+        columns = self.columns + ['l2'] + (['lb'] if table.has_column('lb') else [])
+        self.scores = {}
+        for row in database.query('SELECT {} FROM {}'.format(', '.join(columns), table.name)):
+            if self.scored(row):
+                self.scores[tuple(float(row[c]) for c in self.columns)] = row['l2']
+
+    def scored(self, row):
+        """
+        :param row: row of the result table
+        :return: whether or not the score of the row can be served for its configuration
+        """
+
+        return not row.get('lb') and (self.shared or not is_unfinished(row['l2']))
+
+    def key(self, idxs):
+        """
+        :param idxs: dictionary of indexes describing the position of the configuration on the grid
+        :return: hashable key of the configuration
+        """
+
+        return tuple(float(idxs[p]) for p in self.parameters)
+
+    def score(self, idxs):
+        """
+        :param idxs: dictionary of indexes describing the position of the configuration on the grid
+        :return: score of the configuration, or None if it was not visited yet
+        """
+
+        key = self.key(idxs)
+        if key in self.scores:
+            self.hits += 1
+            return self.scores[key]
+
+        self.misses += 1
+        for row in self.table.find(**dict(zip(self.columns, key))):
+            if self.scored(row):
+                self.scores[key] = row['l2']
+                return row['l2']
+
+        return None
+
+    def refresh(self, idxs):
+        """
+        :param idxs: dictionary of indexes describing the position of the configuration on the grid
+        :return: score of the configuration read again from the result table (e.g. once written by another worker), or
+        None if it is not in the table
+        """
+
+        self.scores.pop(self.key(idxs), None)
+
+        return self.score(idxs)
+
+    def add(self, idxs, score):
+        """
+        Record the score of a configuration inserted into (or updated in) the result table.
+        :param idxs: dictionary of indexes describing the position of the configuration on the grid
+        :param score: score of the configuration (the L2 loss l2)
+        """
+
+        self.scores[self.key(idxs)] = score
+
+    def __len__(self):
+        return len(self.scores)
+
+
+def terminate(signum, _):
+    """
+    Exit when the job is terminated (e.g. preempted by the batch scheduler), such that the buffers of the result writers
+    are flushed on exit.
+    :param signum: number of the received signal
+    """
+
+    sys.exit(128 + signum)
+
+
+class ResultWriter(object):
+    """
+    Write-behind buffer of the rows inserted into or updated in a result table. The buffer is flushed in one transaction
+    with bulk inserts and updates (executemany) every FlushRows rows or FlushDelay seconds, such that simulations do not
+    wait for a commit per configuration, and on exit, including when the job is terminated with SIGTERM.
+    """
+
+    def __init__(self, database, table, maxrows=None, maxdelay=None, on_flush=None):
+        """
+        :param database: database containing the result table
+        :param table: database table to write the simulation results into
+        :param maxrows: number of buffered rows after which the buffer is flushed (None for FlushRows)
+        :param maxdelay: delay in seconds since the last flush after which the buffer is flushed (None for FlushDelay)
+        :param on_flush: function called with the progress of the job (see set_progress) in the transaction of each
+        flush, e.g. to checkpoint it consistently with the flushed rows (None for nothing)
+        """
+
+        self.database = database
+        self.table = table
+        self.name = table.name
+        self.maxrows = FlushRows if maxrows is None else maxrows
+        self.maxdelay = FlushDelay if maxdelay is None else maxdelay
+        self.on_flush = on_flush
+        self.progress = None
+        self.inserts = []
+        self.updates = OrderedDict()
+        self.nrrows = 0
+        self.last_flush = time.time()
+
+        atexit.register(self.flush)
+        signal.signal(signal.SIGTERM, terminate)
+
+    def insert(self, row):
+        """
+        Buffer a row to insert into the result table.
+        :param row: dictionary of the values of the columns of the row
+        """
+
+        self.create_columns(row)
+        self.inserts.append(dict(row))
+        self.nrrows += 1
+        self.flush_if_due()
+
+    def update(self, row, keys):
+        """
+        Buffer the update of a row of the result table.
+        :param row: dictionary of the values of the columns of the row
+        :param keys: names of the columns identifying the row to update (e.g. ['id'])
+        """
+
+        self.create_columns(row)
+
+        # Rows are updated in bulk with the other rows updating the same columns
+        group = (tuple(keys), tuple(sorted(row)))
+        self.updates.setdefault(group, []).append(dict(row))
+        self.nrrows += 1
+        self.flush_if_due()
+
+    def create_columns(self, row):
+        """
+        Create the columns of a row missing from the result table, outside of the transaction of a flush (schema changes
+        within a transaction are not safe once a background writer runs).
+        :param row: dictionary of the values of the columns of the row
+        """
+
+        for column, value in row.items():
+            if not self.table.has_column(column) and value is not None:
+                self.table.create_column_by_example(column, value)
+
+    def set_progress(self, progress):
+        """
+        Record the progress the job will have made once all the rows handed over so far are written.
+        :param progress: progress of the job, passed to on_flush
+        """
+
+        self.progress = progress
+
+    def flush_if_due(self):
+        """
+        Flush the buffer if it holds too many rows or was last flushed too long ago.
+        """
+
+        if self.nrrows >= self.maxrows or time.time() - self.last_flush >= self.maxdelay:
+            self.write()
+
+    def flush(self):
+        """
+        Write all the rows handed over so far into the result table.
+        """
+
+        self.write()
+
+    def write(self):
+        """
+        Write all buffered rows into the result table in one transaction.
+        """
+
+        if self.nrrows == 0 and self.on_flush is None:
+            self.last_flush = time.time()
+            return
+
+        self.database.begin()
+        try:
+            if len(self.inserts) > 0:
+                self.table.insert_many(self.inserts)
+            for (keys, _), rows in self.updates.items():
+                self.table.update_many(rows, list(keys))
+            if self.on_flush is not None:
+                self.on_flush(self.progress)
+            self.database.commit()
+        except BaseException:
+            self.database.rollback()
+            raise
+
+        self.inserts = []
+        self.updates = OrderedDict()
+        self.nrrows = 0
+        self.last_flush = time.time()
+
+
+class BackgroundResultWriter(ResultWriter):
+    """
+    Result writer whose buffer is filled and flushed by a background thread, such that the simulation never waits for
+    SQLite, unless the bounded queue of rows handed over to the thread is full (back-pressure). Rows handed over are
+    only visible in the result table once flushed, so configurations must be looked up in in-process maps updated when
+    handing rows over (see VisitedConfigurations). The database is switched to write-ahead logging, such that the
+    simulation can still read it while the thread writes.
+    """
+
+    def __init__(self, database, table, maxrows=None, maxdelay=None, on_flush=None, queuesize=None):
+        """
+        :param database: database containing the result table
+        :param table: database table to write the simulation results into
+        :param maxrows: number of buffered rows after which the buffer is flushed (None for FlushRows)
+        :param maxdelay: delay in seconds since the last flush after which the buffer is flushed (None for FlushDelay)
+        :param on_flush: function called with the progress of the job in the transaction of each flush (None for none)
+        :param queuesize: number of rows handed over that may wait to be buffered (None for QueueSize)
+        """
+
+        ResultWriter.__init__(self, database, table, maxrows, maxdelay, on_flush)
+        wal_mode(database)
+
+        self.queue = queue.Queue(QueueSize if queuesize is None else queuesize)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        Buffer the rows handed over to the thread and flush them when due, until the process exits.
+        """
+
+        while True:
+            try:
+                method, args = self.queue.get(timeout=max(0., self.maxdelay - time.time() + self.last_flush))
+            except queue.Empty:
+                method, args, done = ResultWriter.flush_if_due, (), None
+            else:
+                done = self.queue.task_done
+            try:
+                if self.error is None:
+                    method(self, *args)
+            except BaseException as error:
+                self.error = error
+            if done is not None:
+                done()
+
+    def hand_over(self, method, *args):
+        """
+        Queue a call of a method of the synchronous writer for the thread, waiting if the queue is full.
+        :param method: method of ResultWriter
+        :param args: arguments of the method
+        """
+
+        if self.error is not None:
+            raise self.error
+        self.queue.put((method, args))
+
+    def insert(self, row):
+        """
+        Hand over a row to insert into the result table.
+        :param row: dictionary of the values of the columns of the row
+        """
+
+        self.hand_over(ResultWriter.insert, dict(row))
+
+    def update(self, row, keys):
+        """
+        Hand over the update of a row of the result table.
+        :param row: dictionary of the values of the columns of the row
+        :param keys: names of the columns identifying the row to update (e.g. ['id'])
+        """
+
+        self.hand_over(ResultWriter.update, dict(row), list(keys))
+
+    def set_progress(self, progress):
+        """
+        Hand over the progress the job will have made once all the rows handed over so far are written.
+        :param progress: progress of the job, passed to on_flush
+        """
+
+        self.hand_over(ResultWriter.set_progress, progress)
+
+    def flush(self):
+        """
+        Wait until all the rows handed over so far are written into the result table.
+        """
+
+        self.hand_over(ResultWriter.write)
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+
+def result_writer(database, table, background=False, on_flush=None):
+    """
+    :param database: database containing the result table
+    :param table: database table to write the simulation results into
+    :param background: whether or not to write the results from a background thread
+    :param on_flush: function called with the progress of the job in the transaction of each flush (None for nothing)
+    :return: writer buffering the rows of the result table
+    """
+
+    if background:
+        return BackgroundResultWriter(database, table, on_flush=on_flush)
+    else:
+        return ResultWriter(database, table, on_flush=on_flush)
@@ -5,7 +5,7 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 22/01/2018
-    Date last modified: 22/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
@@ -14,6 +14,10 @@ import dataset
 import warnings
 import random as rnd
 from simulation import *
+import objective
+import paramspace
+import resultdb
+from screening import online_screening_cut
 from os.path import isfile
 
 
@@ -22,42 +26,19 @@ warnings.filterwarnings("error")
 
 def set_param(pname, index, plas='Claire_noveto'):
     """
-    This function will either transform the given index to the corresponding parameter value or sample an index in the
-    right parameter range to produce a randomly sampled value for the desired parameter.
+    This function will transform the given index to the corresponding parameter value, on the grid centered on the first
+    fit of the Letzkus protocol (see paramspace.py).
     :param pname: Name of the parameter to set
     :param index: Index of the parameter value
     :param plas: Type of plasticity rule used
     :return: return the value for desired parameter to set
     """
 
-    if plas == 'Claire_noveto':
-        if pname in ['Theta_high', 'Theta_low']:
-            return (-5 + 5 * index) * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return 10 ** (index - 6)
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x']:
-            return 3 ** (index - 1) * b2.ms
-        else:
-            raise ValueError(pname)
-    elif plas == 'Claire_veto':
-
-        cbest = {'A_LTD': 0.0001872, 'A_LTP': 0.00003933, 'Theta_low': 4.886 * b2.mV, 'Theta_high': 26.04 * b2.mV,
-                 'b_theta': 9999., 'tau_theta': 32.13 * b2.ms, 'tau_lowpass1': 77.17 * b2.ms,
-                 'tau_lowpass2': 2.001 * b2.ms, 'tau_x': 20.89 * b2.ms}
-
-        if pname in ['Theta_high', 'Theta_low']:
-            return cbest[pname] + 8 * index * b2.mV
-        elif pname in ['A_LTP', 'A_LTD']:
-            return cbest[pname] * 10 ** index
-        elif pname in ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'tau_theta', 'b_theta']:
-            return cbest[pname] * 4 ** index
-        else:
-            raise ValueError(pname)
-    else:
-        raise ValueError(plas)
+    return paramspace.set_param(pname, index, plas, 'Letzkus_first')
 
 
-def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0, jid=0):
+def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0, jid=0, engine='brian2',
+         screen=False, background=False):
     """
     Parameter search script that randomly samples parameter configurations to test through simulation according to a
     distribution determined by a loss expectation evaluated by a previous parameter search run with lower granularity.
@@ -66,6 +47,9 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     :param veto: bool whether or not to use a veto mechanism between LTP and LTD
     :param granularity: int describing how fine the param search will be (Note: the range is also decreased for that)
     :param jid: id of the job running the montecarlo search. Necessary for splitting the grid search in case of split.
+    :param engine: simulation backend to use ('brian2' or 'numpy')
+    :param screen: whether or not to screen configurations with a cheap simulation before the reference simulation
+    :param background: whether or not to write the results from a background thread (see resultdb.result_writer)
     """
 
     # Set random seed to current time to have different seeds for each of the many jobs
@@ -75,19 +59,9 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     # Define some variables depending on the protocol type
     ####################################################################################################################
 
-    if protocol_type is 'Brandalise':
-        nrtraces = 24
-        nrneurons = 18
-        repets = 60
-        targets = [100, 144.8, 96.6, 122, 101.4, 95.5, 128.7, 101.1, 94.5,
-                   100, 131, 96.6, 100, 119.3, 104.5, 104.3, 40, 40]
-    elif protocol_type is 'Letzkus':
-        nrtraces = 9
-        nrneurons = 9
-        repets = 150
-        targets = [92, 129, 90, 100, 118, 100, 137, 85, 100]
-    else:
+    if protocol_type not in objective.Targets:
         raise ValueError(protocol_type)
+    nrtraces = objective.nr_traces(protocol_type)
 
     ####################################################################################################################
     # Connect to database (Sqlite database corresponding to the plasticity model used)
@@ -98,8 +72,16 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     db_name = '../Data/sampleresults_' + protocol_type + '_g' + str(granularity) + '_j' + str(jid) + '.db'
     db = dataset.connect('sqlite:///' + db_name)
     table_name = plasticity + '_veto' if veto else plasticity + '_noveto'
+
+    # Configurations are claimed with leases, such that several workers can share the database and the configurations of
+    # killed workers are simulated again once their lease expired
+    worker = resultdb.owner()
+    resultdb.lease_table(db, table_name, veto)
     the_table = db.create_table(table_name)
 
+    # Rows are buffered and written in one transaction every resultdb.FlushRows rows or resultdb.FlushDelay seconds
+    writer = resultdb.result_writer(db, the_table, background)
+
     ####################################################################################################################
     # Plasticity parameters initializations
     ####################################################################################################################
@@ -126,6 +108,7 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
     # Initialize some variables
     nr_iterations = 10000000
     nrs = 0
+    screened = []
 
     print('\nStarting Sample Search:')
 
@@ -140,7 +123,7 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
         if query is None:
             query = the_table.find_one(id=the_table.count())
 
-        if query['l2'] == 9999999999999999:
+        if resultdb.is_unfinished(query['l2']) and resultdb.claim(db, the_table, query['id'], worker):
 
             nrs += 1
             print("Computed configurations = {}".format(nrs))
@@ -153,33 +136,37 @@ def main(protocol_type='Letzkus', plasticity='Claire', veto=False, granularity=0
             #            Run Simulations of all traces with new parameters and get plasticity
             ############################################################################################################
 
-            # Initialize plasticity array
-            p = [0] * nrtraces
-
-            # Iterate through all available traces
-            for t in range(nrtraces):
-
-                # Simulate traces and store plasticities
-                p[t], _ = simulate(protocol_type, t, parameters)
-
-            # If Brandalise weight supralinear and linear trace plasticity contributions
-            if protocol_type == 'Brandalise':
-                p = [p[0], 0.78 * p[1] + 0.22 * p[2], p[3], 0.8 * p[4] + 0.2 * p[5], p[6], p[7],
-                     0.85 * p[8] + 0.15 * p[9], p[10], p[11], p[12], 0.81 * p[13] + 0.19 * p[14], p[15], p[16],
-                     0.84 * p[17] + 0.16 * p[18], p[19], p[20], 0.85 * p[21] + 0.15 * p[22], p[23]]
-
-            ############################################################################################################
-            #  Compute score and update database
-            ############################################################################################################
-
-            # Compute score
-            differences = [abs(targets[t] - 100 * (1 + repets * p[t])) for t in range(nrneurons)]
-            new_score = sum([d ** 2 for d in differences])
+            # Screen the configuration with the cheap simulation first if required, and only promote it if promising
+            row = dict(id=query['id'], ow=None, ex=None)
+            for fidelity in ([0, 1] if screen else [1]):
+
+                # Simulate all available traces at once
+                if fidelity == 0:
+                    p = list(simulate_protocol(protocol_type, parameters, nrtraces, 'numpy',
+                                               ScreeningParameters['method'], ScreeningParameters['timestep']))
+                else:
+                    p = list(simulate_protocol(protocol_type, parameters, nrtraces, engine))
+
+                ########################################################################################################
+                #  Compute score
+                ########################################################################################################
+
+                max_error, new_score = [float(loss) for loss in objective.scores(p, protocol_type)]
+                row.update(li=max_error, l2=new_score, pl=objective.pack_plasticities(p))
+
+                # Configurations that are not promoted keep their screening score
+                if screen:
+                    row['fi'] = fidelity
+                    if fidelity == 0:
+                        row['ls'] = new_score
+                        if not online_screening_cut(new_score, screened, ScreeningParameters['quantile'],
+                                                    ScreeningParameters['threshold']):
+                            break
 
             # Update database
-            the_table.update(dict(id=query['id'], li=max(differences), l2=new_score), ['id'])
+            writer.update(row, ['id'])
 
-            db.commit()
+    writer.flush()
 
     return 0
 
@@ -199,9 +186,13 @@ if __name__ == "__main__":
     ptype = 'Letzkus'
     rule_name = 'Claire'
     vetoing = False
+    backend = 'numpy'
+    screening = False
+    writing = False
 
     # Run
-    exi = main(ptype, rule_name, veto=vetoing, granularity=g, jid=j)
+    exi = main(ptype, rule_name, veto=vetoing, granularity=g, jid=j, engine=backend, screen=screening,
+               background=writing)
 
     if exi is 0:
         print('\nSample search finished successfully!')
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+    File name: screening.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 27/01/2019
+    Date last modified: 27/01/2019
+    Python Version: 3.5
+"""
+
+import numpy as np
+
+# Number of screened configurations a job must have seen before the quantile of their losses is used for promotion
+WARMUP = 10
+
+
+def screening_cut(losses, quantile=None, threshold=None, history=None):
+    """
+    Single screening cut from the cheap screening simulation to the reference simulation: among configurations
+    evaluated with the screening simulation, only the ones with a loss below the given quantile of the losses and below
+    the threshold are promoted to the reference simulation.
+    :param losses: screening losses of the configurations
+    :param quantile: fraction of the configurations to promote (None to promote all)
+    :param threshold: loss above which configurations are never promoted (None for no threshold)
+    :param history: list of the screening losses seen so far by the job, which is updated with the new losses. If
+    given, the quantile is taken over all of them instead of the new losses only, and all configurations are promoted
+    (unless above the threshold) until more than WARMUP losses were seen.
+    :return: array with the indexes of the promoted configurations
+    """
+
+    losses = np.asarray(losses, dtype=float)
+    reference = losses
+    if history is not None:
+        history.extend(losses.tolist())
+        reference = history if len(history) > WARMUP else []
+
+    promoted = np.ones(len(losses), dtype=bool)
+    if threshold is not None:
+        promoted &= losses <= threshold
+    if quantile is not None and len(reference) > 0:
+        promoted &= losses <= np.quantile(reference, quantile)
+
+    return np.flatnonzero(promoted)
+
+
+def online_screening_cut(loss, history, quantile=None, threshold=None):
+    """
+    Screening cut of configurations screened one at a time, using the quantile of the losses of all configurations
+    screened so far by the job (see screening_cut).
+    :param loss: screening loss of the configuration
+    :param history: list of the screening losses seen so far, which is updated with the new loss
+    :param quantile: fraction of the configurations to promote (None to promote all)
+    :param threshold: loss above which configurations are never promoted (None for no threshold)
+    :return: whether or not to promote the configuration to the reference simulation
+    """
+
+    return len(screening_cut([loss], quantile, threshold, history)) == 1
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+    File name: searchspace.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 28/01/2019
+    Date last modified: 28/01/2019
+    Python Version: 3.5
+"""
+
+import os
+import json
+import itertools
+import numpy as np
+import paramspace
+
+# Specification of the search spaces of each search algorithm, plasticity rule and granularity
+SpecFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'searchspace.json')
+
+# Tolerated excess of the cost of the most loaded job over the average cost of the jobs
+Tolerance = 0.05
+
+# Number of time constants of the presynaptic trace after which the plasticity it gates is negligible, duration (in
+# seconds) of the simulated traces beyond which the active window cannot grow (see numpysim.active_window), and share
+# of the cost of a whole trace spent regardless of the active window (e.g. filtering the voltage)
+WindowDecays = 10.
+Horizon = 1.
+Overhead = 0.1
+
+
+def load_space(algo, table_name, granularity, spec_file=None):
+    """
+    :param algo: search algorithm for which the space is specified ('gridsearch' or 'montesearch')
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param granularity: int describing how fine the param search will be
+    :param spec_file: path of the json specification file (None for searchspace.json)
+    :return: dictionary with the step between grid indexes, the list of [name, lowest index, highest index] of all
+    parameters to fit and the list of [name, lowest index, highest index, step] of the parameters fixed in each job
+    """
+
+    with open(SpecFile if spec_file is None else spec_file) as f:
+        spec = json.load(f)
+
+    try:
+        return spec[algo][table_name][str(granularity)]
+    except KeyError:
+        raise NotImplementedError('{} {} g{}'.format(algo, table_name, granularity))
+
+
+def grid_indexes(low, high, step):
+    """
+    :param low: lowest index of the parameter
+    :param high: highest index of the parameter
+    :param step: step between two grid indexes
+    :return: list of all grid indexes of the parameter
+    """
+
+    return [low + i * step for i in range(int(round((high - low) / step)) + 1)]
+
+
+def blocks(fixed):
+    """
+    :param fixed: list of [name, lowest index, highest index, step] of the parameters fixed in each block
+    :return: list of dictionaries of the indexes of the fixed parameters of each block, with the last parameter varying
+    fastest
+    """
+
+    names = [f[0] for f in fixed]
+
+    return [dict(zip(names, combination)) for combination in itertools.product(*[grid_indexes(*f[1:]) for f in fixed])]
+
+
+def balance(costs, nrjobs):
+    """
+    Assign blocks to jobs by always giving the next most expensive block to the least loaded job.
+    :param costs: estimated cost of each block
+    :param nrjobs: number of jobs
+    :return: list of the block numbers of each job and list of the estimated cost of each job
+    """
+
+    jobs = [[] for _ in range(nrjobs)]
+    loads = [0.] * nrjobs
+    for b in sorted(range(len(costs)), key=lambda k: -costs[k]):
+        j = loads.index(min(loads))
+        jobs[j].append(b)
+        loads[j] += costs[b]
+
+    return [sorted(job) for job in jobs], loads
+
+
+def block_cost(table_name, analytic=()):
+    """
+    Default estimate of the cost of a block of the search space (see partition). The cost of a configuration grows with
+    the length of the active window after the presynaptic spike implied by its tau_x, and configurations scored
+    analytically share a single sweep per combination of the other parameters (see gridsearch.analytic_chunk).
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param analytic: names of the parameters scored analytically if varied in the block
+    :return: function estimating the cost of a block from the dictionary of the indexes taken by each parameter in it
+    """
+
+    def cost(ranges):
+        size = np.prod([len(indexes) for indexes in ranges.values()])
+        window = np.minimum(WindowDecays * paramspace.values('tau_x', ranges['tau_x'], table_name), Horizon) / Horizon
+        sweeps = np.prod([len(ranges[name]) for name in analytic if name in ranges])
+        return size * (Overhead + float(np.mean(window))) / sweeps
+
+    return cost
+
+
+def partition(space, nrjobs=None, last=(), cost=None):
+    """
+    Derive balanced slices of the search space for a number of jobs. The space is cut into blocks of configurations
+    sharing the indexes of the fixed parameters of the specification. If the blocks are too coarse to balance the
+    estimated cost of the jobs, further parameters are fixed in each block.
+    :param space: search space specification (see load_space)
+    :param nrjobs: number of jobs (None for one job per block of the specification)
+    :param last: names of the parameters that are only fixed once all other parameters are, if the blocks are still too
+    coarse (parameters are otherwise fixed in the order of the specification)
+    :param cost: function estimating the cost of a block from the dictionary of the indexes taken by each parameter in
+    it, such as block_cost (None for a cost proportional to the number of configurations)
+    :return: list of the names of the parameters to fit in each job, and list of the lists of the blocks of each job
+    """
+
+    fixed = [list(f) for f in space['fixed']]
+    free = [p for p in space['parameters'] if p[0] not in [f[0] for f in fixed]]
+    free = sorted(free, key=lambda p: p[0] in last)
+
+    while True:
+
+        # Estimated cost of each block
+        bks = blocks(fixed)
+        ranges = {p[0]: grid_indexes(p[1], p[2], space['step']) for p in free}
+        if cost is None:
+            costs = [float(np.prod([len(indexes) for indexes in ranges.values()]))] * len(bks)
+        else:
+            costs = [cost(dict(ranges, **{name: [index] for name, index in b.items()})) for b in bks]
+
+        if nrjobs is None:
+            jobs = [[b] for b in range(len(bks))]
+            break
+
+        # Fix another parameter in each block while the most loaded job exceeds the average too much
+        jobs, loads = balance(costs, nrjobs)
+        if len(free) == 0 or max(loads) <= (1. + Tolerance) * sum(loads) / nrjobs:
+            break
+        fixed.append(free.pop(0) + [space['step']])
+
+    param_names = [p[0] for p in space['parameters'] if p[0] in [q[0] for q in free]]
+
+    return param_names, [[bks[b] for b in job] for job in jobs]
+
+
+def job_blocks(algo, table_name, granularity, jid, nrjobs=None, split=True, last=(), cost=None):
+    """
+    :param algo: search algorithm for which the space is specified ('gridsearch' or 'montesearch')
+    :param table_name: name of the result table (plasticity rule and veto)
+    :param granularity: int describing how fine the param search will be
+    :param jid: id of the job
+    :param nrjobs: number of jobs (None for one job per block of the specification)
+    :param split: whether or not to split the search space between jobs (else the job searches the whole space)
+    :param last: names of the parameters to fix last if the blocks are too coarse (see partition)
+    :param cost: function estimating the cost of a block (see partition)
+    :return: search space specification, list of the names of the parameters to fit and list of dictionaries of the
+    indexes of the fixed parameters of each block of the job
+    """
+
+    space = load_space(algo, table_name, granularity)
+    if not split:
+        space, nrjobs, jid = dict(space, fixed=[]), None, 0
+    param_names, jobs = partition(space, nrjobs, last, cost)
+    if jid >= len(jobs):
+        raise ValueError('Job {} does not exist among the {} jobs of the search space.'.format(jid, len(jobs)))
+
+    return space, param_names, jobs[jid]
+
+
+def grid_shape(pnames, grid_params, step):
+    """
+    :param pnames: list of the names of the parameters to vary, the first one varying slowest
+    :param grid_params: dictionary of boundaries of the grid for each parameter
+    :param step: step between two grid indexes
+    :return: list of the number of grid indexes of each parameter
+    """
+
+    return [len(grid_indexes(grid_params[p][0], grid_params[p][1], step)) for p in pnames]
+
+
+def decode(linear, shape):
+    """
+    Mixed-radix decoding of linear positions on a grid into the positions along each parameter.
+    :param linear: array of linear positions on the grid
+    :param shape: number of grid indexes of each parameter, the first one varying slowest
+    :return: integer array of shape (number of positions, number of parameters)
+    """
+
+    linear = np.asarray(linear, dtype=np.int64)
+    digits = np.zeros((len(linear), len(shape)), dtype=np.int64)
+    for d in reversed(range(len(shape))):
+        digits[:, d] = linear % shape[d]
+        linear = linear // shape[d]
+
+    return digits
+
+
+def encode(digits, shape):
+    """
+    Inverse of decode.
+    :param digits: integer array of shape (number of positions, number of parameters) with the positions along each
+    parameter
+    :param shape: number of grid indexes of each parameter, the first one varying slowest
+    :return: array of linear positions on the grid
+    """
+
+    digits = np.asarray(digits, dtype=np.int64).reshape(-1, len(shape))
+    linear = np.zeros(len(digits), dtype=np.int64)
+    for d in range(len(shape)):
+        linear = linear * shape[d] + digits[:, d]
+
+    return linear
+
+
+def grid_chunks(pnames, grid_params, step, start=0, stop=None, chunksize=1024):
+    """
+    Iterate over the configurations of a grid in chunks, without recursion, such that they can be fed to batched
+    engines. Configurations are enumerated in mixed-radix order, the first parameter varying slowest, and chunks are
+    aligned on multiples of chunksize (such that a chunk of the size of the trailing parameters' grid only varies them).
+    :param pnames: list of the names of the parameters to vary
+    :param grid_params: dictionary of boundaries of the grid for each parameter
+    :param step: step between two grid indexes
+    :param start: linear position of the first configuration to enumerate
+    :param stop: linear position after the last configuration to enumerate (None for the end of the grid)
+    :param chunksize: maximal number of configurations per chunk
+    :return: generator of (linear position of the first configuration of the chunk, float array of shape (number of
+    configurations, number of parameters) with their grid indexes)
+    """
+
+    shape = grid_shape(pnames, grid_params, step)
+    axes = [np.array(grid_indexes(grid_params[p][0], grid_params[p][1], step), dtype=float) for p in pnames]
+    size = int(np.prod(shape, dtype=np.int64))
+    stop = size if stop is None else min(stop, size)
+
+    first = start
+    while first < stop:
+        last = min((first // chunksize + 1) * chunksize, stop)
+        digits = decode(np.arange(first, last), shape)
+        indexes = np.zeros(digits.shape)
+        for d in range(len(pnames)):
+            indexes[:, d] = axes[d][digits[:, d]]
+        yield first, indexes
+        first = last
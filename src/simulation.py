@@ -5,119 +5,563 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 21/12/2018
-    Date last modified: 04/01/2019
+    Date last modified: 27/01/2019
     Python Version: 3.5
 """
 
 import numpy as np
 import brian2 as b2
+import numpysim
+import numbasim
+import tracestore
+from lowpasscache import LowpassCache
 
 ProtocolParameters = {'integration_timestep': 0.1 * b2.msecond,
                       'integration_method': 'euler',
                       'weight_initial': 0.5}
 
+# Cheap simulation used to screen configurations before the reference simulation (see screening.py)
+ScreeningParameters = {'method': 'exact',
+                       'timestep': 1. * b2.msecond,
+                       'quantile': 0.25,
+                       'threshold': None}
 
-def simulate(protocol_type='Letzkus', trace_id=1, plasticity_parameters=None,
-             mon_parameters=False, debug=False):
+# Brian2 networks already built by this process (see brian2_network)
+Brian2Networks = {}
+
+# Brian2 standalone project built by this process (see standalone_project)
+StandaloneProject = {}
+
+# Cache of low-pass filtered voltage traces shared by all simulations with the numpy engine
+LowpassTraces = LowpassCache()
+
+
+def configure_lowpass_cache(maxsize=128, directory=None):
     """
-    A synaptic weight change simulation function, which calculates the weight change, when a synapse is exposed to the
-    voltage trace defined by protocol_type and trace_id. This plasticity is computed using the plasticity rule
-    defined by plasticity_parameters and veto.
+    Replace the cache of low-pass filtered traces used by the numpy engine.
+    :param maxsize: maximal number of filtered traces kept in memory
+    :param directory: directory where filtered traces are also saved as npy files (None to only cache in memory)
+    """
+
+    global LowpassTraces
+    LowpassTraces = LowpassCache(maxsize, directory)
+
+
+def cached_lowpass(protocol_type, trace_id, voltage, dt):
+    """
+    Bind the cache of low-pass filtered traces to a given voltage trace.
     :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
     :param trace_id: Identifies the voltage trace of the protocol.
-    :param plasticity_parameters: parameters of the plasticity rule (see plasticity.py for examples)
-    :param mon_parameters: Specifies the variables to monitor during the simulation
-    :param debug: Set to true for verbose output and shorter simulation
+    :param voltage: voltage trace (in mV)
+    :param dt: integration timestep in seconds
+    :return: function returning the filtered voltage trace for a given time constant in seconds
     """
 
-    ####################################################################################################################
-    # Load voltage traces and get presynaptic input spike time
-    ####################################################################################################################
+    def filtered(tau):
+        return LowpassTraces.filtered(protocol_type, trace_id, voltage, dt, tau)
+
+    return filtered
+
+
+def load_trace(protocol_type='Letzkus', trace_id=1):
+    """
+    Load the voltage trace defined by protocol_type and trace_id together with the time of the presynaptic spike.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :return: voltage trace (in mV) and presynaptic spike time
+    """
+
+    voltage, prespike = tracestore.get_store(protocol_type).padded(trace_id)
+
+    return voltage, prespike * b2.second
+
+
+def integration_scheme(voltage, nrsteps, prm, method='euler', timestep=None):
+    """
+    Adapt voltage traces and parameters to the integration method and timestep of the numpy engine.
+    :param voltage: unpadded voltage trace(s) sampled with the integration_timestep of ProtocolParameters
+    :param nrsteps: number of timesteps of the padded traces
+    :param prm: unitless plasticity parameters (see numpysim.strip_units)
+    :param method: Either 'euler' (same scheme as Brian2) or 'exact' (see numpysim.exact_time_constants)
+    :param timestep: Integration timestep, a multiple of the sampling interval of the traces (which are then averaged
+    over each step). The integration_timestep of ProtocolParameters if None.
+    :return: voltage trace(s), number of timesteps, timestep in seconds and parameters to integrate with the Euler
+    scheme
+    """
+
+    # Resample traces if integrating with a coarser timestep
+    dt = float(ProtocolParameters['integration_timestep'])
+    if timestep is not None:
+        factor = int(round(float(timestep) / dt))
+        if factor < 1 or abs(factor * dt - float(timestep)) > 1e-9 * dt:
+            raise ValueError(timestep)
+        if factor > 1:
+            voltage = numpysim.coarse_trace(voltage, factor)
+            nrsteps = -(-nrsteps // factor)
+            dt = factor * dt
+
+    if method == 'exact':
+        prm = numpysim.exact_time_constants(prm, dt)
+    elif method != 'euler':
+        raise ValueError(method)
+
+    return voltage, nrsteps, dt, prm
+
+
+def simulate_batch(protocol_type='Letzkus', trace_id=1, param_table=None, plasticity='Claire', veto=False,
+                   tolerance=None, engine='numpy', method='euler', timestep=None):
+    """
+    Batched version of simulate, which integrates the weight changes of K parameter configurations at once on the
+    voltage trace defined by protocol_type and trace_id, using the numpy or numba engine.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :param param_table: table of K configurations, either as a numpy structured array or dictionary of columns (unitless
+    SI values) or as a list of plasticity parameter dictionaries like the ones given to simulate
+    :param plasticity: plasticity rule shared by all configurations ('Claire' or 'Clopath')
+    :param veto: whether or not all configurations use the veto mechanism
+    :param tolerance: If given, plasticity is only accumulated in the window after the presynaptic spike outside of
+    which it is guaranteed to change by less than tolerance, and the achieved error bounds are returned as well.
+    :param engine: Integration backend. Either 'numpy' (vectorized over time) or 'numba' (compiled loop over time,
+    parallel over configurations)
+    :param method: Integration of the low-pass filters and veto threshold with the numpy engine (see simulate_protocol)
+    :param timestep: Integration timestep of the numpy engine (see simulate_protocol)
+    :return: array of length K with the plasticity of each configuration (and array of error bounds if tolerance is set)
+    """
+
+    voltage, nrsteps, prespike = tracestore.load_samples(protocol_type, trace_id)
+
+    prm = numpysim.table_columns(param_table)
+    prm['PlasticityRule'] = plasticity
+    prm['veto'] = veto
 
-    if protocol_type == 'Letzkus':
-        voltage = np.load('../Data/L_{}.npy'.format(trace_id))
-        if trace_id in [0, 2, 4, 6, 8, 9]:
-            prespike = 0.0 * b2.ms
-        elif trace_id in [1, 3, 5, 7]:
-            prespike = 10.0 * b2.ms
-        else:
-            raise ValueError(trace_id)
-    elif protocol_type == 'Brandalise':
-        voltage = np.load('../Data/B_{}.npy'.format(trace_id))
-        if trace_id in list(range(21)):
-            prespike = 0.0 * b2.ms
-        elif trace_id in [21, 22, 23]:
-            prespike = 40.0 * b2.ms
-        else:
-            raise ValueError(trace_id)
+    if engine != 'numpy' and (method != 'euler' or timestep is not None):
+        raise ValueError("Other integration methods and timesteps are only available with the numpy engine.")
+
+    voltage, nrsteps, dt, prm = integration_scheme(voltage, nrsteps, prm, method, timestep)
+    if engine == 'numpy':
+        plasticities, bounds = numpysim.batch_kernel(voltage, prespike, dt, prm,
+                                                     cached_lowpass(protocol_type, trace_id, voltage, dt), tolerance,
+                                                     nrsteps)
+    elif engine == 'numba':
+        plasticities, bounds = numbasim.batch_kernel(voltage, prespike, dt, prm, tolerance, nrsteps)
     else:
-        raise ValueError(protocol_type)
+        raise ValueError(engine)
 
-    # Get Simulation duration
-    final_t = len(voltage) * ProtocolParameters['integration_timestep']
+    if tolerance is None:
+        return plasticities
+    else:
+        return plasticities, bounds
+
+
+def simulate_integrals(protocol_type='Letzkus', trace_id=1, param_table=None, plasticity='Claire'):
+    """
+    Compute the potentiation and depression integrals of K configurations without veto, for which the plasticity is
+    linear in the amplitudes: plasticity = A_LTP * ltp - A_LTD * ltd. This allows to score any number of amplitude pairs
+    analytically after a single simulation per combination of thresholds and time constants.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :param param_table: table of K configurations (see simulate_batch), whose amplitudes are ignored
+    :param plasticity: plasticity rule shared by all configurations ('Claire' or 'Clopath')
+    :return: arrays of length K with the potentiation and depression integrals (normalized by the initial weight)
+    """
+
+    voltage, nrsteps, prespike = tracestore.load_samples(protocol_type, trace_id)
+
+    prm = numpysim.table_columns(param_table)
+    prm['PlasticityRule'] = plasticity
+    prm['veto'] = False
+
+    dt = float(ProtocolParameters['integration_timestep'])
+
+    return numpysim.batch_integrals(voltage, prespike, dt, prm, cached_lowpass(protocol_type, trace_id, voltage, dt),
+                                    nrsteps)
+
+
+def simulate_thresholds(protocol_type='Letzkus', trace_id=1, plasticity_parameters=None, theta_high=(), theta_low=()):
+    """
+    Compute the potentiation and depression integrals of the Claire rule without veto (see simulate_integrals) for whole
+    vectors of thresholds, at the cost of about a single simulation.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :param plasticity_parameters: parameters of the plasticity rule (thresholds and amplitudes are ignored)
+    :param theta_high: potentiation thresholds (unitless, in volts)
+    :param theta_low: depression thresholds (unitless, in volts)
+    :return: arrays with the potentiation integrals for each theta_high and the depression integrals for each theta_low
+    (normalized by the initial weight)
+    """
+
+    voltage, nrsteps, prespike = tracestore.load_samples(protocol_type, trace_id)
+    prm = numpysim.strip_units(plasticity_parameters)
+    dt = float(ProtocolParameters['integration_timestep'])
+
+    ltp, ltd = numpysim.threshold_integrals(voltage, prespike, dt, prm, theta_high, theta_low,
+                                            cached_lowpass(protocol_type, trace_id, voltage, dt), nrsteps)
+
+    return ltp / prm['w_init'], ltd / prm['w_init']
+
+
+def plasticity_group(protocol_type='Letzkus', plasticity='Claire', veto=False, nrneurons=1, name='postneuron'):
+    """
+    Build a Brian2 neuron group simulating a plasticity rule on the voltage traces of a protocol. All voltage traces of
+    the protocol are held by a single two dimensional TimedArray and all plasticity parameters are constant variables of
+    the neurons, such that each neuron can simulate its own trace and parameter configuration.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param plasticity: plasticity rule ('Claire' or 'Clopath')
+    :param veto: whether or not to use the veto mechanism
+    :param nrneurons: number of neurons of the group
+    :param name: name of the neuron group
+    :return: neuron group with all state variables initialized to zero
+    """
+
+    ####################################################################################################################
+    # Load all voltage traces of the protocol (traces that are not simulated are left at zero)
+    ####################################################################################################################
+
+    store = tracestore.get_store(protocol_type)
+    voltages = np.zeros((int(np.max(store.durations)), len(store)))
+    for trace_id in range(len(store)):
+        if not np.isnan(store.prespikes[trace_id]):
+            voltages[:store.durations[trace_id], trace_id] = store.padded(trace_id)[0]
+    params = {'voltages': b2.TimedArray(voltages * b2.mV, ProtocolParameters['integration_timestep'])}
 
     ####################################################################################################################
     # Define neuron and synapse equations and bundle them into single neuron object for later simulation with Brian2
     ####################################################################################################################
 
-    # Define constants used in the equations
-    params = {'v': b2.TimedArray(voltage * b2.mV, ProtocolParameters['integration_timestep']),
-              'tau_lowpass1': plasticity_parameters['tau_lowpass1'],
-              'tau_lowpass2': plasticity_parameters['tau_lowpass2'],
-              't_pre': prespike,
-              'x_reset': plasticity_parameters['x_reset'],
-              'A_LTP': plasticity_parameters['A_LTP'],
-              'A_LTD': plasticity_parameters['A_LTD'],
-              'Theta_low': plasticity_parameters['Theta_low'],
-              'Theta_high': plasticity_parameters['Theta_high'],
-              'tau_x': plasticity_parameters['tau_x'],
-              'w_max': plasticity_parameters['w_max'] - plasticity_parameters['w_init'],
-              'w_min': -plasticity_parameters['w_init']
-              }
+    # Define the parameters, which are swapped between simulations
+    eqs = b2.Equations('''
+                       trace_id : integer (constant)
+                       t_prespike : second (constant)
+                       tau_lowpass1 : second (constant)
+                       tau_lowpass2 : second (constant)
+                       tau_x : second (constant)
+                       x_reset : 1 (constant)
+                       A_LTP : 1 (constant)
+                       A_LTD : 1 (constant)
+                       Theta_high : volt (constant)
+                       ''')
 
     # Define neuron equations
-    eqs = b2.Equations('dv_lowpass1/dt = (v(t)-v_lowpass1)/tau_lowpass1 : volt')
-    eqs += b2.Equations('dv_lowpass2/dt = (v(t)-v_lowpass2)/tau_lowpass2 : volt')
-    eqs += b2.Equations('pre_x_trace = x_reset * exp((t_pre - t) / tau_x) * int(t >= t_pre) : 1')
+    eqs += b2.Equations('v = voltages(t, trace_id) : volt')
+    eqs += b2.Equations('dv_lowpass1/dt = (v-v_lowpass1)/tau_lowpass1 : volt')
+    eqs += b2.Equations('dv_lowpass2/dt = (v-v_lowpass2)/tau_lowpass2 : volt')
+    eqs += b2.Equations('pre_x_trace = x_reset * exp((t_prespike - t) / tau_x) * int(t >= t_prespike) : 1')
 
     # Define plasticity equations depending on the chosen plasticity rule
-    if plasticity_parameters['PlasticityRule'] == 'Clopath':
+    if plasticity == 'Clopath':
         eqs += b2.Equations('wLTD = A_LTD * pre_x_trace * (v_lowpass1 - Theta_low)'
                             ' * int(v_lowpass1/mV - Theta_low/mV > 0) : volt')
         eqs += b2.Equations('wLTP = A_LTP * pre_x_trace * (v - Theta_high) * (v_lowpass2 - Theta_low)'
                             ' * int(v - Theta_high > 0*mV) * int(v_lowpass2 - Theta_low > 0*mV)')
         eqs += b2.Equations('dw_ampa/dt = (wLTP - wLTD)/(mV*ms) : 1')
 
-    elif plasticity_parameters['PlasticityRule'] == 'Claire':
+    elif plasticity == 'Claire':
         eqs += b2.Equations('wLTD = A_LTD * pre_x_trace * (v_lowpass1 - Theta_low)'
                             ' * int(v_lowpass1/mV - Theta_low/mV > 0) : volt')
         eqs += b2.Equations('wLTP = A_LTP * pre_x_trace * (v_lowpass2 - Theta_high)'
                             ' * int(v_lowpass2/mV - Theta_high/mV > 0) : volt')
         eqs += b2.Equations('dw_ampa/dt = (wLTP - wLTD)/(mV*ms) : 1')
     else:
-        raise NotImplementedError(plasticity_parameters['PlasticityRule'])
+        raise NotImplementedError(plasticity)
 
     # Add veto equations if required
-    if plasticity_parameters['veto']:
-        params['Theta_low_zero'] = plasticity_parameters['Theta_low']
-        params['b_theta'] = plasticity_parameters['b_theta']
-        params['tau_theta'] = plasticity_parameters['tau_theta']
+    if veto:
+        eqs += b2.Equations('''
+                           Theta_low_zero : volt (constant)
+                           b_theta : 1 (constant)
+                           tau_theta : second (constant)
+                           ''')
         eqs += b2.Equations('dtheta/dt = (wLTP - theta) / tau_theta : volt')
         eqs += b2.Equations('Theta_low = Theta_low_zero + b_theta * theta : volt')
     else:
-        params['Theta_low'] = plasticity_parameters['Theta_low']
+        eqs += b2.Equations('Theta_low : volt (constant)')
 
     # Create neuron group object according to the upper defined equations
-    neuron = b2.NeuronGroup(N=1, model=eqs, namespace=params, name='postneuron',
-                            method=ProtocolParameters['integration_method'])
+    neuron = b2.NeuronGroup(N=nrneurons, model=eqs, namespace=params, name=name,
+                            method=ProtocolParameters['integration_method'],
+                            dt=ProtocolParameters['integration_timestep'])
 
     # Initialize variables
     neuron.v_lowpass1 = 0
     neuron.v_lowpass2 = 0
     neuron.w_ampa = 0
-    if plasticity_parameters['veto']:
+    if veto:
         neuron.theta = 0
 
+    return neuron
+
+
+def brian2_network(protocol_type='Letzkus', plasticity='Claire', veto=False, nrneurons=1):
+    """
+    Build the Brian2 network simulating a plasticity rule on the voltage traces of a protocol, only once per process.
+    Simulations then only need to restore the initial state of the network and swap the trace index and parameter
+    values (see plasticity_group), without parsing equations or generating code again.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param plasticity: plasticity rule ('Claire' or 'Clopath')
+    :param veto: whether or not to use the veto mechanism
+    :param nrneurons: number of neurons, i.e. of simulations run at once
+    :return: network and the neuron group it contains, whose initial state is stored under the name 'initial'
+    """
+
+    key = (protocol_type, plasticity, veto, nrneurons)
+    if key in Brian2Networks:
+        return Brian2Networks[key]
+
+    # Build the network and store its initial state
+    neuron = plasticity_group(protocol_type, plasticity, veto, nrneurons, 'postneuron_{}_{}_{}_{}'.format(*key))
+    network = b2.Network(neuron)
+    network.store('initial')
+
+    Brian2Networks[key] = network, neuron
+
+    return network, neuron
+
+
+def standalone_project(protocol_type='Letzkus', plasticity='Claire', veto=False, block_size=1000, directory=None):
+    """
+    Generate and compile a Brian2 C++ standalone project simulating block_size neurons, each with its own trace and
+    parameter configuration (see plasticity_group). The project is compiled once and then run for whole blocks of
+    configurations by changing the neuron variables at run time (see simulate_standalone). Brian2 supports a single
+    standalone project per process, which is rebuilt if another protocol, rule, veto or block size is requested.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param plasticity: plasticity rule ('Claire' or 'Clopath')
+    :param veto: whether or not to use the veto mechanism
+    :param block_size: number of simulations run at once by the compiled project
+    :param directory: directory of the generated project (a temporary directory by default)
+    :return: standalone device of the project and the neuron group it simulates
+    """
+
+    key = (protocol_type, plasticity, veto, block_size, directory)
+    if StandaloneProject.get('key') == key:
+        return StandaloneProject['device'], StandaloneProject['neuron']
+
+    # Generate the project
+    if 'key' in StandaloneProject:
+        StandaloneProject['device'].reinit()
+    b2.set_device('cpp_standalone', directory=directory, build_on_run=False)
+    device = b2.get_device()
+    neuron = plasticity_group(protocol_type, plasticity, veto, block_size, 'postneurons')
+    network = b2.Network(neuron)
+    final_t = int(np.max(tracestore.get_store(protocol_type).durations)) * ProtocolParameters['integration_timestep']
+    network.run(final_t, namespace={})
+
+    # Compile it without running, and switch back to runtime mode for the other simulations
+    device.build(directory=directory, run=False)
+    b2.set_device('runtime')
+
+    StandaloneProject.update({'key': key, 'device': device, 'neuron': neuron})
+
+    return device, neuron
+
+
+def simulate_standalone(protocol_type='Letzkus', trace_ids=(1,), param_table=None, plasticity='Claire', veto=False,
+                        block_size=1000, directory=None):
+    """
+    Simulate K parameter configurations on several voltage traces with a compiled Brian2 standalone project, which runs
+    block_size pairs of configuration and trace at once.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param trace_ids: Identifies the voltage traces of the protocol to simulate.
+    :param param_table: table of K configurations (see simulate_batch)
+    :param plasticity: plasticity rule shared by all configurations ('Claire' or 'Clopath')
+    :param veto: whether or not all configurations use the veto mechanism
+    :param block_size: number of simulations run at once by the compiled project
+    :param directory: directory of the generated project (a temporary directory by default)
+    :return: array of shape (number of traces, K) with the plasticity of each configuration on each trace
+    """
+
+    device, neuron = standalone_project(protocol_type, plasticity, veto, block_size, directory)
+
+    prm = numpysim.table_columns(param_table)
+    nrconfigs = max(np.size(value) for value in prm.values())
+    names = ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'x_reset', 'A_LTP', 'A_LTD', 'Theta_high']
+    names += ['Theta_low_zero', 'b_theta', 'tau_theta'] if veto else ['Theta_low']
+    prm['Theta_low_zero'] = prm['Theta_low']
+
+    # All pairs of trace and configuration to simulate
+    traces = np.repeat(np.asarray(trace_ids, dtype=int), nrconfigs)
+    configs = np.tile(np.arange(nrconfigs), len(trace_ids))
+    prespikes = np.array([tracestore.prespike_time(protocol_type, trace_id) for trace_id in trace_ids])
+    prespikes = np.repeat(prespikes, nrconfigs)
+    w_init = np.broadcast_to(np.asarray(prm['w_init'], dtype=float), (nrconfigs,))
+
+    plasticities = np.zeros(len(traces))
+    for start in range(0, len(traces), block_size):
+
+        # Fill the block, repeating the first pair in the unused neurons
+        pairs = np.arange(start, start + block_size)
+        pairs[pairs >= len(traces)] = 0
+
+        # Swap the neuron variables and run the compiled project
+        run_args = {neuron.trace_id: traces[pairs],
+                    neuron.t_prespike: prespikes[pairs] * b2.second}
+        for name in names:
+            values = np.broadcast_to(np.asarray(prm[name], dtype=float), (nrconfigs,))[configs[pairs]]
+            run_args[getattr(neuron, name)] = b2.Quantity(values, dim=neuron.variables[name].dim)
+        device.run(run_args=run_args)
+
+        stop = min(start + block_size, len(traces))
+        plasticities[start:stop] = np.asarray(neuron.w_ampa[:stop - start]) / w_init[configs[start:stop]]
+
+    return plasticities.reshape(len(trace_ids), nrconfigs)
+
+
+def simulate_protocol(protocol_type='Letzkus', plasticity_parameters=None, nrtraces=None, engine='numpy',
+                      method='euler', timestep=None):
+    """
+    Simulate the plasticity of a parameter configuration on all voltage traces of a protocol at once, with the traces
+    as a vector dimension of the state variables (each with its own presynaptic spike time).
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param plasticity_parameters: parameters of the plasticity rule (see plasticity.py for examples)
+    :param nrtraces: number of traces to simulate, from the first one on (all simulated traces of the protocol if None)
+    :param engine: Integration backend. Either 'numpy' or 'brian2' (other engines of simulate are run trace by trace)
+    :param method: Integration of the low-pass filters and veto threshold with the numpy engine. Either 'euler' (same
+    scheme as Brian2) or 'exact' (exponential integrator, see numpysim.exact_time_constants)
+    :param timestep: Integration timestep of the numpy engine, a multiple of the sampling interval of the traces (which
+    are then averaged over each step). The integration_timestep of ProtocolParameters by default.
+    :return: array with the plasticity of each trace
+    """
+
+    store = tracestore.get_store(protocol_type)
+    if nrtraces is None:
+        nrtraces = int(np.sum(~np.isnan(store.prespikes)))
+    prespikes = np.array([store.prespike(t) for t in range(nrtraces)])
+    nrsteps = int(np.max(store.durations[:nrtraces]))
+    if np.any(store.durations[:nrtraces] != nrsteps):
+        raise ValueError("All traces of a protocol must be simulated for the same duration.")
+
+    if engine != 'numpy' and (method != 'euler' or timestep is not None):
+        raise ValueError("Other integration methods and timesteps are only available with the numpy engine.")
+
+    if engine == 'numpy':
+
+        # Unpadded traces of different lengths are stacked with zeros up to the longest one
+        samples = [store.samples(t)[0] for t in range(nrtraces)]
+        voltages = np.zeros((nrtraces, max(len(voltage) for voltage in samples)))
+        for t in range(nrtraces):
+            voltages[t, :len(samples[t])] = samples[t]
+
+        voltages, nrsteps, dt, prm = integration_scheme(voltages, nrsteps, numpysim.strip_units(plasticity_parameters),
+                                                        method, timestep)
+        w_ampa = numpysim.plasticity_kernel(voltages, prespikes, dt, prm, None, nrsteps)
+
+        return w_ampa / prm['w_init']
+
+    elif engine == 'brian2':
+
+        # One neuron per trace
+        network, neuron = brian2_network(protocol_type, plasticity_parameters['PlasticityRule'],
+                                         plasticity_parameters['veto'], nrtraces)
+        network.restore('initial')
+        neuron.trace_id = np.arange(nrtraces)
+        neuron.t_prespike = prespikes * b2.second
+        set_group_parameters(neuron, plasticity_parameters)
+        network.run(nrsteps * ProtocolParameters['integration_timestep'], namespace={})
+
+        return np.asarray(neuron.w_ampa[:]) / plasticity_parameters['w_init']
+
+    else:
+        return np.array([simulate(protocol_type, t, plasticity_parameters, engine=engine)[0] for t in range(nrtraces)])
+
+
+def accuracy_report(protocol_type='Letzkus', plasticity_parameters=None, nrtraces=None, method='exact',
+                    timestep=1. * b2.ms):
+    """
+    Compare the plasticities obtained with another integration method and timestep (see simulate_protocol) to the
+    reference Euler integration with the integration_timestep of ProtocolParameters, trace by trace.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param plasticity_parameters: parameters of the plasticity rule (see plasticity.py for examples)
+    :param nrtraces: number of traces to simulate, from the first one on (all simulated traces of the protocol if None)
+    :param method: integration method to evaluate ('euler' or 'exact')
+    :param timestep: integration timestep to evaluate
+    :return: arrays with the reference plasticities and the absolute error of each trace
+    """
+
+    reference = simulate_protocol(protocol_type, plasticity_parameters, nrtraces)
+    errors = np.abs(simulate_protocol(protocol_type, plasticity_parameters, nrtraces, 'numpy', method, timestep)
+                    - reference)
+
+    print('Accuracy of {} integration with timestep {} on {} traces:'.format(method, timestep, protocol_type))
+    for t in range(len(reference)):
+        print('\tTrace {}: plasticity {:.6g}, absolute error {:.3g}'.format(t, reference[t], errors[t]))
+    print('\tMax Error {:.3g}'.format(np.max(errors)))
+
+    return reference, errors
+
+
+def set_group_parameters(neuron, plasticity_parameters):
+    """
+    Swap the plasticity parameters of a neuron group built by plasticity_group.
+    :param neuron: neuron group
+    :param plasticity_parameters: parameters of the plasticity rule
+    """
+
+    for name in ['tau_lowpass1', 'tau_lowpass2', 'tau_x', 'x_reset', 'A_LTP', 'A_LTD', 'Theta_high']:
+        setattr(neuron, name, plasticity_parameters[name])
+    if plasticity_parameters['veto']:
+        neuron.Theta_low_zero = plasticity_parameters['Theta_low']
+        neuron.b_theta = plasticity_parameters['b_theta']
+        neuron.tau_theta = plasticity_parameters['tau_theta']
+    else:
+        neuron.Theta_low = plasticity_parameters['Theta_low']
+
+
+def simulate(protocol_type='Letzkus', trace_id=1, plasticity_parameters=None,
+             mon_parameters=False, debug=False, engine='brian2'):
+    """
+    A synaptic weight change simulation function, which calculates the weight change, when a synapse is exposed to the
+    voltage trace defined by protocol_type and trace_id. This plasticity is computed using the plasticity rule
+    defined by plasticity_parameters and veto.
+    :param protocol_type: Specifies the study from which we use the voltage traces. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :param plasticity_parameters: parameters of the plasticity rule (see plasticity.py for examples)
+    :param mon_parameters: Specifies the variables to monitor during the simulation
+    :param debug: Set to true for verbose output and shorter simulation
+    :param engine: Integration backend. Either 'brian2', 'numpy' or 'numba' (same Euler scheme, but without monitors)
+    """
+
+    ####################################################################################################################
+    # Use the vectorized numpy engine if requested (it skips the whole Brian2 setup and code generation)
+    ####################################################################################################################
+
+    if engine == 'numpy':
+        if mon_parameters:
+            raise NotImplementedError("Monitors are only available with the brian2 engine.")
+        voltage, nrsteps, prespike = tracestore.load_samples(protocol_type, trace_id)
+        prm = numpysim.strip_units(plasticity_parameters)
+        dt = float(ProtocolParameters['integration_timestep'])
+        w_ampa = numpysim.plasticity_kernel(voltage, prespike, dt, prm,
+                                            cached_lowpass(protocol_type, trace_id, voltage, dt), nrsteps)
+        return float(w_ampa) / prm['w_init'], None
+    elif engine == 'numba':
+        if mon_parameters:
+            raise NotImplementedError("Monitors are only available with the brian2 engine.")
+        voltage, nrsteps, prespike = tracestore.load_samples(protocol_type, trace_id)
+        prm = numpysim.strip_units(plasticity_parameters)
+        dt = float(ProtocolParameters['integration_timestep'])
+        plasticity = numbasim.batch_kernel(voltage, prespike, dt, prm, nrsteps=nrsteps)[0]
+        return float(plasticity[0]), None
+    elif engine != 'brian2':
+        raise ValueError(engine)
+
+    ####################################################################################################################
+    # Get the Brian2 network of the protocol and plasticity rule, and reset it to its initial state
+    ####################################################################################################################
+
+    network, neuron = brian2_network(protocol_type, plasticity_parameters['PlasticityRule'],
+                                     plasticity_parameters['veto'])
+    network.restore('initial')
+
+    # Get Simulation duration
+    final_t = tracestore.get_store(protocol_type).durations[trace_id] * ProtocolParameters['integration_timestep']
+
+    ####################################################################################################################
+    # Swap the voltage trace and the plasticity parameters
+    ####################################################################################################################
+
+    neuron.trace_id = trace_id
+    neuron.t_prespike = tracestore.prespike_time(protocol_type, trace_id) * b2.second
+    set_group_parameters(neuron, plasticity_parameters)
+
     ####################################################################################################################
     # Finish Initialization
     ####################################################################################################################
@@ -136,14 +580,17 @@ def simulate(protocol_type='Letzkus', trace_id=1, plasticity_parameters=None,
     if debug:
         print('\nRunning Simulation:')
 
-    # Define monitor that will record the desired variables during simulation
+    # Define monitor that will record the desired variables during simulation (only for this run)
     monitor = None
     if mon_parameters:
         monitor = b2.StateMonitor(neuron, mon_parameters, record=True)
+        network.add(monitor)
 
     # Run simulation
     rep = 'text' if debug else None
-    b2.run(final_t, report=rep)
+    network.run(final_t, report=rep, namespace={})
+    if monitor is not None:
+        network.remove(monitor)
 
     if debug:
         print('Simulation successfully terminated.\n')
@@ -5,12 +5,13 @@
     Author: Matthias Tsai
     Email: matthias.chinyen.tsai@gmail.com
     Date created: 11/01/2019
-    Date last modified: 11/01/2019
+    Date last modified: 28/01/2019
     Python Version: 3.5
 """
 
 import dataset
-from math import floor
+import searchspace
+from resultdb import Columns
 
 
 if __name__ == "__main__":
@@ -20,16 +21,19 @@ if __name__ == "__main__":
     protocol_type = 'Letzkus'
     plasticity = 'Claire'
     veto = False
+    nrjobs = None  # number of jobs of the next granularity (None for one job per block of searchspace.json)
 
     # Predefine some specifics dependent stuff
     table_name = plasticity + '_veto' if veto else plasticity + '_noveto'
-    if granularity == 0 and protocol_type is 'Letzkus' and plasticity is 'Claire' and not veto:
-        nrdb = 91
-    else:
+    if veto:
         raise NotImplementedError
 
+    # Blocks of the search space of each job of the next granularity (balanced as in montesearch.init_params)
+    _, jobs = searchspace.partition(searchspace.load_space('montesearch', table_name, granularity + 1), nrjobs,
+                                    cost=searchspace.block_cost(table_name))
+
     # Create database splits one by one
-    for i in range(nrdb):
+    for i in range(len(jobs)):
 
         print('Base {}'.format(i))
 
@@ -41,12 +45,11 @@ if __name__ == "__main__":
         db.query("BEGIN;")
         db.query("ATTACH DATABASE '../Data/monteresults_"+protocol_type+"_g"+str(granularity)+".db' AS candidate;")
 
-        if granularity == 0 and protocol_type is 'Letzkus' and plasticity is 'Claire' and not veto:
-            itl = str((i % 13) * 0.5 + 2)
-            iad = str(int(floor(float(i) / 13.) + 1))
-            condition = "tl = " + itl + " AND ad = " + iad
+        if len(jobs[i]) == 0:
+            condition = "0"
         else:
-            raise NotImplementedError
+            condition = " OR ".join("(" + " AND ".join(Columns[p] + " = " + str(block[p]) for p in sorted(block)) + ")"
+                                    for block in jobs[i])
 
         db.query("INSERT INTO main." + table_name + " SELECT NULL, th, tl, ap, ad, t1, t2, tx, score FROM candidate."
                  + table_name + " WHERE " + condition + ";")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""
+    File name: tracestore.py
+    Author: Matthias Tsai
+    Email: matthias.chinyen.tsai@gmail.com
+    Date created: 25/01/2019
+    Date last modified: 25/01/2019
+    Python Version: 3.5
+"""
+
+import struct
+import zipfile
+import numpy as np
+from os.path import abspath, dirname, join
+
+# Directory of the data files, independently of the working directory
+DataDirectory = abspath(join(dirname(abspath(__file__)), '..', 'Data'))
+
+# Time of the presynaptic spike of each trace in seconds (nan for traces that are not simulated)
+Prespikes = {'Letzkus': [0., 0.01, 0., 0.01, 0., 0.01, 0., 0.01, 0., 0., np.nan],
+             'Brandalise': [0.] * 21 + [0.04] * 3 + [np.nan]}
+
+# Trace stores already opened by this process
+Stores = {}
+
+
+def bundle_path(protocol_type, directory=None):
+    """
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :param directory: directory of the trace bundle (DataDirectory by default)
+    :return: path of the trace bundle of the protocol (see preprocess.py)
+    """
+
+    return join(DataDirectory if directory is None else directory, '{}_bundle.npz'.format(protocol_type))
+
+
+def mmap_member(path, name):
+    """
+    Memory-map an array saved uncompressed inside an npz archive (as done by np.savez). Such members are plain npy files
+    within the zip file, such that their data can be mapped directly from the archive, read-only. All the processes
+    mapping the same archive then share the same physical pages.
+    :param path: path of the npz archive
+    :param name: name of the array in the archive
+    :return: read-only array
+    """
+
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path) as archive:
+            return archive[name]
+
+    with open(path, 'rb') as f:
+
+        # Skip the local file header of the member, whose name and extra fields can differ from the central directory
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        # Parse the npy header
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape, order='F' if fortran_order else 'C', offset=offset)
+
+
+class TraceStore(object):
+    """
+    Read-only store of the voltage traces of a protocol. The samples of all traces are memory-mapped from the trace
+    bundle of the protocol, which is opened only once per process (see get_store), instead of reading npy files for each
+    simulation.
+    """
+
+    def __init__(self, protocol_type, directory=None):
+        """
+        :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+        :param directory: directory of the trace bundle (DataDirectory by default)
+        """
+
+        if protocol_type not in Prespikes:
+            raise ValueError(protocol_type)
+
+        self.protocol_type = protocol_type
+        self.path = bundle_path(protocol_type, directory)
+
+        # Small tables are read in memory, the samples are memory-mapped
+        with np.load(self.path) as bundle:
+            self.offsets = bundle['offsets']
+            self.prespikes = bundle['prespike']
+            self.durations = bundle['nrsteps']
+            self.dt = float(bundle['dt'])
+        self.data = mmap_member(self.path, 'samples')
+
+    def __len__(self):
+        return len(self.prespikes)
+
+    def prespike(self, trace_id):
+        """
+        :param trace_id: Identifies the voltage trace of the protocol.
+        :return: time of the presynaptic spike in seconds
+        """
+
+        if not 0 <= trace_id < len(self) or np.isnan(self.prespikes[trace_id]):
+            raise ValueError(trace_id)
+
+        return float(self.prespikes[trace_id])
+
+    def samples(self, trace_id):
+        """
+        :param trace_id: Identifies the voltage trace of the protocol.
+        :return: unpadded voltage trace (read-only, in mV), number of timesteps to simulate and presynaptic spike time
+        (in seconds)
+        """
+
+        prespike = self.prespike(trace_id)
+        voltage = np.asarray(self.data[self.offsets[trace_id]:self.offsets[trace_id + 1]])
+
+        return voltage, int(self.durations[trace_id]), prespike
+
+    def padded(self, trace_id):
+        """
+        :param trace_id: Identifies the voltage trace of the protocol.
+        :return: voltage trace padded with zeros up to the number of timesteps to simulate (in mV) and presynaptic spike
+        time (in seconds)
+        """
+
+        samples, nrsteps, prespike = self.samples(trace_id)
+        voltage = np.zeros(nrsteps)
+        voltage[:len(samples)] = samples
+
+        return voltage, prespike
+
+
+def get_store(protocol_type):
+    """
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :return: trace store of the protocol, opened on first use
+    """
+
+    if protocol_type not in Stores:
+        Stores[protocol_type] = TraceStore(protocol_type)
+
+    return Stores[protocol_type]
+
+
+def load_samples(protocol_type='Letzkus', trace_id=1):
+    """
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :return: unpadded voltage trace (read-only, in mV), number of timesteps to simulate and presynaptic spike time (in
+    seconds)
+    """
+
+    return get_store(protocol_type).samples(trace_id)
+
+
+def prespike_time(protocol_type='Letzkus', trace_id=1):
+    """
+    :param protocol_type: Specifies the study from which the voltage traces come. Can be 'Brandalise' or 'Letzkus'
+    :param trace_id: Identifies the voltage trace of the protocol.
+    :return: time of the presynaptic spike in seconds
+    """
+
+    return get_store(protocol_type).prespike(trace_id)
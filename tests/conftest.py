@@ -0,0 +1,37 @@
+"""
+    Working directories of the search scripts, which read the traces from and write their results to ../Data.
+"""
+
+import os
+import sys
+import json
+
+import pytest
+
+Source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, Source)
+
+
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    """
+    Working directory next to a Data directory holding the traces, but none of the result databases of the repository.
+    :return: function writing a search space specification (see searchspace.load_space) to use, and returning the path
+    of the Data directory
+    """
+
+    import searchspace
+
+    data = tmpdir.mkdir('Data')
+    for name in os.listdir(os.path.join(Source, '..', 'Data')):
+        if not name.endswith('.db'):
+            os.symlink(os.path.abspath(os.path.join(Source, '..', 'Data', name)), str(data.join(name)))
+    monkeypatch.chdir(str(tmpdir.mkdir('src')))
+
+    def specify(space):
+        spec = tmpdir.join('searchspace.json')
+        spec.write(json.dumps(space))
+        monkeypatch.setattr(searchspace, 'SpecFile', str(spec))
+        return str(data)
+
+    return specify
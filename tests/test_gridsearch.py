@@ -0,0 +1,69 @@
+"""
+    Resuming a grid search job killed in the middle of a chunk.
+"""
+
+import os
+import sqlite3
+import warnings
+
+import pytest
+
+import gridsearch
+import resultdb
+
+warnings.resetwarnings()
+
+# Veto grid of 16 configurations in a single block
+Space = {"gridsearch": {"Claire_veto": {"0": {
+    "step": 1,
+    "parameters": [["Theta_high", -1, 0], ["Theta_low", 0, 1], ["A_LTP", 0, 0], ["A_LTD", 0, 0],
+                   ["tau_lowpass1", 0, 0], ["tau_lowpass2", 0, 0], ["tau_x", -1, 0], ["b_theta", -1, 0],
+                   ["tau_theta", 0, 0]],
+    "fixed": [["A_LTP", 0, 0, 1]]}}}}
+
+
+class Killed(Exception):
+    pass
+
+
+@pytest.fixture
+def database(workdir, monkeypatch):
+    data = workdir(Space)
+    monkeypatch.setattr(gridsearch, 'ChunkSize', 8)
+    monkeypatch.setattr(gridsearch, 'analytic_parameters', lambda *args: [])
+    monkeypatch.setattr(resultdb, 'FlushRows', 1)
+    monkeypatch.setattr(gridsearch, 'ScreenedLosses', [])
+
+    return os.path.join(data, 'gridresults_Letzkus_g0_j0.db')
+
+
+def rows(db_name):
+    with sqlite3.connect(db_name) as connection:
+        return connection.execute('SELECT th, tl, ap, ad, t1, t2, tx, bt, tt FROM Claire_veto').fetchall()
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_resume_after_screened_rows(database, monkeypatch):
+
+    # Kill the job once the configurations rejected by the screening of the second chunk are written, before the
+    # promoted ones are simulated
+    store = gridsearch.store_configurations
+
+    def killed(table, configurations, *args):
+        losses = store(table, configurations, *args)
+        if len(args) > 4 and args[4] == 0 and len(configurations) > 0:
+            raise Killed()
+        return losses
+
+    monkeypatch.setattr(gridsearch, 'store_configurations', killed)
+    with pytest.raises(Killed):
+        gridsearch.main('Letzkus', 'Claire', True, 0, False, 0, 'numpy', screen=True)
+    written = rows(database)
+    assert 8 < len(written) < 16
+
+    # The restarted job only simulates the configurations that are missing
+    monkeypatch.setattr(gridsearch, 'store_configurations', store)
+    gridsearch.main('Letzkus', 'Claire', True, 0, False, 0, 'numpy', screen=True)
+    written = rows(database)
+    assert len(written) == 16
+    assert len(set(written)) == 16
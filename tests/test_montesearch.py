@@ -0,0 +1,54 @@
+"""
+    Pruning Monte-Carlo steps against the acceptance bound.
+"""
+
+import random
+import builtins
+import warnings
+
+import numpy as np
+import pytest
+
+import montesearch
+
+warnings.resetwarnings()
+
+# Single parameter varied along a line, on which the walk regularly gets stuck and restarts from a random configuration
+Space = {"montesearch": {"Claire_noveto": {"0": {
+    "step": 1,
+    "parameters": [["Theta_high", 0, 200], ["Theta_low", 1, 1], ["A_LTP", 1, 1], ["A_LTD", 1, 1],
+                   ["tau_lowpass1", 1, 1], ["tau_lowpass2", 1, 1], ["tau_x", 1, 1]],
+    "fixed": [["Theta_low", 1, 1, 1], ["A_LTP", 1, 1, 1], ["A_LTD", 1, 1, 1], ["tau_lowpass1", 1, 1, 1],
+              ["tau_lowpass2", 1, 1, 1], ["tau_x", 1, 1, 1]]}}}}
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_lower_bounds_never_accepted(workdir, monkeypatch, capsys):
+    # Reproducible walk of 2000 iterations
+    workdir(Space)
+    seed = random.seed
+    monkeypatch.setattr(random, 'seed', lambda *args: seed(0))
+    monkeypatch.setattr(montesearch, 'range', lambda *args: builtins.range(*args[:-1], min(args[-1], 2000)),
+                        raising=False)
+
+    # Losses drawn at random, configurations whose loss exceeds the bound being abandoned with a lower bound of their
+    # loss above the bound
+    losses = random.Random(1)
+    bounds = set()
+
+    def bounded_losses(simulate_traces, protocol_type, nrconfigs, bound, order):
+        loss = losses.uniform(1., 100.)
+        complete = bound is None or loss <= bound
+        if not complete:
+            loss = (bound + loss) / 2.
+            bounds.add(loss)
+        return np.array([[np.sqrt(loss)]]), np.zeros((1, 1)), [complete]
+
+    monkeypatch.setattr(montesearch, 'bounded_losses', bounded_losses)
+    montesearch.main('Letzkus', 'Claire', False, False, 0, None, True, 0, 'numpy', prune=True)
+
+    # Scores of the current configuration after each step
+    output = capsys.readouterr().out
+    scores = [float(line.split('=')[1]) for line in output.splitlines() if 'Score = ' in line]
+    assert len(bounds) > 0
+    assert len(set(scores) & bounds) == 0